@@ -0,0 +1,62 @@
+'''
+The shared imports of the algorithms and their helpers, loaded on first use.
+
+An algorithm file used to start with import clr, import decimal as d and often pandas and
+numpy, which a short lived process (a sweep worker, a backtest node) pays for before
+Initialize even when the modules are only needed at a roll or by a warm-up. The modules
+here are registered at import and only executed the first time one of their attributes is
+read, after which they are plain modules with no per access cost:
+
+    from AlgorithmBase import *         # d, np, pd, datetime, timedelta
+
+    class MyAlgorithm(QCAlgorithm):
+        def Initialize(self):
+            ...
+        def OnRoll(self):
+            history = self.History(...)      # pandas is loaded here, if nothing loaded it earlier
+            closes = np.asarray(history['close'])
+
+A module imported elsewhere before (numpy by the data reader) is returned as is. The LEAN
+names (QCAlgorithm, Resolution, TimeSpan, ...) are injected into the algorithm module by the
+platform and by LocalReplay, so the algorithms need no clr or QuantConnect imports for
+them. StartupBenchmark measures the import cost of each algorithm.
+'''
+
+import importlib.util
+import sys
+from datetime import datetime, timedelta
+
+
+def lazy_import(name):
+    '''The module of a name, imported now if it already was and otherwise on first use.'''
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError('No module named {!r}'.format(name), name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+def is_loaded(name):
+    '''Whether a module has been executed, rather than only registered by lazy_import().'''
+    module = sys.modules.get(name)
+    return module is not None and not isinstance(module, importlib.util._LazyModule)
+
+
+def order_fee(order_event):
+    '''The fee of an order event as a number: an OrderFee in LEAN, a number locally.'''
+    fee = order_event.OrderFee
+    return getattr(getattr(fee, 'Value', fee), 'Amount', fee) or 0.0
+
+
+d = lazy_import('decimal')
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+__all__ = ['d', 'np', 'pd', 'datetime', 'timedelta', 'lazy_import']
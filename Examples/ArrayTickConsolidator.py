@@ -0,0 +1,461 @@
+'''
+Array backed tick bar consolidator.
+
+Quote prices are written into preallocated bid/ask buffers instead of being aggregated into a
+bar object one tick at a time. A bar is closed by reducing the buffers once it has enough
+quotes (count bars), enough traded quantity (volume bars) or a wide enough mid price range
+(range bars). Given the quote type, trade ticks only add their quantity to the volume. Completed
+bars are written into a reusable struct-of-arrays batch that is handed to the DataConsolidated
+handlers once it holds batch_size bars, and at the end of every update_ticks() call, so a
+handler gets the bars a slice completed as columns without building an object per bar:
+
+    consolidator = ArrayTickConsolidator(512, batch_size=64, quote_type=TickType.Quote)
+    consolidator.DataConsolidated += self.OnBars        # handler(consolidator, batch)
+    ...
+    consolidator.update_ticks(slice.Ticks[symbol])      # a call per slice
+
+for_each_bar() adapts a handler of single TickBars. update_many() consolidates whole arrays of
+ticks at once, which is the fast path for research and warm-up.
+'''
+
+from AlgorithmBase import np
+
+
+COUNT = 'count'
+VOLUME = 'volume'
+RANGE = 'range'
+
+
+class ConsolidatedEvent:
+    '''Handler list supporting `event += handler` and `event -= handler`.'''
+    __slots__ = ('handlers',)
+
+    def __init__(self):
+        self.handlers = []
+
+    def __iadd__(self, handler):
+        self.handlers.append(handler)
+        return self
+
+    def __isub__(self, handler):
+        if handler in self.handlers:
+            self.handlers.remove(handler)
+        return self
+
+    def __call__(self, sender, data):
+        for handler in self.handlers:
+            handler(sender, data)
+
+
+class Bar:
+    __slots__ = ('Open', 'High', 'Low', 'Close')
+
+    def __init__(self, open, high, low, close):
+        self.Open = open
+        self.High = high
+        self.Low = low
+        self.Close = close
+
+    def __str__(self):
+        return 'O: {} H: {} L: {} C: {}'.format(self.Open, self.High, self.Low, self.Close)
+
+
+class TickBar:
+    '''A single consolidated bar with the members of a QuoteBar.'''
+    __slots__ = ('Symbol', 'Time', 'EndTime', 'Bid', 'Ask', 'LastBidSize', 'LastAskSize', 'Volume', 'TickCount')
+
+    def __init__(self, symbol, time, end_time, bid, ask, last_bid_size, last_ask_size, volume, tick_count):
+        self.Symbol = symbol
+        self.Time = time
+        self.EndTime = end_time
+        self.Bid = bid
+        self.Ask = ask
+        self.LastBidSize = last_bid_size
+        self.LastAskSize = last_ask_size
+        self.Volume = volume
+        self.TickCount = tick_count
+
+    @property
+    def Open(self):
+        return (self.Bid.Open + self.Ask.Open) / 2.0
+
+    @property
+    def High(self):
+        return (self.Bid.High + self.Ask.High) / 2.0
+
+    @property
+    def Low(self):
+        return (self.Bid.Low + self.Ask.Low) / 2.0
+
+    @property
+    def Close(self):
+        return (self.Bid.Close + self.Ask.Close) / 2.0
+
+    Value = Close
+    Price = Close
+
+    def __str__(self):
+        return '{}: Bid: {} Ask: {}'.format(self.Symbol, self.Bid, self.Ask)
+
+
+class TickBarBatch:
+    '''
+    Completed bars in struct-of-arrays form. Only the first count entries are valid and the
+    arrays are overwritten after the handlers return, so handlers must copy what they keep.
+    '''
+    FIELDS = ('bid_open', 'bid_high', 'bid_low', 'bid_close', 'ask_open', 'ask_high', 'ask_low', 'ask_close',
+              'last_bid_size', 'last_ask_size', 'volume')
+
+    def __init__(self, capacity):
+        self.symbol = None
+        self.count = 0
+        self.capacity = capacity
+        self.start_time = np.empty(capacity, dtype='datetime64[ns]')
+        self.end_time = np.empty(capacity, dtype='datetime64[ns]')
+        self.ticks = np.zeros(capacity, dtype=np.int64)
+        for name in self.FIELDS:
+            setattr(self, name, np.zeros(capacity))
+
+    @property
+    def close(self):
+        n = self.count
+        return (self.bid_close[:n] + self.ask_close[:n]) * 0.5
+
+    def bar(self, i):
+        '''Bar i of the batch as a TickBar.'''
+        bo, bh, bl, bc, ao, ah, al, ac, bs, as_, v = (getattr(self, name)[i].item() for name in self.FIELDS)
+        start = self.start_time[i].astype('datetime64[us]').item()
+        end = self.end_time[i].astype('datetime64[us]').item()
+        return TickBar(self.symbol, start, end, Bar(bo, bh, bl, bc), Bar(ao, ah, al, ac), bs, as_, v,
+                       int(self.ticks[i]))
+
+    def bars(self):
+        '''The batch as TickBar objects.'''
+        n = self.count
+        columns = [getattr(self, name)[:n].tolist() for name in self.FIELDS]
+        starts = self.start_time[:n].astype('datetime64[us]').tolist()
+        ends = self.end_time[:n].astype('datetime64[us]').tolist()
+        ticks = self.ticks[:n].tolist()
+        for i in range(n):
+            bo, bh, bl, bc, ao, ah, al, ac, bs, as_, v = (c[i] for c in columns)
+            yield TickBar(self.symbol, starts[i], ends[i], Bar(bo, bh, bl, bc), Bar(ao, ah, al, ac), bs, as_, v,
+                          ticks[i])
+
+    def __len__(self):
+        return self.count
+
+
+def for_each_bar(handler):
+    '''Adapts a per-bar handler(sender, bar) to the batches emitted by ArrayTickConsolidator.'''
+    def on_batch(sender, batch):
+        for bar in batch.bars():
+            handler(sender, bar)
+    return on_batch
+
+
+class ArrayTickConsolidator:
+    '''
+    Consolidates quote ticks into count, volume or range bars.
+
+    size is the number of quote ticks per bar (COUNT), the traded quantity per bar (VOLUME) or
+    the mid price range that closes a bar (RANGE). If quote_type (TickType.Quote) is given, only
+    the ticks of that type add their prices to a bar and the others (trades) only add their
+    Quantity to its volume; otherwise every tick is taken as a quote. capacity is the initial
+    size of the working bar buffers, which double when a bar outgrows them.
+    '''
+
+    def __init__(self, size, mode=COUNT, batch_size=1, quote_type=None, capacity=None):
+        if mode not in (COUNT, VOLUME, RANGE):
+            raise ValueError('Unknown bar mode: {}'.format(mode))
+        self.size = size
+        self.mode = mode
+        self.quote_type = quote_type
+        self.DataConsolidated = ConsolidatedEvent()
+        self.batch = TickBarBatch(batch_size)
+
+        # the quote prices of the working bar, preallocated so adding a tick is a store
+        capacity = capacity or (size if mode == COUNT else 1024)
+        self._bid = np.zeros(capacity)
+        self._ask = np.zeros(capacity)
+        self._n = 0
+        self._start = None
+        self._end = None
+        self._last_bid_size = 0.0
+        self._last_ask_size = 0.0
+        self._volume = 0.0
+        self._high = 0.0
+        self._low = 0.0
+
+    @property
+    def WorkingCount(self):
+        return self._n
+
+    def _grow(self, capacity):
+        n = self._n
+        for name in ('_bid', '_ask'):
+            column = np.zeros(capacity)
+            column[:n] = getattr(self, name)[:n]
+            setattr(self, name, column)
+
+    def Update(self, tick):
+        '''Adds a single tick, closing the working bar when it is complete.'''
+        self.update_ticks((tick,))
+
+    def update_ticks(self, ticks):
+        '''
+        Adds the ticks of a slice, slice.Ticks[symbol], in one call. The bars they complete are
+        handed to the handlers at the end of the call, as a batch.
+        '''
+        quote_type = self.quote_type
+        mode = self.mode
+        size = self.size
+        bids = self._bid
+        asks = self._ask
+        capacity = len(bids)
+        n = self._n
+        volume = self._volume
+        start = self._start
+        last = None
+        for tick in ticks:
+            if start is None:
+                start = tick.Time
+            if quote_type is not None and tick.TickType != quote_type:
+                # a trade only adds its size, the bar closes on it once it has a quote
+                volume += tick.Quantity
+                if mode != VOLUME or not n or volume < size:
+                    continue
+            else:
+                if n == capacity:
+                    self._n = n
+                    self._grow(2 * capacity)
+                    bids = self._bid
+                    asks = self._ask
+                    capacity = len(bids)
+                bid = tick.BidPrice
+                ask = tick.AskPrice
+                bids[n] = bid
+                asks[n] = ask
+                n += 1
+                last = tick
+                volume += tick.Quantity
+
+                if mode == COUNT:
+                    if n < size:
+                        continue
+                elif mode == VOLUME:
+                    if volume < size:
+                        continue
+                else:
+                    mid = (bid + ask) * 0.5
+                    if n == 1:
+                        self._high = self._low = mid
+                    elif mid > self._high:
+                        self._high = mid
+                    elif mid < self._low:
+                        self._low = mid
+                    if self._high - self._low < size:
+                        continue
+            if last is not None:
+                self._last_quote(last)
+                last = None
+            self._n = n
+            self._start = start
+            self._end = tick.Time
+            self._volume = volume
+            self._close_working()
+            n = 0
+            volume = 0.0
+            start = None
+        self._n = n
+        self._start = start
+        self._volume = volume
+        if last is not None:
+            self._last_quote(last)
+        if self.batch.count:
+            self.Flush()
+
+    def _last_quote(self, tick):
+        self.batch.symbol = tick.Symbol
+        self._last_bid_size = tick.BidSize
+        self._last_ask_size = tick.AskSize
+
+    def update_many(self, times, bid, ask, bid_size, ask_size, quantity=None, symbol=None, quote=None):
+        '''
+        Consolidates arrays of ticks. Bar boundaries are found with vector operations (and a
+        search per bar for volume and range bars), and the bars are aggregated with reduceat.
+        quote, a boolean array, marks the quotes if the arrays also hold trades: the prices of
+        a bar come from its quotes and its volume from the quantity of all its ticks.
+        '''
+        if len(times) == 0:
+            return
+        if symbol is not None:
+            self.batch.symbol = symbol
+        times = np.asarray(times, dtype='datetime64[ns]')
+        bid = np.asarray(bid, dtype=np.float64)
+        ask = np.asarray(ask, dtype=np.float64)
+        bid_size = np.asarray(bid_size, dtype=np.float64)
+        ask_size = np.asarray(ask_size, dtype=np.float64)
+        quantity = np.zeros(len(times)) if quantity is None else np.asarray(quantity, dtype=np.float64)
+        quote = np.ones(len(times), dtype=bool) if quote is None else np.asarray(quote, dtype=bool)
+
+        # the working bar's quotes ahead of the new ticks
+        pending = self._n
+        if pending:
+            bid = np.concatenate((self._bid[:pending], bid))
+            ask = np.concatenate((self._ask[:pending], ask))
+            quantity = np.r_[np.zeros(pending), quantity]
+            quote = np.r_[np.ones(pending, dtype=bool), quote]
+        quotes = np.flatnonzero(quote)
+        # running volume, including what the working bar already traded
+        volume = np.cumsum(quantity)
+        volume += self._volume
+        ends = self._bar_ends(bid, ask, volume, quotes)
+
+        consumed = 0
+        if len(ends):
+            starts = np.r_[0, ends[:-1]]
+            # the quotes of each bar, a bar always has at least one
+            first = np.searchsorted(quotes, starts)
+            stop = np.searchsorted(quotes, ends)
+            qbid = bid[quotes[:stop[-1]]]
+            qask = ask[quotes[:stop[-1]]]
+            bars = (qbid[first], np.maximum.reduceat(qbid, first), np.minimum.reduceat(qbid, first), qbid[stop - 1],
+                    qask[first], np.maximum.reduceat(qask, first), np.minimum.reduceat(qask, first), qask[stop - 1])
+            # positions in the incoming arrays, bars never end within the pending quotes
+            last_quotes = quotes[stop - 1] - pending
+            in_pending = last_quotes < 0
+            last_bid_size = np.where(in_pending, self._last_bid_size, bid_size[np.maximum(last_quotes, 0)])
+            last_ask_size = np.where(in_pending, self._last_ask_size, ask_size[np.maximum(last_quotes, 0)])
+            start_times = times[np.maximum(starts - pending, 0)]
+            if self._start is not None:
+                start_times[0] = np.datetime64(self._start, 'ns')
+            end_times = times[ends - 1 - pending]
+            volumes = np.diff(np.r_[0.0, volume[ends - 1]])
+            self._write(start_times, end_times, bars, last_bid_size, last_ask_size, volumes, stop - first)
+            consumed = int(ends[-1])
+
+        # keep the quotes of the unfinished bar
+        total = len(bid)
+        rest = quotes[np.searchsorted(quotes, consumed):]
+        self._n = 0
+        if len(rest) > len(self._bid):
+            self._grow(2 * len(rest))
+        self._bid[:len(rest)] = bid[rest]
+        self._ask[:len(rest)] = ask[rest]
+        self._n = len(rest)
+        self._volume = float(volume[-1] - (volume[consumed - 1] if consumed else 0.0))
+        if consumed == total:
+            self._start = None
+            self._volume = 0.0
+        elif consumed or self._start is None:
+            self._start = times[consumed - pending if consumed else 0].astype('datetime64[us]').item()
+        if consumed < total:
+            self._end = times[-1].astype('datetime64[us]').item()
+        if len(rest):
+            position = rest[-1] - pending
+            if position >= 0:
+                self._last_bid_size = float(bid_size[position])
+                self._last_ask_size = float(ask_size[position])
+            mid = (bid[rest] + ask[rest]) * 0.5
+            self._high = float(mid.max())
+            self._low = float(mid.min())
+
+    def _bar_ends(self, bid, ask, volume, quotes):
+        '''Exclusive end index of every bar completed in the joined arrays.'''
+        total = len(bid)
+        if self.mode == COUNT:
+            return quotes[self.size - 1::self.size] + 1
+
+        ends = []
+        if self.mode == VOLUME:
+            base = 0.0
+            start = 0
+            while True:
+                idx = int(np.searchsorted(volume, base + self.size, 'left'))
+                if idx >= total:
+                    break
+                # a bar closes on the tick reaching its volume once it has a quote
+                first = np.searchsorted(quotes, start)
+                if first == len(quotes):
+                    break
+                idx = max(idx, int(quotes[first]))
+                ends.append(idx + 1)
+                base = volume[idx]
+                start = idx + 1
+            return np.array(ends, dtype=np.int64)
+
+        mid = (bid[quotes] + ask[quotes]) * 0.5
+        start = 0
+        count = len(mid)
+        while start < count:
+            window = 64
+            found = -1
+            while True:
+                stop = min(start + window, count)
+                segment = mid[start:stop]
+                width = np.maximum.accumulate(segment) - np.minimum.accumulate(segment)
+                hit = np.flatnonzero(width >= self.size)
+                if len(hit):
+                    found = start + int(hit[0])
+                    break
+                if stop == count:
+                    break
+                window *= 4
+            if found < 0:
+                break
+            ends.append(int(quotes[found]) + 1)
+            start = found + 1
+        return np.array(ends, dtype=np.int64)
+
+    def _close_working(self):
+        n = self._n
+        bid = self._bid[:n]
+        ask = self._ask[:n]
+        batch = self.batch
+        i = batch.count
+        batch.start_time[i] = self._start
+        batch.end_time[i] = self._end
+        batch.bid_open[i] = bid[0]
+        batch.bid_high[i] = bid.max()
+        batch.bid_low[i] = bid.min()
+        batch.bid_close[i] = bid[n - 1]
+        batch.ask_open[i] = ask[0]
+        batch.ask_high[i] = ask.max()
+        batch.ask_low[i] = ask.min()
+        batch.ask_close[i] = ask[n - 1]
+        batch.last_bid_size[i] = self._last_bid_size
+        batch.last_ask_size[i] = self._last_ask_size
+        batch.volume[i] = self._volume
+        batch.ticks[i] = n
+        batch.count = i + 1
+        self._n = 0
+        self._start = None
+        self._volume = 0.0
+        if batch.count == batch.capacity:
+            self.Flush()
+
+    def _write(self, start_times, end_times, bars, last_bid_size, last_ask_size, volumes, ticks):
+        batch = self.batch
+        total = len(end_times)
+        done = 0
+        while done < total:
+            i = batch.count
+            k = min(batch.capacity - i, total - done)
+            batch.start_time[i:i + k] = start_times[done:done + k]
+            batch.end_time[i:i + k] = end_times[done:done + k]
+            for name, values in zip(TickBarBatch.FIELDS[:8], bars):
+                getattr(batch, name)[i:i + k] = values[done:done + k]
+            batch.last_bid_size[i:i + k] = last_bid_size[done:done + k]
+            batch.last_ask_size[i:i + k] = last_ask_size[done:done + k]
+            batch.volume[i:i + k] = volumes[done:done + k]
+            batch.ticks[i:i + k] = ticks[done:done + k]
+            batch.count = i + k
+            done += k
+            if batch.count == batch.capacity:
+                self.Flush()
+
+    def Flush(self):
+        '''Hands the completed bars to the handlers, even if the batch is not full.'''
+        if self.batch.count:
+            self.DataConsolidated(self, self.batch)
+            self.batch.count = 0
@@ -0,0 +1,194 @@
+'''
+Memory-mapped columnar store of bars, one folder of raw column files per contract and resolution.
+
+    <store>/<ticker>/contracts.csv
+    <store>/<ticker>/<resolution>/<symbol>/time.i8      int64 bar end times, ns since the epoch
+    <store>/<ticker>/<resolution>/<symbol>/open.f8      float64, and likewise high, low, close, volume
+
+The time column is the index: range reads are two binary searches and return read-only
+views of the mapped files, so a warm-up or a notebook only pages in the rows it touches.
+New bars are appended to the end of the files. A BarStore is a LocalDataFolder, so it can
+be given to LocalReplay in place of the csv folder it was built from:
+
+    python BarStore.py ~/data ~/store       # build, or append what is new since the last run
+    python LocalReplay.py FuturesMovingAverageCrossOverExample2.py --data ~/store --store
+'''
+
+import argparse
+import io
+import os
+import shutil
+
+import numpy as np
+
+from LocalReplay import BAR_COLUMNS, LocalDataFolder, read_chunks, to_ns
+from LocalLean import RESOLUTION_NAMES, RESOLUTION_PERIODS, Resolution
+
+
+COLUMNS = ('time',) + BAR_COLUMNS
+EXTENSIONS = {'time': '.i8', 'open': '.f8', 'high': '.f8', 'low': '.f8', 'close': '.f8', 'volume': '.f8'}
+DTYPES = {'.i8': np.int64, '.f8': np.float64}
+
+
+def _map(path, dtype):
+    # a torn append can leave part of a row at the end, which is ignored
+    n = os.path.getsize(path) // np.dtype(dtype).itemsize if os.path.exists(path) else 0
+    if n == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', shape=(n,))
+
+
+class BarSeries:
+    '''The mapped columns of one contract at one resolution.'''
+    __slots__ = ('folder', 'times', 'open', 'high', 'low', 'close', 'volume')
+
+    def __init__(self, folder):
+        self.folder = folder
+        columns = [_map(os.path.join(folder, c + EXTENSIONS[c]), DTYPES[EXTENSIONS[c]]) for c in COLUMNS]
+        # the time column is written last when appending, so it bounds the complete rows
+        n = min(len(c) for c in columns)
+        self.times, self.open, self.high, self.low, self.close, self.volume = (c[:n] for c in columns)
+
+    def __len__(self):
+        return len(self.times)
+
+    def rows(self, lo, hi):
+        return (self.times[lo:hi], self.open[lo:hi], self.high[lo:hi], self.low[lo:hi], self.close[lo:hi],
+                self.volume[lo:hi])
+
+    def range(self, start=None, end=None):
+        '''Views of the bars with end times in [start, end].'''
+        lo = 0 if start is None else np.searchsorted(self.times, to_ns(start), 'left')
+        hi = len(self.times) if end is None else np.searchsorted(self.times, to_ns(end), 'right')
+        return self.rows(lo, max(lo, hi))
+
+    def tail(self, n, end=None):
+        '''Views of the last n bars ending at or before end.'''
+        hi = len(self.times) if end is None else np.searchsorted(self.times, to_ns(end), 'right')
+        return self.rows(max(0, hi - n), hi)
+
+    @property
+    def last_time(self):
+        return int(self.times[-1]) if len(self.times) else None
+
+
+class BarStore(LocalDataFolder):
+    '''
+    Bar series stored as memory-mapped column files. Series are mapped on first use and
+    remapped after an append. Tick data is not stored.
+    '''
+
+    def __init__(self, root):
+        LocalDataFolder.__init__(self, root)
+        self._series = dict()
+
+    def folder(self, ticker, resolution, value):
+        return os.path.join(self.root, ticker.lower(), RESOLUTION_NAMES[resolution], value)
+
+    def path(self, ticker, resolution, value):
+        folder = self.folder(ticker, resolution, value)
+        return folder if os.path.exists(os.path.join(folder, 'time.i8')) else None
+
+    def series(self, ticker, resolution, value):
+        '''The BarSeries of a contract, or None if it isn't stored.'''
+        key = (ticker.lower(), resolution, value)
+        series = self._series.get(key)
+        if series is None:
+            folder = self.path(ticker, resolution, value)
+            if folder is None:
+                return None
+            series = self._series[key] = BarSeries(folder)
+        return series
+
+    def chunks(self, symbol, resolution, start=None, end=None):
+        series = self.series(symbol.ID.Symbol, resolution, symbol.Value)
+        if series is None or resolution == Resolution.Tick:
+            return iter(())
+        rows = series.range(start, end)
+        return iter([rows] if len(rows[0]) else [])
+
+    def append(self, ticker, resolution, value, times, open, high, low, close, volume):
+        '''
+        Appends bars given by their end times in ns. Bars that don't end after the last stored
+        bar are skipped, so appending overlapping data is safe. Returns the number of new bars.
+        '''
+        times = np.asarray(times, dtype=np.int64)
+        folder = self.folder(ticker, resolution, value)
+        series = self.series(ticker, resolution, value)
+        last = None if series is None else series.last_time
+        lo = 0 if last is None else np.searchsorted(times, last, 'right')
+        if lo >= len(times):
+            return 0
+
+        os.makedirs(folder, exist_ok=True)
+        self._series.pop((ticker.lower(), resolution, value), None)
+        rows = self._truncate(folder)
+        columns = dict(time=times, open=open, high=high, low=low, close=close, volume=volume)
+        # values first and times last, so readers never see a time without its bar
+        for name in BAR_COLUMNS + ('time',):
+            extension = EXTENSIONS[name]
+            with io.open(os.path.join(folder, name + extension), 'r+b' if rows else 'wb') as f:
+                f.seek(rows * np.dtype(DTYPES[extension]).itemsize)
+                np.asarray(columns[name][lo:], dtype=DTYPES[extension]).tofile(f)
+        return len(times) - lo
+
+    @staticmethod
+    def _truncate(folder):
+        '''
+        Cuts the columns of a series back to its complete rows, the rows of its time column, and
+        returns their number. An append that was interrupted after writing some value columns
+        leaves rows past the times, and the next append would be written after them.
+        '''
+        time = os.path.join(folder, 'time.i8')
+        rows = os.path.getsize(time) // 8 if os.path.exists(time) else 0
+        for name in COLUMNS:
+            path = os.path.join(folder, name + EXTENSIONS[name])
+            size = rows * np.dtype(DTYPES[EXTENSIONS[name]]).itemsize
+            if os.path.exists(path) and os.path.getsize(path) != size:
+                os.truncate(path, size)
+        return rows
+
+    def ingest(self, source):
+        '''
+        Appends the bars of every file of a LocalDataFolder (or its path) that are newer than
+        what is stored, and copies its contracts lists. Returns the number of new bars.
+        '''
+        if not isinstance(source, LocalDataFolder):
+            source = LocalDataFolder(source)
+        added = 0
+        for ticker in sorted(os.listdir(source.root)):
+            if not os.path.isdir(os.path.join(source.root, ticker)):
+                continue
+            contracts = os.path.join(source.root, ticker, 'contracts.csv')
+            if os.path.exists(contracts):
+                os.makedirs(os.path.join(self.root, ticker), exist_ok=True)
+                shutil.copyfile(contracts, os.path.join(self.root, ticker, 'contracts.csv'))
+                self._contracts.pop(ticker, None)
+            for resolution, name in RESOLUTION_NAMES.items():
+                files = os.path.join(source.root, ticker, name)
+                if resolution == Resolution.Tick or not os.path.isdir(files):
+                    continue
+                for file_name in sorted(os.listdir(files)):
+                    value, extension = os.path.splitext(file_name)
+                    if extension not in ('.csv', '.parquet'):
+                        continue
+                    series = self.series(ticker, resolution, value)
+                    last = None if series is None else series.last_time
+                    start = None if last is None else np.datetime64(last + 1, 'ns')
+                    for chunk in read_chunks(os.path.join(files, file_name), BAR_COLUMNS,
+                                             RESOLUTION_PERIODS[resolution], start):
+                        added += self.append(ticker, resolution, value, *chunk)
+        return added
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build or update a bar store from a local data folder.')
+    parser.add_argument('data', help='local data folder of csv or parquet files')
+    parser.add_argument('store', help='bar store folder')
+    args = parser.parse_args(argv)
+    added = BarStore(args.store).ingest(args.data)
+    print('{} new bars'.format(added))
+
+
+if __name__ == '__main__':
+    main()
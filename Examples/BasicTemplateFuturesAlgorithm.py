@@ -1,5 +1,4 @@
-import clr
-import decimal as d
+from AlgorithmBase import *
 
 
 class BasicTemplateFuturesAlgorithm(QCAlgorithm):
@@ -0,0 +1,359 @@
+'''
+Reproducible benchmarks of the example algorithms over synthetic ES futures data.
+
+generate() writes a data folder that only depends on its settings: the quarterly ES
+contracts around the period with their expiries, 24 hour weekday minute bars of every
+contract in its last 200 days, priced off one seeded random walk with a carry so the chain
+rolls like the real one, and quote ticks of the same contracts over the last tick_days. The
+folder is named after the settings and reused by later runs.
+
+Every case replays an algorithm over the folder with LocalReplay, each run in a fresh
+process, and reports
+
+    events/sec      rows replayed per second of the replay loop
+    latency         percentiles per event of the time of the step that delivers it, measured
+                    between OnData calls (so including the merge of a day's data)
+    peak RSS        of the process
+
+as the median of repeat runs, with the events and the net profit of the run, which a change
+that is only meant to be faster must not change. --save writes the results as a baseline
+and --baseline compares with one: a case regresses when its throughput, median or p99
+latency or peak RSS is worse by more than the tolerance, or its events or net profit
+differ, and the exit status is then 1:
+
+    python Examples/BenchmarkSuite.py --save ~/bench/baseline.json
+    python Examples/BenchmarkSuite.py --baseline ~/bench/baseline.json --case multiple --repeat 5
+'''
+
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import time as timer
+from datetime import datetime, timedelta
+
+from AlgorithmBase import np, pd
+from HandlerProfiler import Histogram, format_ns
+from LocalReplay import LocalReplay, load_algorithm, to_ns
+
+
+FOLDER = os.path.dirname(os.path.abspath(__file__))
+
+MINUTE = 'minute'
+TICK = 'tick'
+
+# case -> algorithm file, the data it runs on and its parameters
+CASES = {
+    'rollover': ('FuturesContractRollover.py', MINUTE, {}),
+    'crossover': ('FuturesMovingAverageCrossOverExample2.py', MINUTE, {}),
+    'multiple': ('MultipleSymbolConsolidationAlgorithm.py', MINUTE, {}),
+    'tick_chart': ('FuturesTickChartExample.py', TICK, {}),
+    'long': ('FuturesLongExample.py', MINUTE, {}),
+}
+
+# metric -> whether higher is better
+COMPARED = (('rate', True), ('p50', False), ('p99', False), ('rss', False))
+PERCENTILES = (('p50', 50), ('p90', 90), ('p99', 99), ('p999', 99.9))
+
+MONTH_CODES = {3: 'H', 6: 'M', 9: 'U', 12: 'Z'}
+TICK_SIZE = 0.25
+LISTED_DAYS = 200       # days before expiry a contract has data
+
+
+# Synthetic data
+
+class Settings:
+    '''The settings a data folder is generated from.'''
+
+    def __init__(self, start=datetime(2019, 2, 1), days=60, tick_days=2, ticks_per_minute=60, seed=7):
+        self.start = start
+        self.days = days
+        self.tick_days = tick_days
+        self.ticks_per_minute = ticks_per_minute
+        self.seed = seed
+
+    @property
+    def end(self):
+        return self.start + timedelta(days=self.days)
+
+    @property
+    def name(self):
+        return 'es-{:%Y%m%d}-{}d-{}t{}-s{}'.format(self.start, self.days, self.tick_days, self.ticks_per_minute,
+                                                  self.seed)
+
+    def as_dict(self):
+        return dict(start=self.start.isoformat(), days=self.days, tick_days=self.tick_days,
+                    ticks_per_minute=self.ticks_per_minute, seed=self.seed)
+
+
+def expiry(year, month):
+    '''The expiry of the ES contract of a month: the third Friday at 13:30.'''
+    first = datetime(year, month, 1, 13, 30)
+    return first + timedelta(days=(4 - first.weekday()) % 7 + 14)
+
+
+def contracts(start, end):
+    '''(symbol, expiry) of the quarterly contracts trading between start and end, and those a year out.'''
+    listed = []
+    year, month = start.year - 1, 3
+    while True:
+        e = expiry(year, month)
+        if e > end + timedelta(days=400):
+            return listed
+        if e > start - timedelta(days=100):
+            listed.append(('ES{}{:02d}'.format(MONTH_CODES[month], year % 100), e))
+        year, month = (year + 1, 3) if month == 12 else (year, month + 3)
+
+
+def _minutes(start, end):
+    '''The start times (ns) of the minutes of the weekdays in [start, end).'''
+    days = [start + timedelta(days=i) for i in range((end - start).days)]
+    days = np.array([to_ns(day) for day in days if day.weekday() < 5], dtype=np.int64)
+    return (days[:, None] + np.arange(1440, dtype=np.int64) * 60 * 10 ** 9).ravel()
+
+
+def _ticks(price, step=TICK_SIZE):
+    return np.round(price / step) * step
+
+
+def generate(folder, settings):
+    '''Writes the data folder of settings, unless it is already complete. Returns its path.'''
+    path = os.path.join(os.path.expanduser(folder), settings.name)
+    marker = os.path.join(path, 'settings.json')
+    if os.path.exists(marker):
+        return path
+    rng = np.random.default_rng(settings.seed)
+    root = os.path.join(path, 'es')
+    for sub in (MINUTE, TICK):
+        os.makedirs(os.path.join(root, sub), exist_ok=True)
+
+    listed = contracts(settings.start, settings.end)
+    with open(os.path.join(root, 'contracts.csv'), 'w') as f:
+        f.write('symbol,expiry\n')
+        f.writelines('{},{:%Y-%m-%d %H:%M}\n'.format(symbol, e) for symbol, e in listed)
+
+    # one random walk with a drift that changes every day, so the averages cross
+    times = _minutes(settings.start - timedelta(days=10), settings.end)
+    days = len(times) // 1440
+    drift = np.repeat(rng.normal(0.0, 0.004, days) / 1440, 1440)
+    spot = 2500.0 * np.exp(np.cumsum(drift + rng.normal(0.0, 0.0004, len(times))))
+    tick_start = times[-settings.tick_days * 1440] if settings.tick_days else times[-1] + 1
+
+    ns_per_year = 365 * 86400 * 10 ** 9
+    for symbol, e in listed:
+        e_ns = to_ns(e)
+        live = (times >= e_ns - LISTED_DAYS * 86400 * 10 ** 9) & (times + 60 * 10 ** 9 <= e_ns)
+        if not live.any():
+            continue
+        t = times[live]
+        close = _ticks(spot[live] * np.exp(0.02 * (e_ns - t) / ns_per_year))
+        opens = np.r_[close[0], close[:-1]]
+        high = np.maximum(opens, close) + TICK_SIZE * rng.integers(0, 3, len(t))
+        low = np.minimum(opens, close) - TICK_SIZE * rng.integers(0, 3, len(t))
+        volume = rng.integers(5, 500, len(t))
+        pd.DataFrame(dict(time=t, open=opens, high=high, low=low, close=close, volume=volume)).to_csv(
+            os.path.join(root, MINUTE, symbol + '.csv'), index=False)
+
+        ticked = t >= tick_start
+        if ticked.any():
+            n = settings.ticks_per_minute
+            minutes = np.repeat(t[ticked], n)
+            offsets = np.sort(rng.integers(0, 60 * 10 ** 9, (ticked.sum(), n)), axis=1).ravel()
+            # the mid walks from the open to the close of its minute with a tick of noise
+            weight = np.tile(np.arange(n) / n, ticked.sum())
+            mid = (np.repeat(opens[ticked], n) * (1 - weight) + np.repeat(close[ticked], n) * weight +
+                   TICK_SIZE * rng.integers(-1, 2, len(minutes)))
+            bid = np.floor(mid / TICK_SIZE) * TICK_SIZE
+            ask = bid + TICK_SIZE
+            last = np.where(rng.integers(0, 2, len(minutes)) == 1, ask, bid)
+            pd.DataFrame(dict(time=minutes + offsets, bid=bid, ask=ask, bidsize=rng.integers(1, 50, len(minutes)),
+                              asksize=rng.integers(1, 50, len(minutes)), last=last,
+                              quantity=rng.integers(1, 10, len(minutes)))).to_csv(
+                os.path.join(root, TICK, symbol + '.csv'), index=False)
+
+    with open(marker, 'w') as f:
+        json.dump(dict(settings.as_dict(), tick_start=int(tick_start)), f)
+    return path
+
+
+def case_period(data, settings, kind):
+    '''The start and end date of a case: after the warm-up days, or over the ticks.'''
+    end = settings.end - timedelta(days=1)
+    if kind == TICK:
+        with open(os.path.join(data, 'settings.json')) as f:
+            tick_start = datetime(1970, 1, 1) + timedelta(microseconds=json.load(f)['tick_start'] // 1000)
+        return datetime(tick_start.year, tick_start.month, tick_start.day), end
+    return settings.start, end
+
+
+# Runs
+
+class StepClock:
+    '''
+    Times the steps of a replay between OnData calls, each counted once per event it
+    delivered.
+    '''
+
+    def __init__(self, algorithm):
+        self.histogram = Histogram()
+        self.last = None
+        on_data = algorithm.OnData
+        clock = timer.perf_counter_ns
+        histogram = self.histogram
+
+        def OnData(slice):
+            on_data(slice)
+            now = clock()
+            if self.last is not None:
+                events = len(slice.Bars)
+                for ticks in slice.Ticks.values():
+                    events += len(ticks)
+                histogram.add_repeated(now - self.last, events)
+            self.last = now
+
+        algorithm.OnData = OnData
+
+
+def peak_rss():
+    '''The peak resident set size of this process in bytes.'''
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def run_case(task):
+    '''Replays one case in this process and returns its figures.'''
+    name, data, start, end = task
+    path, _, parameters = CASES[name]
+    replay = LocalReplay(load_algorithm(os.path.join(FOLDER, path)), data, dict(parameters))
+    clock = StepClock(replay.algorithm)
+    algorithm = replay.run(start, end)
+    histogram = clock.histogram
+    result = dict(events=replay.events, steps=replay.steps, seconds=replay.elapsed,
+                  rate=replay.events / replay.elapsed if replay.elapsed else 0.0,
+                  net_profit=round(algorithm.Portfolio.TotalNetProfit, 2), max=histogram.max, rss=peak_rss())
+    for key, p in PERCENTILES:
+        result[key] = histogram.percentile(p)
+    return result
+
+
+def benchmark(names, data, settings, repeat=3):
+    '''The median figures of repeat runs of each case, every run in a fresh process.'''
+    tasks = []
+    for name in names:
+        start, end = case_period(data, settings, CASES[name][1])
+        tasks.extend([(name, data, start, end)] * repeat)
+    with multiprocessing.get_context('spawn').Pool(1, maxtasksperchild=1) as pool:
+        runs = pool.map(run_case, tasks, chunksize=1)
+
+    results = dict()
+    for i, name in enumerate(names):
+        mine = runs[i * repeat:(i + 1) * repeat]
+        result = {key: statistics.median(r[key] for r in mine) for key in mine[0]}
+        # the outcome of a run is the same every time, or the comparison would catch it
+        result['events'] = mine[0]['events']
+        result['net_profit'] = mine[0]['net_profit']
+        result['deterministic'] = all((r['events'], r['net_profit']) == (mine[0]['events'], mine[0]['net_profit'])
+                                      for r in mine)
+        results[name] = result
+    return results
+
+
+# Baselines
+
+def compare(results, baseline, tolerance=0.1):
+    '''(case, message) of every regression of results against a baseline's.'''
+    regressions = []
+    for name, result in results.items():
+        if not result['deterministic']:
+            regressions.append((name, 'events or net profit differ between runs'))
+        base = baseline.get(name)
+        if base is None:
+            continue
+        for key in ('events', 'net_profit'):
+            if result[key] != base[key]:
+                regressions.append((name, '{} changed: {} -> {}'.format(key, base[key], result[key])))
+        for key, higher in COMPARED:
+            change = _change(result[key], base[key])
+            if (-change if higher else change) > tolerance:
+                regressions.append((name, '{} {:+.1%} ({} -> {})'.format(key, change, _format(key, base[key]),
+                                                                          _format(key, result[key]))))
+    return regressions
+
+
+def _change(value, base):
+    return (value - base) / base if base else 0.0
+
+
+def _format(key, value):
+    if key == 'rate':
+        return '{:,.0f}/s'.format(value)
+    if key == 'rss':
+        return '{:.0f}MB'.format(value / 2 ** 20)
+    return format_ns(value)
+
+
+def report(results, baseline=None):
+    keys = ['rate', 'p50', 'p90', 'p99', 'p999', 'max', 'rss']
+    header = ['case', 'events', 'net profit'] + keys
+    lines = [header]
+    for name, r in results.items():
+        line = [name, '{:,}'.format(r['events']), '{:.2f}'.format(r['net_profit'])]
+        for key in keys:
+            cell = _format(key, r[key])
+            base = (baseline or dict()).get(name)
+            if base is not None and key in base:
+                cell += ' ({:+.0%})'.format(_change(r[key], base[key]))
+            line.append(cell)
+        lines.append(line)
+    widths = [max(len(line[i]) for line in lines) for i in range(len(header))]
+    return '\n'.join('  '.join(cell.ljust(w) if i == 0 else cell.rjust(w)
+                               for i, (cell, w) in enumerate(zip(line, widths))) for line in lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the example algorithms over synthetic ES data.')
+    parser.add_argument('--case', action='append', choices=sorted(CASES), help='case to run (all by default)')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per case, each in a fresh process')
+    parser.add_argument('--data', default=tempfile.gettempdir(), help='folder of the generated data folders')
+    parser.add_argument('--start', type=datetime.fromisoformat, default=datetime(2019, 2, 1),
+                        help='first day of the backtests')
+    parser.add_argument('--days', type=int, default=60, help='calendar days of minute bars')
+    parser.add_argument('--tick-days', type=int, default=2, help='weekdays of ticks at the end of the period')
+    parser.add_argument('--ticks-per-minute', type=int, default=60, help='ticks of each contract per minute')
+    parser.add_argument('--seed', type=int, default=7, help='seed of the synthetic prices')
+    parser.add_argument('--save', metavar='FILE', help='write the results to this file as a baseline')
+    parser.add_argument('--baseline', metavar='FILE', help='compare the results with a saved baseline')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='relative change of a figure counted as a regression (0.1 is 10%%)')
+    args = parser.parse_args(argv)
+
+    settings = Settings(args.start, args.days, args.tick_days, args.ticks_per_minute, args.seed)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['settings'] != settings.as_dict():
+            parser.error('the baseline was run with other data settings: {}'.format(baseline['settings']))
+
+    clock = timer.perf_counter()
+    data = generate(args.data, settings)
+    print('data: {} ({:.1f}s)'.format(data, timer.perf_counter() - clock))
+    names = args.case or list(CASES)
+    results = benchmark(names, data, settings, args.repeat)
+    print(report(results, baseline and baseline['cases']))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(dict(settings=settings.as_dict(), cases=results), f, indent=1)
+    regressions = compare(results, baseline['cases'] if baseline else dict(), args.tolerance)
+    for name, message in regressions:
+        print('REGRESSION {}: {}'.format(name, message))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,93 @@
+'''
+Snapshots of a replay taken at the end of a day, so a long backtest can carry on from any
+saved day instead of starting over.
+
+A snapshot is the whole algorithm object pickled at midnight: its securities, portfolio and
+open orders, the current and next contracts, the indicator windows, the consolidators with
+their working bars and any flags it keeps, along with the futures universe of the replay.
+Resuming unpickles it and opens the data files from that day on, so Initialize, the warm-up
+period and the history requests aren't run again and only the days after the snapshot are
+replayed:
+
+    python LocalReplay.py MultipleSymbolConsolidationAlgorithm.py --data ~/data --checkpoint ~/ckpt
+    python LocalReplay.py MultipleSymbolConsolidationAlgorithm.py --data ~/data --resume 2015-11-02 --checkpoint ~/ckpt
+
+Snapshots are named after the day they resume from, and loading a day takes the latest one
+at or before it. The algorithm's code is imported again on resume, so a change to a method
+applies to the resumed days while the state it works on comes from the snapshot.
+
+Everything the algorithm holds has to pickle: consolidator factories and event handlers are
+bound methods, functools.partial or classes rather than lambdas.
+'''
+
+import gzip
+import os
+import pickle
+from datetime import datetime
+
+
+EXTENSION = '.ckpt'
+DAY_FORMAT = '%Y-%m-%d'
+
+
+def save_snapshot(path, snapshot):
+    '''Writes a snapshot to a compressed file, atomically.'''
+    temporary = path + '.tmp'
+    with gzip.open(temporary, 'wb', compresslevel=6) as f:
+        pickle.dump(snapshot, f, pickle.HIGHEST_PROTOCOL)
+    os.replace(temporary, path)
+
+
+def load_snapshot(path):
+    with gzip.open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+class Checkpoints:
+    '''
+    A folder of snapshots, one saved every `every` days with data. keep, if given, is the
+    number of the most recent snapshots left in the folder.
+    '''
+
+    def __init__(self, folder, every=1, keep=None):
+        self.folder = os.path.expanduser(folder)
+        self.every = every
+        self.keep = keep
+        self.saved = 0
+        self._days = 0
+        os.makedirs(self.folder, exist_ok=True)
+
+    def path(self, day):
+        return os.path.join(self.folder, day.strftime(DAY_FORMAT) + EXTENSION)
+
+    def days(self):
+        '''The days of the saved snapshots, in order.'''
+        days = []
+        for name in os.listdir(self.folder):
+            if name.endswith(EXTENSION):
+                try:
+                    days.append(datetime.strptime(name[:-len(EXTENSION)], DAY_FORMAT))
+                except ValueError:
+                    continue
+        return sorted(days)
+
+    def end_of_day(self, replay, day):
+        '''Called by the replay after each day with data; day is the next day to replay.'''
+        self._days += 1
+        if self._days % self.every == 0:
+            self.save(replay.snapshot(day), day)
+
+    def save(self, snapshot, day):
+        save_snapshot(self.path(day), snapshot)
+        self.saved += 1
+        if self.keep is not None:
+            for old in self.days()[:-self.keep]:
+                os.remove(self.path(old))
+
+    def load(self, day=None):
+        '''The latest snapshot at or before day, or the latest of all.'''
+        days = [d for d in self.days() if day is None or d <= day]
+        if not days:
+            raise FileNotFoundError('No checkpoint in {}{}'.format(
+                self.folder, '' if day is None else ' at or before ' + day.strftime(DAY_FORMAT)))
+        return load_snapshot(self.path(days[-1]))
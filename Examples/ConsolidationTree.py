@@ -0,0 +1,339 @@
+'''
+Multi-timeframe bars of many symbols from one feed.
+
+Instead of one consolidator per symbol and timeframe, each aggregating every raw bar on its
+own, the timeframes form a tree: a level is fed the completed bars of the largest coarser
+level whose period it is a multiple of, so with 5, 30, 60 minute and daily levels over a
+minute feed
+
+    1m -> 5m -> 30m
+             -> 60m -> 1d
+
+a raw bar only touches the 5 minute level and the others are updated once per completed
+parent bar, and checked for a gap once per 5 minute bucket. The working bars of a level are
+kept in columns (start, end, open, high, low, close and volume) indexed by a row per symbol,
+so another contract is another row of the same levels rather than another set of
+consolidators. The columns are lists: a raw bar
+updates a handful of scalars, which plain lists index faster than NumPy arrays.
+
+    self.bars = ConsolidationTree(self, TimeSpan.FromMinutes(1))
+    self.bars.subscribe(TimeSpan.FromMinutes(60), self.OnHour)
+    self.bars.add_indicator(symbol, TimeSpan.FromMinutes(5), self.fast)
+    self.bars.add(symbol)       # subscribes the symbol's raw bars
+    ...
+    self.bars.remove(symbol)    # at a roll
+
+Buckets are aligned like TradeBarConsolidator's: a bar starts at a multiple of its period
+counted from 0001-01-01 and is emitted by the raw bar that reaches its end, or, when the data
+has a gap, by the first raw bar after it, at every level: a raw bar starting a bucket scans the
+levels below with its time before it is added. Each level's bars are the ones a
+TradeBarConsolidator of that period would build, emitted on the same raw bar. Like those
+consolidators a bar left open by a gap is also emitted by a Scan() on the clock, which LEAN and
+LocalReplay call at every time step, so it closes as soon as any symbol's data passes its end.
+Levels are meant to be added before the data starts: a level added later starts from the next
+completed bar of its parent.
+'''
+
+from datetime import datetime, timedelta
+
+from ArrayTickConsolidator import ConsolidatedEvent
+
+
+class TreeBar:
+    '''A consolidated bar with the members of a TradeBar.'''
+    __slots__ = ('Symbol', 'Time', 'EndTime', 'Open', 'High', 'Low', 'Close', 'Volume', 'Period')
+
+    def __init__(self, symbol, time, end_time, open, high, low, close, volume):
+        self.Symbol = symbol
+        self.Time = time
+        self.EndTime = end_time
+        self.Open = open
+        self.High = high
+        self.Low = low
+        self.Close = close
+        self.Volume = volume
+        self.Period = end_time - time
+
+    @property
+    def Value(self):
+        return self.Close
+
+    @property
+    def Price(self):
+        return self.Close
+
+    def __str__(self):
+        return '{} O: {} H: {} L: {} C: {} V: {}'.format(self.Symbol, self.Open, self.High, self.Low,
+                                                         self.Close, self.Volume)
+
+
+class Level:
+    '''
+    One timeframe of the tree: the working bar of every row, the handlers called with each
+    completed bar (DataConsolidated) and the indicators of each row.
+    '''
+
+    def __init__(self, tree, period, rows):
+        self.tree = tree
+        self.Period = period
+        self.parent = None
+        self.children = []
+        self.DataConsolidated = ConsolidatedEvent()
+        self._indicators = dict()       # row -> [(indicator, selector, bar input)]
+        # working bar columns; a row without a working bar has no end
+        self._start = [None] * rows
+        self._end = [None] * rows
+        self._open = [0.0] * rows
+        self._high = [0.0] * rows
+        self._low = [0.0] * rows
+        self._close = [0.0] * rows
+        self._volume = [0.0] * rows
+
+    def _add_row(self):
+        for column in (self._start, self._end):
+            column.append(None)
+        for column in (self._open, self._high, self._low, self._close, self._volume):
+            column.append(0.0)
+
+    def add_indicator(self, row, indicator, selector=None):
+        bar_input = getattr(indicator, 'BAR_INPUT', False)
+        self._indicators.setdefault(row, []).append((indicator, selector, bar_input))
+
+    def working_bar(self, row):
+        '''The bar being built for a row, or None.'''
+        if self._end[row] is None:
+            return None
+        return self._bar(row, self._start[row], self._end[row], self._open[row], self._high[row],
+                         self._low[row], self._close[row], self._volume[row])
+
+    def _clear(self, row):
+        self._end[row] = None
+        self._indicators.pop(row, None)
+
+    def update(self, row, start, end, open, high, low, close, volume):
+        '''Adds a bar of the parent level (or a raw bar) to a row.'''
+        working_end = self._end[row]
+        if working_end is not None and start >= working_end:
+            self._emit(row)
+            working_end = None
+        if working_end is None:
+            bucket = start - (start - datetime.min) % self.Period
+            working_end = self._end[row] = bucket + self.Period
+            self._start[row] = bucket
+            self._open[row] = open
+            self._high[row] = high
+            self._low[row] = low
+            self._close[row] = close
+            self._volume[row] = volume
+        else:
+            if high > self._high[row]:
+                self._high[row] = high
+            if low < self._low[row]:
+                self._low[row] = low
+            self._close[row] = close
+            self._volume[row] += volume
+        if end >= working_end:
+            self._emit(row)
+
+    def update_bar(self, row, data):
+        '''update() with a raw bar, which reads only the fields it needs.'''
+        working_end = self._end[row]
+        if working_end is None or data.Time >= working_end:
+            # the bar starts a bucket, and every coarser bucket ends on a bucket boundary of
+            # this level: close the stale bars of the levels below with the bar's time before
+            # adding it, as their own consolidators would
+            time = data.Time
+            self.scan(row, time)
+            self.update(row, time, data.EndTime, data.Open, data.High, data.Low, data.Close, data.Volume)
+            return
+        high = data.High
+        if high > self._high[row]:
+            self._high[row] = high
+        low = data.Low
+        if low < self._low[row]:
+            self._low[row] = low
+        self._close[row] = data.Close
+        self._volume[row] += data.Volume
+        if data.EndTime >= working_end:
+            self._emit(row)
+
+    def scan(self, row, time):
+        '''Emits a row's working bar once time has reached its end.'''
+        working_end = self._end[row]
+        if working_end is not None and time >= working_end:
+            self._emit(row)
+        for child in self.children:
+            child.scan(row, time)
+
+    def _emit(self, row):
+        start = self._start[row]
+        end = self._end[row]
+        self._end[row] = None
+        open = self._open[row]
+        high = self._high[row]
+        low = self._low[row]
+        close = self._close[row]
+        volume = self._volume[row]
+        indicators = self._indicators.get(row)
+        if indicators or self.DataConsolidated.handlers:
+            bar = self._bar(row, start, end, open, high, low, close, volume)
+            if indicators:
+                for indicator, selector, bar_input in indicators:
+                    if bar_input:
+                        indicator.Update(bar)
+                    elif selector is None:
+                        indicator.Update(end, close)
+                    else:
+                        indicator.Update(end, selector(bar))
+            self.DataConsolidated(self, bar)
+        for child in self.children:
+            child.update(row, start, end, open, high, low, close, volume)
+
+    def _bar(self, row, start, end, open, high, low, close, volume):
+        return TreeBar(self.tree.symbols[row], start, end, open, high, low, close, volume)
+
+
+class _Feed:
+    '''The consolidator a symbol's raw bars are subscribed with.'''
+    __slots__ = ('tree', 'row')
+
+    def __init__(self, tree, row):
+        self.tree = tree
+        self.row = row
+
+    def Update(self, data):
+        for level in self.tree.roots:
+            level.update_bar(self.row, data)
+
+    def Scan(self, time):
+        self.tree.scan(self.row, time)
+
+
+class ConsolidationTree:
+    '''
+    The levels of the tree by period and the rows of the symbols. algorithm, if given, is
+    used to subscribe the raw bars of the symbols that are add()ed; resolution is the period
+    of those raw bars.
+    '''
+
+    def __init__(self, algorithm=None, resolution=timedelta(minutes=1)):
+        self.algorithm = algorithm
+        self.resolution = resolution
+        self.levels = dict()        # period -> Level
+        self.roots = []             # the levels fed the raw bars
+        self.symbols = []           # row -> symbol, None for a free row
+        self._rows = dict()         # symbol -> row
+        self._free = []
+        self._feeds = dict()        # symbol -> _Feed subscribed with the algorithm
+
+    # Levels
+
+    def level(self, period):
+        '''The level of a period, added to the tree if it isn't in it yet.'''
+        level = self.levels.get(period)
+        if level is None:
+            if period % self.resolution:
+                raise ValueError('{} is not a multiple of the {} resolution'.format(period, self.resolution))
+            level = self.levels[period] = Level(self, period, len(self.symbols))
+            self._link()
+        return level
+
+    def _link(self):
+        '''Feeds each level from the largest level whose period divides its own.'''
+        periods = sorted(self.levels)
+        self.roots = []
+        for level in self.levels.values():
+            level.children = []
+        for i, period in enumerate(periods):
+            level = self.levels[period]
+            parents = [p for p in periods[:i] if not period % p]
+            level.parent = self.levels[parents[-1]] if parents else None
+            if level.parent is None:
+                self.roots.append(level)
+            else:
+                level.parent.children.append(level)
+
+    def subscribe(self, period, handler):
+        '''Calls handler(level, bar) with the bars of a period of every symbol. Returns the level.'''
+        level = self.level(period)
+        level.DataConsolidated += handler
+        return level
+
+    def unsubscribe(self, period, handler):
+        level = self.levels.get(period)
+        if level is not None:
+            level.DataConsolidated -= handler
+
+    def add_indicator(self, symbol, period, indicator, selector=None):
+        '''
+        Updates an indicator with the bars of a symbol at a period: with the bar itself if
+        it takes bars (BAR_INPUT), otherwise with the close or selector(bar). The indicator
+        is dropped when the symbol is removed.
+        '''
+        self.level(period).add_indicator(self.row(symbol), indicator, selector)
+        return indicator
+
+    # Symbols
+
+    def row(self, symbol):
+        '''The row of a symbol, given one if it has none.'''
+        row = self._rows.get(symbol)
+        if row is not None:
+            return row
+        if self._free:
+            row = self._free.pop()
+            self.symbols[row] = symbol
+        else:
+            row = len(self.symbols)
+            self.symbols.append(symbol)
+            for level in self.levels.values():
+                level._add_row()
+        self._rows[symbol] = row
+        return row
+
+    def add(self, symbol):
+        '''Gives a symbol a row and subscribes its raw bars with the algorithm.'''
+        row = self.row(symbol)
+        if self.algorithm is not None and symbol not in self._feeds:
+            feed = self._feeds[symbol] = _Feed(self, row)
+            self.algorithm.SubscriptionManager.AddConsolidator(symbol, feed)
+        return row
+
+    def remove(self, symbol):
+        '''Unsubscribes a symbol and drops its working bars and indicators.'''
+        feed = self._feeds.pop(symbol, None)
+        if feed is not None:
+            self.algorithm.SubscriptionManager.RemoveConsolidator(symbol, feed)
+        row = self._rows.pop(symbol, None)
+        if row is None:
+            return
+        for level in self.levels.values():
+            level._clear(row)
+        self.symbols[row] = None
+        self._free.append(row)
+
+    def working_bar(self, symbol, period):
+        row = self._rows.get(symbol)
+        return None if row is None else self.levels[period].working_bar(row)
+
+    # Data
+
+    def update(self, data):
+        '''Adds a raw bar of a symbol that has a row.'''
+        self.update_row(self._rows[data.Symbol], data)
+
+    def update_row(self, row, data):
+        for level in self.roots:
+            level.update_bar(row, data)
+
+    def update_many(self, bars):
+        '''Adds a time step of raw bars, a dictionary of bars by symbol like slice.Bars.'''
+        rows = self._rows
+        for symbol, bar in bars.items():
+            row = rows.get(symbol)
+            if row is not None:
+                self.update_row(row, bar)
+
+    def scan(self, row, time):
+        for level in self.roots:
+            level.scan(row, time)
@@ -0,0 +1,204 @@
+'''
+Back-adjusted continuous front month series, built bar by bar across rolls.
+
+The algorithm keeps choosing the front contract (FuturesRollManager, 3 days before expiry)
+and feeds the front contract's consolidated bars to update(). At a roll, roll() is called
+with the last prices of the old and the new contract. The adjustment is either their ratio
+or their difference. Instead of refilling indicators from the new contract's history, the
+indicators fed by the series are adjusted in place (FastIndicators adjust()). They run once
+over the whole backtest, and only the first contract needs a warm-up.
+
+The raw front month bars and the roll table can be cached in a BarStore. bars() then
+returns the back-adjusted series as of any time, and later runs warm up from it. The series
+is stored under the name of its roll schedule, and a run whose rolls disagree with the
+stored ones (another data source, say) raises instead of mixing the two series:
+
+    self.continuous = ContinuousFuture('ES', Resolution.Hour, RATIO, store='~/store', schedule='roll3d')
+    self.continuous.add_indicator(self.sma)
+    ...
+    self.continuous.roll(self.Time, new.Symbol, old_price, new_price)   # at a roll
+    self.continuous.update(bar)                                         # each hourly bar
+'''
+
+import csv
+import io
+import os
+from collections import deque
+
+from AlgorithmBase import np
+
+
+RATIO = 'ratio'
+DIFFERENCE = 'difference'
+
+
+def _ns(time):
+    return int(np.datetime64(time, 'ns').astype(np.int64))
+
+
+class Roll:
+    '''A roll at time (ns) to symbol: earlier prices map to price * factor + offset.'''
+    __slots__ = ('time', 'symbol', 'factor', 'offset')
+
+    def __init__(self, time, symbol, factor, offset):
+        self.time = time
+        self.symbol = symbol
+        self.factor = factor
+        self.offset = offset
+
+
+class ContinuousFuture:
+    '''
+    A continuous series named name (ES-continuous-ratio-<schedule> by default), stored in the
+    BarStore under ticker and resolution when a store, or its path, is given. schedule names
+    the roll rule choosing the front contract, roll3d for 3 days before expiry.
+    '''
+
+    def __init__(self, ticker, resolution, method=RATIO, store=None, name=None, schedule=None):
+        if method not in (RATIO, DIFFERENCE):
+            raise ValueError('method must be {} or {}'.format(RATIO, DIFFERENCE))
+        self.ticker = ticker
+        self.resolution = resolution
+        self.method = method
+        self.name = name or '-'.join([ticker.upper(), 'continuous', method] + ([schedule] if schedule else []))
+        self.indicators = []
+        self.symbol = None
+        self.rolls = []
+        self._since = None          # the first bar or the last roll of this run, in ns
+        self._closes = deque(maxlen=0)  # (end time, close) of the last bars, to warm up indicators without adjust()
+
+        if isinstance(store, str):
+            from BarStore import BarStore
+            store = BarStore(store)
+        self.store = store
+        self._pending = []
+        if store is not None:
+            self.rolls = self._read_rolls()
+
+    def add_indicator(self, indicator):
+        '''Updates the indicator with every bar and adjusts it at every roll.'''
+        self.indicators.append(indicator)
+        if not hasattr(indicator, 'adjust'):
+            period = int(getattr(indicator, 'WarmUpPeriod', 0) or getattr(indicator, 'Period', 0) or 0)
+            if period > self._closes.maxlen:
+                self._closes = deque(self._closes, maxlen=period)
+        return indicator
+
+    def update(self, bar):
+        '''Adds a bar of the front contract and updates the indicators with it.'''
+        self.symbol = bar.Symbol
+        time = bar.EndTime
+        close = bar.Close
+        for indicator in self.indicators:
+            if getattr(indicator, 'BAR_INPUT', False):
+                indicator.Update(bar)
+            else:
+                indicator.Update(time, close)
+        if self._since is None:
+            self._since = _ns(time)
+        if self._closes.maxlen:
+            self._closes.append((time, close))
+        if self.store is not None:
+            self._pending.append((_ns(time), bar.Open, bar.High, bar.Low, close, bar.Volume))
+
+    def roll(self, time, symbol, old_price, new_price):
+        '''
+        Rolls the series to symbol, given the last prices of the old and new contracts at time.
+        Returns the Roll, or None when a price is missing and the series is left unadjusted.
+        '''
+        if not old_price or not new_price:
+            self.symbol = symbol
+            return None
+        if self.method == RATIO:
+            factor, offset = new_price / old_price, 0.0
+        else:
+            factor, offset = 1.0, new_price - old_price
+
+        roll = Roll(_ns(time), str(symbol.Value if hasattr(symbol, 'Value') else symbol), factor, offset)
+        if self._record(roll) and self.store is not None:
+            self.flush()
+            self._write_roll(roll)
+
+        self._closes = deque(((t, c * factor + offset) for t, c in self._closes), maxlen=self._closes.maxlen)
+        for indicator in self.indicators:
+            if hasattr(indicator, 'adjust'):
+                indicator.adjust(factor, offset)
+            else:
+                indicator.Reset()
+                for t, c in self._closes:
+                    indicator.Update(t, c)
+        self.symbol = symbol
+        return roll
+
+    def _record(self, roll):
+        '''
+        Adds a roll of this run to the roll table, and returns whether it is new. A roll the table
+        already has must match the stored one, and the table must have no roll this run skipped.
+        '''
+        since = roll.time if self._since is None else self._since
+        self._since = roll.time
+        stored = [r for r in self.rolls if since < r.time <= roll.time]
+        if not stored and (not self.rolls or roll.time > self.rolls[-1].time):
+            self.rolls.append(roll)
+            return True
+        if len(stored) == 1 and stored[0].time == roll.time and stored[0].symbol == roll.symbol \
+                and np.isclose(stored[0].factor, roll.factor) and np.isclose(stored[0].offset, roll.offset):
+            return False
+        raise ValueError('The roll to {} at {} does not match the rolls stored for {}, which come from another '
+                         'schedule or data source'.format(roll.symbol, np.datetime64(roll.time, 'ns'), self.name))
+
+    def flush(self):
+        '''Appends the bars received since the last flush to the store.'''
+        if self.store is None or not self._pending:
+            return
+        columns = [np.array(c) for c in zip(*self._pending)]
+        self._pending = []
+        self.store.append(self.ticker, self.resolution, self.name, *columns)
+
+    def bars(self, count=None, end=None):
+        '''
+        The back-adjusted bars ending at or before end from the store: end times, open, high,
+        low, close and volume arrays. Prices of a bar are adjusted by every roll after it.
+        '''
+        self.flush()
+        series = None if self.store is None else self.store.series(self.ticker, self.resolution, self.name)
+        if series is None:
+            empty = np.empty(0)
+            return np.empty(0, dtype='datetime64[ns]'), empty, empty, empty, empty, empty
+        times, open, high, low, close, volume = series.range(None, end) if count is None else series.tail(count, end)
+
+        # roll times after the last bar don't apply to the returned series
+        rolls = [r for r in self.rolls if end is None or r.time <= _ns(end)]
+        if rolls:
+            roll_times = np.array([r.time for r in rolls], dtype=np.int64)
+            # composition of the adjustments of rolls i.. : x -> x * factors[i] + offsets[i]
+            factors = np.ones(len(rolls) + 1)
+            offsets = np.zeros(len(rolls) + 1)
+            for i in range(len(rolls) - 1, -1, -1):
+                factors[i] = factors[i + 1] * rolls[i].factor
+                offsets[i] = rolls[i].offset * factors[i + 1] + offsets[i + 1]
+            idx = np.searchsorted(roll_times, times, 'left')
+            factor, offset = factors[idx], offsets[idx]
+            open, high, low, close = (a * factor + offset for a in (open, high, low, close))
+        return times.view('datetime64[ns]'), open, high, low, close, volume
+
+    def _rolls_path(self):
+        return os.path.join(self.store.folder(self.ticker, self.resolution, self.name), 'rolls.csv')
+
+    def _read_rolls(self):
+        path = self._rolls_path()
+        if not os.path.exists(path):
+            return []
+        with io.open(path) as f:
+            return [Roll(int(row['time']), row['symbol'], float(row['factor']), float(row['offset']))
+                    for row in csv.DictReader(f)]
+
+    def _write_roll(self, roll):
+        path = self._rolls_path()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        new = not os.path.exists(path)
+        with io.open(path, 'a', newline='') as f:
+            writer = csv.writer(f)
+            if new:
+                writer.writerow(['time', 'symbol', 'factor', 'offset'])
+            writer.writerow([roll.time, roll.symbol, repr(roll.factor), repr(roll.offset)])
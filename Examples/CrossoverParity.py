@@ -0,0 +1,448 @@
+'''
+Parity checks of VectorizedCrossover against the event driven crossover examples.
+
+Each case replays an example with LocalReplay, recording the bars its crossover handler is
+called with and the orders that fill. It then builds the same bars from the data folder
+with NumPy, backtests them with VectorizedCrossover, and compares the two bar for bar and
+fill for fill:
+
+    python CrossoverParity.py --data ~/data --case futures --start 2019-03-01 --end 2019-04-15
+    python CrossoverParity.py --data ~/equities --case basic --start 2015-01-05 --end 2015-03-31
+    python CrossoverParity.py --data ~/data --case tick
+
+futures is FuturesMovingAverageCrossOverExample2: hourly bars of the front contract from the
+roll schedule, averages over the back-adjusted series warmed up from the first contract's
+history, and a liquidation at every roll. basic is BasicTemplateFuturesAlgorithm on five
+minute SPY bars, whose averages also take every minute bar (they are registered on the
+subscription as well as on the consolidator). tick is FuturesTickChartExample over count
+bars of the front contract's quote ticks, filled at the ask and the bid, over the days of
+the tick data unless --start and --end are given.
+
+Two of the examples don't trade as written: BasicTemplateFuturesAlgorithm never hooks its
+handler to the consolidator, and FuturesTickChartExample orders the canonical chain symbol,
+which is rejected. The harness runs them with the handler hooked and trading the contract
+its bars come from. FuturesTickChartExample also consolidates every contract of the chain
+into the same averages, so it is run on the front contract only.
+
+A case is skipped when the data folder doesn't have its data, and fails when neither run
+traded, since there are no fills to compare.
+'''
+
+import argparse
+import os
+import sys
+import time as timer
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import LocalLean
+from LocalLean import OrderStatus, Resolution, SecurityType, Symbol
+from LocalReplay import LocalDataFolder, LocalReplay, load_algorithm, to_ns
+from IndicatorWarmUp import consolidate_bars
+from VectorizedCrossover import EMA, backtest, crossover, sma
+
+
+MINUTE = 60 * 10 ** 9
+
+
+# Event driven runs
+
+def recording(cls, handler, before=None, batched=False):
+    '''
+    A subclass of an algorithm class recording the bars its handler is called with, as (bar end
+    time, algorithm time, close) in self.recorded_bars, and its fills, as (time, quantity, price)
+    in self.recorded_fills. before(algorithm, data) runs ahead of the handler. A batched handler
+    is called with a TickBarBatch rather than a bar.
+    '''
+    method = getattr(cls, handler)
+
+    def recorded(self, sender, data):
+        for bar in data.bars() if batched else (data,):
+            self.recorded_bars.append((bar.EndTime, self.Time, bar.Close))
+        if before is not None:
+            before(self, data)
+        return method(self, sender, data)
+
+    def OnOrderEvent(self, order_event):
+        if order_event.Status == OrderStatus.Filled:
+            self.recorded_fills.append((self.Time, order_event.FillQuantity, order_event.FillPrice))
+        return cls.OnOrderEvent(self, order_event)
+
+    def __init__(self):
+        cls.__init__(self)
+        self.recorded_bars = []
+        self.recorded_fills = []
+
+    return type(cls.__name__, (cls,), {'__init__': __init__, handler: recorded, 'OnOrderEvent': OnOrderEvent,
+                                       '__module__': cls.__module__})
+
+
+def replay(cls, data, start, end, parameters):
+    run = LocalReplay(cls, data, parameters)
+    algorithm = run.run(start, end)
+    return run, algorithm
+
+
+# Data
+
+def _join(chunks):
+    chunks = list(chunks)
+    if not chunks:
+        return None
+    return tuple(np.concatenate(c) for c in zip(*chunks))
+
+
+def emissions(ends, period, first=None, last=None):
+    '''
+    The consolidated bars a TradeBarConsolidator of period (ns) emits from bars with the end
+    times ends (ns), fed from the first bar ending after first until the last ending at or
+    before last. Returns the index of the last bar in each consolidated bar and of the bar
+    whose update emits it, which is that bar when it ends the period and otherwise the next
+    bar, in a later period. A consolidated bar not emitted by then is dropped.
+    '''
+    lo = 0 if first is None else int(np.searchsorted(ends, first, 'right'))
+    hi = len(ends) if last is None else int(np.searchsorted(ends, last, 'right'))
+    if lo >= hi:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty
+    ends = ends[lo:hi]
+    buckets = (ends - MINUTE) // period
+    lasts = np.r_[np.flatnonzero(buckets[1:] != buckets[:-1]), len(ends) - 1]
+    complete = ends[lasts] >= (buckets[lasts] + 1) * period
+    triggers = np.where(complete, lasts, lasts + 1)
+    emitted = triggers < len(ends)
+    return lasts[emitted] + lo, triggers[emitted] + lo
+
+
+def _datetimes(ns):
+    return np.asarray(ns, dtype=np.int64).view('datetime64[ns]').astype('datetime64[us]').tolist()
+
+
+class Case:
+    '''The handler bars and fills of the event driven run and of the vectorized backtest of one example.'''
+
+    def __init__(self, name):
+        self.name = name
+        self.event_bars = []
+        self.event_fills = []
+        self.event_net_profit = 0.0
+        self.event_seconds = 0.0
+        self.bars = []
+        self.fills = []
+        self.net_profit = 0.0
+        self.seconds = 0.0
+        self.load_seconds = 0.0
+        self.skipped = None         # why the case wasn't run
+
+    def skip(self, reason):
+        self.skipped = reason
+        return self
+
+    def mismatches(self, tolerance=1e-6):
+        '''Descriptions of the first differing bar and fill, if any.'''
+        if self.skipped:
+            return []
+        found = []
+        if not self.event_fills and not self.fills:
+            found.append('no fills to compare, try other dates or parameters')
+        for kind, event, vector in (('bar', self.event_bars, self.bars), ('fill', self.event_fills, self.fills)):
+            if len(event) != len(vector):
+                found.append('{} {}s event driven, {} vectorized'.format(len(event), kind, len(vector)))
+            for i, (a, b) in enumerate(zip(event, vector)):
+                if a[:2] != b[:2] or abs(a[2] - b[2]) > tolerance * max(1.0, abs(a[2])):
+                    found.append('{} {}: event driven {}, vectorized {}'.format(kind, i, a, b))
+                    break
+        if abs(self.event_net_profit - self.net_profit) > tolerance * max(1.0, abs(self.event_net_profit)):
+            found.append('net profit: event driven {:.2f}, vectorized {:.2f}'.format(
+                self.event_net_profit, self.net_profit))
+        return found
+
+    def report(self):
+        if self.skipped:
+            return '{}: skipped, {}'.format(self.name, self.skipped)
+        lines = ['{}: {} bars  {} fills  net profit {:.2f} (event driven {:.2f})'.format(
+            self.name, len(self.bars), len(self.fills), self.net_profit, self.event_net_profit)]
+        mismatches = self.mismatches()
+        lines.extend('  MISMATCH ' + m for m in mismatches)
+        if not mismatches:
+            lines.append('  bars and fills match')
+        speedup = self.event_seconds / self.seconds if self.seconds else float('inf')
+        lines.append('  event driven {:.2f}s  vectorized {:.4f}s ({:,.0f}x), {:.2f}s with loading'.format(
+            self.event_seconds, self.seconds, speedup, self.load_seconds + self.seconds))
+        return '\n'.join(lines)
+
+    def record_event(self, run, algorithm):
+        self.event_bars = list(algorithm.recorded_bars)
+        self.event_fills = list(algorithm.recorded_fills)
+        self.event_net_profit = algorithm.Portfolio.TotalNetProfit
+        self.event_seconds = run.elapsed
+
+    def record(self, result, bar_ends, bar_closes, bar_steps, trade_times):
+        self.bars = list(zip(_datetimes(bar_ends), _datetimes(bar_steps), bar_closes.tolist()))
+        self.fills = list(zip(_datetimes(trade_times), result.trade_quantity.tolist(), result.trade_price.tolist()))
+        self.net_profit = result.net_profit
+
+
+# Cases
+
+def basic_case(data, start=None, end=None, parameters=None):
+    '''BasicTemplateFuturesAlgorithm: EMA(9) over SMA(50) on five minute SPY bars, all in with SetHoldings.'''
+    case = Case('basic')
+    if data.path('SPY', Resolution.Minute, 'SPY') is None:
+        return case.skip('no SPY minute data in {}'.format(data.root))
+    cls = load_algorithm(_path('BasicTemplateFuturesAlgorithm.py'))
+
+    def hooked(self):
+        cls.Initialize(self)
+        for consolidator in self.SubscriptionManager.Consolidators[self.Symbol('SPY')]:
+            if isinstance(consolidator, LocalLean.TradeBarConsolidator):
+                consolidator.DataConsolidated += self.OnDataConsolidated
+
+    algorithm_class = recording(type(cls.__name__, (cls,), {'Initialize': hooked, '__module__': cls.__module__}),
+                                'OnDataConsolidated')
+    run, algorithm = replay(algorithm_class, data, start, end, parameters)
+    case.record_event(run, algorithm)
+
+    clock = timer.perf_counter()
+    begin = run.start - algorithm.WarmUpPeriod
+    minutes = _join(run.data.chunks(Symbol.Create('SPY'), Resolution.Minute, begin, run.end))
+    ends, closes = minutes[0], minutes[4]
+    lasts, triggers = emissions(ends, 5 * MINUTE)
+    # the averages take every minute close, and the five minute close right after the
+    # minute that emits it
+    values = np.insert(closes, triggers + 1, closes[lasts])
+    at = triggers + np.arange(1, len(triggers) + 1)
+    case.load_seconds = timer.perf_counter() - clock
+
+    clock = timer.perf_counter()
+    allowed = ends[triggers] >= to_ns(run.start)
+    result = backtest(values, 9, 50, fast_kind=EMA, at=at, buy=closes[triggers], sell=closes[triggers],
+                      allowed=allowed, fraction=1.0, cash=100000.0)
+    case.seconds = timer.perf_counter() - clock
+    bar_ends = (ends[lasts] - MINUTE) // (5 * MINUTE) * (5 * MINUTE) + 5 * MINUTE
+    case.record(result, bar_ends, closes[lasts], ends[triggers], ends[triggers][result.trade_index])
+    return case
+
+
+def futures_case(data, start=None, end=None, parameters=None):
+    '''FuturesMovingAverageCrossOverExample2: SMA(18) over SMA(50) of hourly front month bars, one contract.'''
+    parameters = dict(parameters or {})
+    cls = load_algorithm(_path('FuturesMovingAverageCrossOverExample2.py'))
+    case = Case('futures')
+    run, algorithm = replay(recording(cls, 'OnHour'), data, start, end, parameters)
+    case.record_event(run, algorithm)
+
+    clock = timer.perf_counter()
+    fast_period = int(parameters.get('fast_sma_period') or 18)
+    slow_period = int(parameters.get('slow_sma_period') or 50)
+    roll_period = timedelta(days=int(parameters.get('roll_days') or 3)) // timedelta(microseconds=1) * 1000
+    method = parameters.get('adjustment') or 'ratio'
+    begin = run.start - algorithm.WarmUpPeriod
+    canonical = [s for s in algorithm.Securities.values() if isinstance(s, LocalLean.Future)][0]
+    schedule = front_month(run.data, canonical, begin, run.end, roll_period)
+    if schedule is None:
+        return case.skip('no {} contract with minute data is selected'.format(canonical.Symbol.ID.Symbol))
+    contracts, roll_times = schedule
+    # the first contract's history, consolidated like WarmUpIndicators
+    selected = _datetimes([roll_times[0]])[0]
+    history = run.data.history_arrays(contracts[0]['symbol'], slow_period * 60, Resolution.Minute, selected)
+    warm = consolidate_bars(history, selected, 60)
+    case.load_seconds = timer.perf_counter() - clock
+
+    clock = timer.perf_counter()
+    steps, prices, raw, ends, flat_after, flat_price, factors = [], [], [], [], [], [], []
+    for k, contract in enumerate(contracts):
+        last = roll_times[k + 1] if k + 1 < len(roll_times) else None
+        minute_ends, minute_closes = contract['ends'], contract['closes']
+        lasts, triggers = emissions(minute_ends, 60 * MINUTE, roll_times[k], last)
+        raw.append(minute_closes[lasts])
+        ends.append((minute_ends[lasts] - MINUTE) // (60 * MINUTE) * (60 * MINUTE) + 60 * MINUTE)
+        steps.append(minute_ends[triggers])
+        prices.append(minute_closes[triggers])
+        flat = np.zeros(len(lasts), dtype=bool)
+        price = np.zeros(len(lasts))
+        if last is not None:
+            # the roll's Liquidate closes the old contract at its last price
+            old = _price_at(contract, last)
+            factors.append(_adjustment(method, old, _price_at(contracts[k + 1], last)))
+            if len(lasts):
+                flat[-1] = True
+                price[-1] = old
+        flat_after.append(flat)
+        flat_price.append(price)
+
+    # back-adjusted series: every bar before a roll is moved by that roll's adjustment. The
+    # averages of a contract's bars are taken over the series as adjusted by then, like the
+    # indicators, so that rounding the earlier bars by a later roll can't break a tie.
+    adjusted = [warm[1].copy()]
+    fast, slow = [], []
+    for k, segment in enumerate(raw):
+        if k:
+            factor, offset = factors[k - 1]
+            for s in adjusted:
+                s *= factor
+                s += offset
+        adjusted.append(segment.copy())
+        values = np.concatenate(adjusted)
+        fast.append(sma(values, fast_period)[len(values) - len(segment):])
+        slow.append(sma(values, slow_period)[len(values) - len(segment):])
+    fast, slow = np.concatenate(fast), np.concatenate(slow)
+    ready = np.arange(len(warm[1]) + 1, len(warm[1]) + len(fast) + 1) >= max(fast_period, slow_period)
+    steps, prices = np.concatenate(steps), np.concatenate(prices)
+    flat_after, flat_price = np.concatenate(flat_after), np.concatenate(flat_price)
+    start_ns = to_ns(run.start)
+    allowed = steps >= start_ns
+    roll_ns = np.repeat(np.r_[roll_times[1:], 0], [len(r) for r in raw])
+    flat_after &= roll_ns >= start_ns
+    result = crossover(fast, slow, buy=prices, sell=prices, allowed=allowed, ready=ready, flat_after=flat_after,
+                       flat_price=flat_price, multiplier=canonical.SymbolProperties.ContractMultiplier)
+    case.seconds = timer.perf_counter() - clock
+    times = np.where(result.trade_flat, roll_ns[result.trade_index], steps[result.trade_index])
+    case.record(result, np.concatenate(ends), np.concatenate(raw), steps, times)
+    return case
+
+
+def tick_case(data, start=None, end=None, parameters=None):
+    '''FuturesTickChartExample: SMA(50) over SMA(100) of count bars of quote ticks, with a tolerance.'''
+    parameters = dict(parameters or {})
+    case = Case('tick')
+    root = LocalLean.Futures.Indices.SP500EMini
+    front = None
+    for value, expiry in data.contracts(root):
+        if data.path(root, Resolution.Tick, value) is not None and (front is None or expiry < front[1]):
+            front = (value, expiry)
+    if front is None:
+        return case.skip('no {} tick data in {}'.format(root, data.root))
+    symbol = Symbol.Create(root, SecurityType.Future, *front)
+    ticks = _join(data.chunks(symbol, Resolution.Tick))
+    if start is None or end is None:
+        first, last = _datetimes([ticks[0][0], ticks[0][-1]])
+        start = start or datetime(first.year, first.month, first.day)
+        end = end or datetime(last.year, last.month, last.day)
+    cls = load_algorithm(_path('FuturesTickChartExample.py'))
+
+    def front_only(self, changes):
+        cls.OnSecuritiesChanged(self, changes)
+        for other in [s for s in self.consolidators if s.Value != front[0]]:
+            del self.consolidators[other]
+
+    def trade_contract(self, batch):
+        self.futureES = self.Securities[batch.symbol]
+
+    algorithm_class = recording(type(cls.__name__, (cls,), {'OnSecuritiesChanged': front_only,
+                                                             '__module__': cls.__module__}),
+                                'OnBars', trade_contract, batched=True)
+    run, algorithm = replay(algorithm_class, data, start, end, parameters)
+    case.record_event(run, algorithm)
+
+    clock = timer.perf_counter()
+    size = int(parameters.get('tickLength') or 512)
+    begin, stop = to_ns(run.start - algorithm.WarmUpPeriod), to_ns(run.end)
+    times, bid, ask = ticks[0], ticks[1], ticks[2]
+    quotes = (bid > 0) & (ask > 0) & (times >= begin) & (times < stop)
+    times, bid, ask = times[quotes], bid[quotes], ask[quotes]
+    closes = np.arange(size - 1, len(times), size)
+    times, closes, asks, bids = times[closes], (bid[closes] + ask[closes]) / 2.0, ask[closes], bid[closes]
+    case.load_seconds = timer.perf_counter() - clock
+
+    clock = timer.perf_counter()
+    canonical = [s for s in algorithm.Securities.values() if isinstance(s, LocalLean.Future)][0]
+    result = backtest(closes, int(parameters.get('fastPeriod') or 50), int(parameters.get('slowPeriod') or 100),
+                      tolerance=float(parameters.get('tolerance') or 0.00015), buy=asks, sell=bids,
+                      allowed=times >= to_ns(run.start), multiplier=canonical.SymbolProperties.ContractMultiplier)
+    case.seconds = timer.perf_counter() - clock
+    case.record(result, times, closes, times, times[result.trade_index])
+    return case
+
+
+CASES = {'basic': basic_case, 'futures': futures_case, 'tick': tick_case}
+
+
+# Futures helpers
+
+def front_month(data, canonical, begin, end, roll_period):
+    '''
+    The contracts FuturesRollManager selects at the first step of each day with data, rolling
+    roll_period (ns) before expiry, as dicts of symbol, expiry and minute bar end times and
+    closes, and the times each one was selected. None if no contract is ever selected.
+    '''
+    root = canonical.Symbol.ID.Symbol
+    lo, hi = canonical.FilterRange
+    listed = data.contracts(root)
+    bars = dict()
+    for value, expiry in listed:
+        symbol = Symbol.Create(root, SecurityType.Future, value, expiry)
+        # a contract is in the universe from the first day it passes the filter until it expires
+        first = max(begin, datetime(expiry.year, expiry.month, expiry.day) - hi)
+        last = min(end, datetime(expiry.year, expiry.month, expiry.day) + timedelta(days=1))
+        minutes = _join(data.chunks(symbol, canonical.Resolution, first, last))
+        if minutes is not None:
+            keep = minutes[0] < to_ns(last)
+            bars[value] = dict(symbol=symbol, expiry=expiry, ends=minutes[0][keep], closes=minutes[4][keep])
+    if not bars:
+        return None
+
+    steps = np.unique(np.concatenate([b['ends'] for b in bars.values()]))
+    days = steps.view('datetime64[ns]').astype('datetime64[D]')
+    firsts = steps[np.r_[0, np.flatnonzero(days[1:] != days[:-1]) + 1]]
+
+    contracts, times = [], []
+    current = None
+    for step in firsts.tolist():
+        if current is not None and to_ns(current['expiry']) - step >= roll_period:
+            continue
+        day = _datetimes([step])[0].replace(hour=0, minute=0, second=0, microsecond=0)
+        chain = sorted((b for b in bars.values() if b['expiry'] >= day and day + lo <= b['expiry'] <= day + hi),
+                       key=lambda b: b['expiry'])
+        chosen = next((b for b in chain if to_ns(b['expiry']) >= step + roll_period), None)
+        if chosen is None or chosen is current:
+            continue
+        contracts.append(chosen)
+        times.append(step)
+        current = chosen
+    if not contracts:
+        return None
+    return contracts, np.array(times, dtype=np.int64)
+
+
+def _price_at(contract, time):
+    '''The security price of a contract at time: the close of its last bar by then, 0 without data.'''
+    i = int(np.searchsorted(contract['ends'], time, 'right'))
+    return float(contract['closes'][i - 1]) if i else 0.0
+
+
+def _adjustment(method, old, new):
+    if not old or not new:
+        return 1.0, 0.0
+    return (new / old, 0.0) if method == 'ratio' else (1.0, new - old)
+
+
+
+def _path(name):
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Check the vectorized crossover backtests against the examples.')
+    parser.add_argument('--data', required=True, help='local data folder')
+    parser.add_argument('--case', action='append', choices=sorted(CASES), help='example to check (all by default)')
+    parser.add_argument('--start', type=datetime.fromisoformat, help='override the start date')
+    parser.add_argument('--end', type=datetime.fromisoformat, help='override the end date')
+    parser.add_argument('--param', action='append', default=[], metavar='NAME=VALUE',
+                        help='algorithm parameter returned by GetParameter')
+    args = parser.parse_args(argv)
+
+    parameters = dict(p.split('=', 1) for p in args.param)
+    data = LocalDataFolder(args.data)
+    failed = False
+    for name in args.case or sorted(CASES):
+        case = CASES[name](data, args.start, args.end, parameters)
+        print(case.report())
+        # a case asked for by name fails if it can't run
+        failed |= bool(case.mismatches()) or bool(case.skipped and args.case)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,615 @@
+'''
+Incremental indicators with the LEAN Update(time, value) / IsReady / Current.Value surface.
+
+Every indicator is a __slots__ object over a fixed-size ring buffer (a preallocated list)
+with running sums, so an update is O(1) and creates no containers. Running sums are
+recomputed from the window each time the ring wraps, which bounds floating point drift to
+one window at amortized O(1) cost. update_many(values) is the bulk path for warm-up and
+research: the data point indicators compute their final state from the tail of the array
+with NumPy instead of looping.
+
+The bar indicators (AverageTrueRange, ParabolicStopAndReverse) take bars with High, Low and
+Close through Update(bar), or update_bar(time, high, low, close).
+
+adjust(factor, offset) rewrites an indicator's state as if every past input x had been
+x * factor + offset, which is how a back-adjusted continuous futures series is carried
+across a roll without refilling the indicators.
+'''
+
+from AlgorithmBase import np
+
+
+class IndicatorDataPoint:
+    __slots__ = ('Time', 'Value')
+
+    def __init__(self, time=None, value=0.0):
+        self.Time = time
+        self.Value = value
+
+    def __float__(self):
+        return float(self.Value)
+
+    def __str__(self):
+        return str(self.Value)
+
+
+def _value(x):
+    return x.Current.Value if isinstance(x, Indicator) else x
+
+
+def _name_and_period(name, period, prefix):
+    '''Supports both the Indicator(period) and Indicator(name, period) constructors.'''
+    if period is None:
+        return '{}({})'.format(prefix, name), name
+    return name, period
+
+
+class Indicator:
+    '''Common members: Name, Current, Samples, IsReady, comparisons and the generic update_many.'''
+    __slots__ = ('Name', 'Current', 'Samples', 'Period')
+    BAR_INPUT = False
+
+    def __init__(self, name, period):
+        self.Name = name
+        self.Period = period
+        self.Current = IndicatorDataPoint()
+        self.Samples = 0
+
+    @property
+    def IsReady(self):
+        return self.Samples >= self.Period
+
+    @property
+    def WarmUpPeriod(self):
+        return self.Period
+
+    def update_many(self, values, times=None):
+        '''Updates with every value of an array. Returns IsReady.'''
+        if times is None:
+            times = [None] * len(values)
+        for time, value in zip(times, np.asarray(values, dtype=np.float64).tolist()):
+            self.Update(time, value)
+        return self.IsReady
+
+    def _set(self, time, value, samples):
+        self.Samples += samples
+        self.Current.Time = time
+        self.Current.Value = value
+        return self.IsReady
+
+    def adjust(self, factor=1.0, offset=0.0):
+        '''Rewrites the state as if every past input x had been x * factor + offset.'''
+        self.Current.Value = self.Current.Value * factor + offset
+
+    def Reset(self):
+        self.Current = IndicatorDataPoint()
+        self.Samples = 0
+
+    def __float__(self):
+        return float(self.Current.Value)
+
+    def __str__(self):
+        return str(self.Current.Value)
+
+    def __format__(self, spec):
+        return format(self.Current.Value, spec)
+
+    def __lt__(self, other):
+        return self.Current.Value < _value(other)
+
+    def __le__(self, other):
+        return self.Current.Value <= _value(other)
+
+    def __gt__(self, other):
+        return self.Current.Value > _value(other)
+
+    def __ge__(self, other):
+        return self.Current.Value >= _value(other)
+
+    def __repr__(self):
+        return '{}: {}'.format(self.Name, self.Current.Value)
+
+
+class _Window(Indicator):
+    '''An indicator over a ring buffer of the last Period values.'''
+    __slots__ = ('_window', '_index')
+
+    def __init__(self, name, period):
+        Indicator.__init__(self, name, period)
+        self._window = [0.0] * period
+        self._index = 0
+
+    def values(self):
+        '''The window, oldest first.'''
+        n = min(self.Samples, self.Period)
+        if n < self.Period:
+            return self._window[:n]
+        i = self._index
+        return self._window[i:] + self._window[:i]
+
+    def _load_window(self, values):
+        '''Replaces the ring with the last Period values of an array, oldest first.'''
+        tail = values[-self.Period:].tolist()
+        self._window[:len(tail)] = tail
+        self._index = len(tail) % self.Period
+        return tail
+
+    def _adjust_window(self, factor, offset):
+        n = min(self.Samples, self.Period)
+        window = self._window
+        for i in range(n):
+            window[i] = window[i] * factor + offset
+
+    def Reset(self):
+        Indicator.Reset(self)
+        self._window = [0.0] * self.Period
+        self._index = 0
+
+
+class SimpleMovingAverage(_Window):
+    __slots__ = ('_sum',)
+
+    def __init__(self, name, period=None):
+        name, period = _name_and_period(name, period, 'SMA')
+        _Window.__init__(self, name, period)
+        self._sum = 0.0
+
+    def Update(self, time, value):
+        window = self._window
+        i = self._index
+        self._sum += value - window[i]
+        window[i] = value
+        i += 1
+        if i == self.Period:
+            i = 0
+            self._sum = sum(window)
+        self._index = i
+        n = self.Samples + 1
+        return self._set(time, self._sum / (n if n < self.Period else self.Period), 1)
+
+    def update_many(self, values, times=None):
+        values = np.asarray(values, dtype=np.float64)
+        if len(values) == 0:
+            return self.IsReady
+        joined = np.concatenate((np.asarray(self.values(), dtype=np.float64), values))
+        tail = self._load_window(joined)
+        self._sum = sum(tail)
+        return self._set(None if times is None else times[-1], self._sum / len(tail), len(values))
+
+    def adjust(self, factor=1.0, offset=0.0):
+        self._adjust_window(factor, offset)
+        self._sum = sum(self.values())
+        Indicator.adjust(self, factor, offset)
+
+    def Reset(self):
+        _Window.Reset(self)
+        self._sum = 0.0
+
+
+class ExponentialMovingAverage(Indicator):
+    __slots__ = ('_k',)
+
+    def __init__(self, name, period=None):
+        name, period = _name_and_period(name, period, 'EMA')
+        Indicator.__init__(self, name, period)
+        self._k = 2.0 / (period + 1)
+
+    def Update(self, time, value):
+        # our first data point just returns identity
+        if self.Samples == 0:
+            return self._set(time, value, 1)
+        k = self._k
+        return self._set(time, value * k + self.Current.Value * (1.0 - k), 1)
+
+    def update_many(self, values, times=None):
+        values = np.asarray(values, dtype=np.float64)
+        n = len(values)
+        if n == 0:
+            return self.IsReady
+        k = self._k
+        if self.Samples == 0:
+            seed, values = values[0], values[1:]
+        else:
+            seed = self.Current.Value
+        # ema = seed * (1 - k)^m + sum(k * (1 - k)^(m - 1 - j) * x[j])
+        decay = (1.0 - k) ** np.arange(len(values), -1, -1, dtype=np.float64)
+        value = float(seed * decay[0] + k * (decay[1:] @ values))
+        return self._set(None if times is None else times[-1], value, n)
+
+
+class LinearWeightedMovingAverage(_Window):
+    '''Weights 1..n from the oldest to the newest value, with running sum and weighted sum.'''
+    __slots__ = ('_sum', '_weighted')
+
+    def __init__(self, name, period=None):
+        name, period = _name_and_period(name, period, 'LWMA')
+        _Window.__init__(self, name, period)
+        self._sum = 0.0
+        self._weighted = 0.0
+
+    def Update(self, time, value):
+        period = self.Period
+        window = self._window
+        i = self._index
+        n = self.Samples
+        if n < period:
+            n += 1
+            self._weighted += n * value
+            self._sum += value
+        else:
+            n = period
+            self._weighted += period * value - self._sum
+            self._sum += value - window[i]
+        window[i] = value
+        i += 1
+        if i == period:
+            # the ring is full and in order, oldest first
+            i = 0
+            self._sum = sum(window)
+            self._weighted = sum(j * v for j, v in enumerate(window, 1))
+        self._index = i
+        return self._set(time, self._weighted / (n * (n + 1) / 2.0), 1)
+
+    def update_many(self, values, times=None):
+        values = np.asarray(values, dtype=np.float64)
+        if len(values) == 0:
+            return self.IsReady
+        joined = np.concatenate((np.asarray(self.values(), dtype=np.float64), values))
+        tail = np.asarray(self._load_window(joined))
+        n = len(tail)
+        self._sum = float(tail.sum())
+        self._weighted = float(np.arange(1, n + 1) @ tail)
+        return self._set(None if times is None else times[-1], self._weighted / (n * (n + 1) / 2.0), len(values))
+
+    def adjust(self, factor=1.0, offset=0.0):
+        self._adjust_window(factor, offset)
+        values = self.values()
+        self._sum = sum(values)
+        self._weighted = sum(j * v for j, v in enumerate(values, 1))
+        Indicator.adjust(self, factor, offset)
+
+    def Reset(self):
+        _Window.Reset(self)
+        self._sum = 0.0
+        self._weighted = 0.0
+
+
+class HullMovingAverage(Indicator):
+    '''Hull moving average as defined in OpeningRangeBreakout.cs: LWMAs over period^2 / 2, period^2 and period.'''
+    __slots__ = ('_fast', '_slow', '_smooth')
+
+    def __init__(self, name, period=None):
+        name, period = _name_and_period(name, period, 'HMA')
+        Indicator.__init__(self, name, period)
+        nsquared = period * period
+        self._fast = LinearWeightedMovingAverage(nsquared // 2)
+        self._slow = LinearWeightedMovingAverage(nsquared)
+        self._smooth = LinearWeightedMovingAverage(period)
+
+    @property
+    def IsReady(self):
+        return self._smooth.IsReady and self._slow.IsReady
+
+    @property
+    def WarmUpPeriod(self):
+        return self._slow.Period + self.Period - 1
+
+    def Update(self, time, value):
+        self._fast.Update(time, value)
+        self._slow.Update(time, value)
+        self._smooth.Update(time, 2.0 * self._fast.Current.Value - self._slow.Current.Value)
+        return self._set(time, self._smooth.Current.Value, 1)
+
+    def adjust(self, factor=1.0, offset=0.0):
+        # 2 * fast - slow transforms like the input, so the smoothing average does too
+        for average in (self._fast, self._slow, self._smooth):
+            average.adjust(factor, offset)
+        Indicator.adjust(self, factor, offset)
+
+    def Reset(self):
+        Indicator.Reset(self)
+        self._fast.Reset()
+        self._slow.Reset()
+        self._smooth.Reset()
+
+
+class StandardDeviation(_Window):
+    '''
+    Population standard deviation from running sums of the deviations from a reference value,
+    which is moved to the window mean at every wrap to keep the sums small.
+    '''
+    __slots__ = ('_ref', '_sum', '_squares')
+
+    def __init__(self, name, period=None):
+        name, period = _name_and_period(name, period, 'STD')
+        _Window.__init__(self, name, period)
+        self._ref = None
+        self._sum = 0.0
+        self._squares = 0.0
+
+    def Update(self, time, value):
+        if self._ref is None:
+            self._ref = value
+        ref = self._ref
+        window = self._window
+        i = self._index
+        d = value - ref
+        if self.Samples >= self.Period:
+            old = window[i] - ref
+            self._sum += d - old
+            self._squares += d * d - old * old
+        else:
+            self._sum += d
+            self._squares += d * d
+        window[i] = value
+        i += 1
+        if i == self.Period:
+            i = 0
+            self._rebase(window)
+        self._index = i
+        n = min(self.Samples + 1, self.Period)
+        mean = self._sum / n
+        variance = self._squares / n - mean * mean
+        return self._set(time, variance ** 0.5 if variance > 0 else 0.0, 1)
+
+    def _rebase(self, values):
+        ref = self._ref = sum(values) / len(values)
+        self._sum = sum(v - ref for v in values)
+        self._squares = sum((v - ref) * (v - ref) for v in values)
+
+    def update_many(self, values, times=None):
+        values = np.asarray(values, dtype=np.float64)
+        if len(values) == 0:
+            return self.IsReady
+        joined = np.concatenate((np.asarray(self.values(), dtype=np.float64), values))
+        tail = self._load_window(joined)
+        self._rebase(tail)
+        return self._set(None if times is None else times[-1], float(np.std(tail)), len(values))
+
+    def adjust(self, factor=1.0, offset=0.0):
+        self._adjust_window(factor, offset)
+        if self.Samples:
+            self._rebase(self.values())
+        self.Current.Value *= abs(factor)
+
+    def Reset(self):
+        _Window.Reset(self)
+        self._ref = None
+        self._sum = 0.0
+        self._squares = 0.0
+
+
+class MovingAverageType:
+    Simple = 0
+    Exponential = 1
+    Wilders = 2
+    LinearWeightedMovingAverage = 3
+
+
+def moving_average(ma_type, name, period):
+    if ma_type == MovingAverageType.Exponential:
+        return ExponentialMovingAverage(name, period)
+    if ma_type == MovingAverageType.Wilders:
+        return WilderMovingAverage(name, period)
+    if ma_type == MovingAverageType.LinearWeightedMovingAverage:
+        return LinearWeightedMovingAverage(name, period)
+    return SimpleMovingAverage(name, period)
+
+
+class Band(Indicator):
+    '''A value computed by a parent indicator, such as the bands of BollingerBands.'''
+    __slots__ = ()
+
+    def __init__(self, name):
+        Indicator.__init__(self, name, 1)
+
+
+class BollingerBands(Indicator):
+    '''BollingerBands([name,] period, k, movingAverageType=MovingAverageType.Simple)'''
+    __slots__ = ('K', 'MovingAverage', 'StandardDeviation', 'MiddleBand', 'UpperBand', 'LowerBand')
+
+    def __init__(self, *args):
+        if isinstance(args[0], str):
+            name, args = args[0], args[1:]
+        else:
+            name = 'BB({},{})'.format(args[0], args[1])
+        period, k = args[0], args[1]
+        ma_type = args[2] if len(args) > 2 else MovingAverageType.Simple
+
+        Indicator.__init__(self, name, period)
+        self.K = k
+        self.MovingAverage = moving_average(ma_type, name + '_MiddleBand', period)
+        self.StandardDeviation = StandardDeviation(name + '_StandardDeviation', period)
+        self.MiddleBand = Band(name + '_MiddleBand')
+        self.UpperBand = Band(name + '_UpperBand')
+        self.LowerBand = Band(name + '_LowerBand')
+
+    @property
+    def IsReady(self):
+        return self.MovingAverage.IsReady and self.StandardDeviation.IsReady
+
+    def Update(self, time, value):
+        self.MovingAverage.Update(time, value)
+        self.StandardDeviation.Update(time, value)
+        return self._bands(time, 1)
+
+    def update_many(self, values, times=None):
+        self.MovingAverage.update_many(values, times)
+        self.StandardDeviation.update_many(values, times)
+        return self._bands(None if times is None else times[-1], len(values))
+
+    def _bands(self, time, samples):
+        middle = self.MovingAverage.Current.Value
+        width = self.K * self.StandardDeviation.Current.Value
+        self.MiddleBand._set(time, middle, samples)
+        self.UpperBand._set(time, middle + width, samples)
+        self.LowerBand._set(time, middle - width, samples)
+        return self._set(time, middle, samples)
+
+    def adjust(self, factor=1.0, offset=0.0):
+        self.MovingAverage.adjust(factor, offset)
+        self.StandardDeviation.adjust(factor, offset)
+        if self.Samples:
+            self._bands(self.Current.Time, 0)
+
+    def Reset(self):
+        Indicator.Reset(self)
+        for indicator in (self.MovingAverage, self.StandardDeviation, self.MiddleBand, self.UpperBand,
+                          self.LowerBand):
+            indicator.Reset()
+
+
+class WilderMovingAverage(_Window):
+    '''The average of the first Period values, then value = (value * (n - 1) + x) / n.'''
+    __slots__ = ('_sum',)
+
+    def __init__(self, name, period=None):
+        name, period = _name_and_period(name, period, 'WWMA')
+        _Window.__init__(self, name, period)
+        self._sum = 0.0
+
+    def Update(self, time, value):
+        n = self.Samples + 1
+        period = self.Period
+        if n <= period:
+            self._sum += value
+            return self._set(time, self._sum / n, 1)
+        return self._set(time, (self.Current.Value * (period - 1) + value) / period, 1)
+
+    def adjust(self, factor=1.0, offset=0.0):
+        if self.Samples < self.Period:
+            self._sum = self._sum * factor + offset * self.Samples
+        Indicator.adjust(self, factor, offset)
+
+    def Reset(self):
+        _Window.Reset(self)
+        self._sum = 0.0
+
+
+class AverageTrueRange(Indicator):
+    '''Average of the true range, smoothed with Wilder's average by default like LEAN.'''
+    __slots__ = ('_average', '_previous_close')
+    BAR_INPUT = True
+
+    def __init__(self, name, period=None, movingAverageType=MovingAverageType.Wilders):
+        name, period = _name_and_period(name, period, 'ATR')
+        Indicator.__init__(self, name, period)
+        self._average = moving_average(movingAverageType, name + '_TR', period)
+        self._previous_close = None
+
+    def Update(self, bar):
+        return self.update_bar(bar.EndTime, bar.High, bar.Low, bar.Close)
+
+    def update_bar(self, time, high, low, close):
+        previous = self._previous_close
+        true_range = high - low
+        if previous is not None:
+            if high - previous > true_range:
+                true_range = high - previous
+            if previous - low > true_range:
+                true_range = previous - low
+        self._previous_close = close
+        self._average.Update(time, true_range)
+        return self._set(time, self._average.Current.Value, 1)
+
+    def update_many(self, high, low, close, times=None):
+        high = np.asarray(high, dtype=np.float64)
+        low = np.asarray(low, dtype=np.float64)
+        close = np.asarray(close, dtype=np.float64)
+        if len(close) == 0:
+            return self.IsReady
+        previous = np.r_[np.nan if self._previous_close is None else self._previous_close, close[:-1]]
+        true_range = np.fmax(high - low, np.fmax(np.abs(high - previous), np.abs(low - previous)))
+        self._previous_close = float(close[-1])
+        self._average.update_many(true_range, times)
+        return self._set(None if times is None else times[-1], self._average.Current.Value, len(close))
+
+    def adjust(self, factor=1.0, offset=0.0):
+        # ranges are unchanged by an offset and scale with the factor
+        self._average.adjust(abs(factor))
+        if self._previous_close is not None:
+            self._previous_close = self._previous_close * factor + offset
+        self.Current.Value = self._average.Current.Value
+
+    def Reset(self):
+        Indicator.Reset(self)
+        self._average.Reset()
+        self._previous_close = None
+
+
+class ParabolicStopAndReverse(Indicator):
+    '''Wilder's parabolic SAR, ready after two bars.'''
+    __slots__ = ('_af_start', '_af_increment', '_af_max', '_af', '_long', '_ep', '_sar',
+                 '_high1', '_low1', '_high2', '_low2', '_close1')
+    BAR_INPUT = True
+
+    def __init__(self, name=None, afStart=0.02, afIncrement=0.02, afMax=0.2):
+        Indicator.__init__(self, 'PSAR({},{},{})'.format(afStart, afIncrement, afMax) if name is None
+                           else str(name), 2)
+        self._af_start = afStart
+        self._af_increment = afIncrement
+        self._af_max = afMax
+        self.Reset()
+
+    def Update(self, bar):
+        return self.update_bar(bar.EndTime, bar.High, bar.Low, bar.Close)
+
+    def update_bar(self, time, high, low, close):
+        samples = self.Samples
+        if samples == 0:
+            self._high1, self._low1, self._close1 = high, low, close
+            return self._set(time, close, 1)
+
+        if samples == 1:
+            # the trend is set by the first two closes
+            self._long = close >= self._close1
+            self._af = self._af_start
+            if self._long:
+                self._sar = min(low, self._low1)
+                self._ep = max(high, self._high1)
+            else:
+                self._sar = max(high, self._high1)
+                self._ep = min(low, self._low1)
+        else:
+            sar = self._sar + self._af * (self._ep - self._sar)
+            if self._long:
+                # the stop can't be above the last two lows
+                sar = min(sar, self._low1, self._low2)
+                if low <= sar:
+                    self._long = False
+                    sar, self._ep, self._af = self._ep, low, self._af_start
+                elif high > self._ep:
+                    self._ep = high
+                    self._af = min(self._af + self._af_increment, self._af_max)
+            else:
+                sar = max(sar, self._high1, self._high2)
+                if high >= sar:
+                    self._long = True
+                    sar, self._ep, self._af = self._ep, high, self._af_start
+                elif low < self._ep:
+                    self._ep = low
+                    self._af = min(self._af + self._af_increment, self._af_max)
+            self._sar = sar
+
+        self._high2, self._low2 = self._high1, self._low1
+        self._high1, self._low1, self._close1 = high, low, close
+        return self._set(time, self._sar, 1)
+
+    def adjust(self, factor=1.0, offset=0.0):
+        '''Moves the price levels; factor must be positive.'''
+        self._ep = self._ep * factor + offset
+        self._sar = self._sar * factor + offset
+        self._high1, self._low1, self._high2, self._low2, self._close1 = (
+            x * factor + offset for x in (self._high1, self._low1, self._high2, self._low2, self._close1))
+        Indicator.adjust(self, factor, offset)
+
+    @property
+    def IsLong(self):
+        return self._long
+
+    def Reset(self):
+        Indicator.Reset(self)
+        self._af = self._af_start
+        self._long = True
+        self._ep = self._sar = 0.0
+        self._high1 = self._low1 = self._high2 = self._low2 = self._close1 = 0.0
@@ -1,5 +1,8 @@
-import clr
-import decimal as d
+from AlgorithmBase import *
+from functools import partial
+
+from FuturesRollManager import FuturesRollManager
+from TradeJournal import journal_for
 
 
 class FuturesContractRollover(QCAlgorithm):
@@ -23,6 +26,13 @@ class FuturesContractRollover(QCAlgorithm):
         futureES = self.AddFuture(Futures.Indices.SP500EMini)
         futureES.SetFilter(TimeSpan.Zero, TimeSpan.FromDays(360))
         
+        # Contract selection, rolling roll_days (3 by default) before expiry. The hourly
+        # consolidator is moved to the new contract at each roll, and the rolls are recorded
+        # in the run's journal, if it has one.
+        roll_days = int(self.GetParameter('roll_days') or 3)
+        self.roll = FuturesRollManager(self, roll_days=roll_days, on_roll=journal_for(self).roll)
+        self.roll.add_consolidator(partial(TradeBarConsolidator, TimeSpan.FromMinutes(60)), self.OnHour)
+        
     def OnData(self, slice):
         
         if not self.InitUpdateContract(slice):
@@ -38,45 +48,16 @@ class FuturesContractRollover(QCAlgorithm):
         if not self.new_day:
             return True
             
-        if self.contract != None and (self.contract.Expiry - self.Time).days >= 3: # rolling 3 days before expiry
-            return True
-            
-        for chain in slice.FutureChains.Values:
-            # When selecting contract, if on expiry date then skip first as it would be the same one.
-            idx = 0
-            if self.contract != None:
-                self.Log('Expiry days away {} - {}'.format((self.contract.Expiry-self.Time).days, self.contract.Expiry))
-            if self.contract != None and (self.contract.Expiry - self.Time).days < 3:
-                idx = 1
-            
-            contracts = list(chain.Contracts.Values)
-            
-            chain_contracts = list(contracts) #[contract for contract in chain]
-            chain_contracts = sorted(chain_contracts, key=lambda x: x.Expiry)
+        if not self.roll.update(slice):
+            return False
             
-            if len(chain_contracts) < 2:
-                return False
-                
-            first = chain_contracts[idx]
-            second = chain_contracts[idx+1]
-            
-            if (first.Expiry - self.Time).days >= 3:
-                self.contract = first
-            elif (first.Expiry - self.Time).days < 3 and (second.Expiry - self.Time).days >= 3:
-                self.contract = second
+        if self.roll.rolled:
+            self.contract = self.roll.contract
             self.Log("Setting contract to: {}".format(self.contract.Symbol.Value))
-            
-            self.new_day = False
             self.reset = True
             
-            # Set up consolidators.
-            one_hour = TradeBarConsolidator(TimeSpan.FromMinutes(60))
-            one_hour.DataConsolidated += self.OnHour
-            
-            self.SubscriptionManager.AddConsolidator(self.contract.Symbol, one_hour)
-            
-            return True
-        return False
+        self.new_day = False
+        return True
         
     def OnHour(self, sender, bar):
         if bar.Symbol == self.contract.Symbol:
@@ -1,5 +1,7 @@
-import clr
-import decimal as d
+from AlgorithmBase import *
+
+from StopTargetEngine import StopTargetEngine, TARGET
+from TradeJournal import journal_for
 
 
 class FuturesLongExample(QCAlgorithm):
@@ -16,10 +18,16 @@ class FuturesLongExample(QCAlgorithm):
         self.SetTimeZone('America/Los_Angeles') # Set timezone
         
         # Risk management
-        self.stop_loss = 0.02 * -1 # in percent
-        self.take_profit = 0.02 # in percent
+        self.stop_loss = float(self.GetParameter('stop_loss') or 0.02) * -1 # in percent
+        self.take_profit = float(self.GetParameter('take_profit') or 0.02) # in percent
         self.profit_hit = False
         self.stop_hit = False
+        self.entry_price = None
+        self.journal = journal_for(self)
+        
+        # The stop and target are registered as prices at entry and checked against the
+        # bars of the position's contract only
+        self.exits = StopTargetEngine(self, on_exit=self.OnExit)
         
         # Subscribe and set our expiry filter for the futures chain
         futureES = self.AddFuture(Futures.Indices.SP500EMini)
@@ -28,32 +36,43 @@ class FuturesLongExample(QCAlgorithm):
         # Indicators
         
     def OnData(self, slice):
+        # Manage long position on ES
+        self.exits.on_data(slice)
+        
+        # already in a position or waiting for the entry to fill, or the TP or SL have been triggered
+        if len(self.exits) or self.exits.entering() or self.stop_hit or self.profit_hit:
+            return
+        
         for chain in slice.FutureChains:
-            # Get contracts expiring no earlier than in 90 days
-            contracts = list(filter(lambda x: x.Expiry > self.Time + timedelta(90), chain.Value))
-
-            # if there is any contract, trade the front contract
-            if len(contracts) == 0: continue
-            front = sorted(contracts, key = lambda x: x.Expiry, reverse=True)[0]
-            front_symbol = front.Symbol
-            current_position_size = self.Securities[front_symbol].Holdings.Quantity
+            # Get the contract expiring last, if it expires no earlier than in 90 days
+            front = max(chain.Value, key=lambda x: x.Expiry, default=None)
+            if front is None or front.Expiry <= self.Time + timedelta(90): continue
+            if self.Securities[front.Symbol].Holdings.Quantity != 0: continue
+            
+            # Check margin requirements and available cash that aligns with risk tolerance
             
-            # my portfolio does not have a position with ES, and the TP or SL have not been triggered yet
-            if current_position_size == 0:
-                # Check margin requirements and available cash that aligns with risk tolerance
+            # Enter 1 lot long position, the stop and target are set when it fills
+            ticket = self.exits.enter(front.Symbol, 1, self.OnEntry)
+            if ticket.Status == OrderStatus.Invalid: continue
+            return
             
-                # Enter 1 lot long position
-                if not self.stop_hit and not self.profit_hit:
-                    self.MarketOrder(front_symbol, 1)
-                    self.Log("Buy >> {}".format(front.LastPrice))
-            else: # Manage long position on ES
-                pos_return = self.Securities[front_symbol].Holdings.UnrealizedProfitPercent
-                if pos_return >= self.take_profit or pos_return <= self.stop_loss:
-                    self.Liquidate()
-                    pos_return = pos_return * 100
-                    if pos_return > 0:
-                        self.profit_hit = True
-                        self.Debug("Profit hit: {}%".format(pos_return))
-                    else:
-                        self.stop_hit = True
-                        self.Debug("Stop loss hit: {}%".format(pos_return))
+    def OnEntry(self, symbol, quantity, price):
+        last = self.Securities[symbol].Price
+        self.Log("Buy >> {}".format(last))
+        self.journal.signal('BUY', symbol, last)
+        self.entry_price = price
+        self.exits.add(symbol, quantity, stop=price * (1 + self.stop_loss), target=price * (1 + self.take_profit))
+        
+    def OnOrderEvent(self, order_event):
+        self.exits.on_order_event(order_event, order_event.Status in (OrderStatus.Canceled, OrderStatus.Invalid))
+        
+    def OnExit(self, exit, kind, ticket):
+        pos_return = (ticket.AverageFillPrice / self.entry_price - 1) * 100
+        if kind == TARGET:
+            self.profit_hit = True
+            self.Debug("Profit hit: {}%".format(pos_return))
+            self.journal.signal('TARGET', exit.symbol, pos_return)
+        else:
+            self.stop_hit = True
+            self.Debug("Stop loss hit: {}%".format(pos_return))
+            self.journal.signal('STOP', exit.symbol, pos_return)
@@ -1,7 +1,11 @@
-import clr
-import decimal as d
+from AlgorithmBase import *
 
-import pandas as pd
+from ConsolidationTree import ConsolidationTree
+from ContinuousFuture import ContinuousFuture
+from FastIndicators import SimpleMovingAverage
+from FuturesRollManager import FuturesRollManager
+from IndicatorWarmUp import consolidate_bars, history_bars, load_sma
+from TradeJournal import journal_for
 
 
 class FuturesMovingAverageCrossOverExample2(QCAlgorithm):
@@ -19,17 +23,37 @@ class FuturesMovingAverageCrossOverExample2(QCAlgorithm):
         self.new_day = True
         self.reset = True
         
+        # Signals and the hourly SMAs are recorded in the run's journal, if it has one
+        self.journal = journal_for(self)
+        
         # Risk management
         
         # Subscribe and set our expiry filter for the futures chain
         futureES = self.AddFuture(Futures.Indices.SP500EMini)
         futureES.SetFilter(TimeSpan.Zero, TimeSpan.FromDays(360))
         
-        # Indicators
-        self.slow_sma = None
-        self.slow_sma_period = 50
-        self.fast_sma = None
-        self.fast_sma_period = 18
+        # Contract selection, rolling roll_days (3 by default) before expiry. The hourly
+        # bars come from a consolidation tree over the minute feed, moved to the new
+        # contract at each roll.
+        roll_days = int(self.GetParameter('roll_days') or 3)
+        
+        # Indicators, over the hourly back-adjusted continuous series. They are warmed up
+        # once and adjusted at each roll instead of being rebuilt for the new contract, so
+        # they are the FastIndicators ones, which have adjust(), rather than LEAN's.
+        self.slow_sma_period = int(self.GetParameter('slow_sma_period') or 50)
+        self.fast_sma_period = int(self.GetParameter('fast_sma_period') or 18)
+        self.slow_sma = SimpleMovingAverage(self.slow_sma_period)
+        self.fast_sma = SimpleMovingAverage(self.fast_sma_period)
+        
+        self.continuous = ContinuousFuture('ES', Resolution.Hour, self.GetParameter('adjustment') or 'ratio',
+                                           store=self.GetParameter('continuous_store'),
+                                           schedule='roll{}d'.format(roll_days))
+        self.continuous.add_indicator(self.slow_sma)
+        self.continuous.add_indicator(self.fast_sma)
+        
+        self.roll = FuturesRollManager(self, roll_days=roll_days, on_roll=self.journal.roll)
+        self.bars = ConsolidationTree(self, TimeSpan.FromMinutes(1))
+        self.bars.subscribe(TimeSpan.FromMinutes(60), self.OnHour)
         
     def OnData(self, slice):
         
@@ -40,6 +64,7 @@ class FuturesMovingAverageCrossOverExample2(QCAlgorithm):
         if self.reset:
             self.reset = False
             self.Log('RESET: closing all positions')
+            self.journal.signal('RESET', self.contract.Symbol)
             self.Liquidate()
             
     def InitUpdateContract(self, slice):
@@ -47,61 +72,46 @@ class FuturesMovingAverageCrossOverExample2(QCAlgorithm):
         if not self.new_day:
             return True
             
-        if self.contract != None and (self.contract.Expiry - self.Time).days >= 3: # rolling 3 days before expiry
-            return True
-            
-        for chain in slice.FutureChains.Values:
-            # When selecting contract, if on expiry date then skip first as it would be the same one.
-            idx = 0
-            if self.contract != None:
-                self.Log('Expiry days away {} - {}'.format((self.contract.Expiry-self.Time).days, self.contract.Expiry))
-            if self.contract != None and (self.contract.Expiry - self.Time).days < 3:
-                idx = 1
-            
-            contracts = list(chain.Contracts.Values)
-            
-            chain_contracts = list(contracts) #[contract for contract in chain]
-            chain_contracts = sorted(chain_contracts, key=lambda x: x.Expiry)
-            
-            if len(chain_contracts) < 2:
-                return False
-                
-            first = chain_contracts[idx]
-            second = chain_contracts[idx+1]
+        if not self.roll.update(slice):
+            return False
             
-            if (first.Expiry - self.Time).days >= 3:
-                self.contract = first
-            elif (first.Expiry - self.Time).days < 3 and (second.Expiry - self.Time).days >= 3:
-                self.contract = second
+        if self.roll.rolled:
+            previous = self.contract
+            self.contract = self.roll.contract
             self.Log("Setting contract to: {}".format(self.contract.Symbol.Value))
-            
-            self.new_day = False
+            if previous is not None:
+                self.bars.remove(previous.Symbol)
+            self.bars.add(self.contract.Symbol)
+            if previous is None:
+                self.WarmUpIndicators()
+            else:
+                self.continuous.roll(self.Time, self.contract.Symbol, self.Securities[previous.Symbol].Price,
+                                     self.Securities[self.contract.Symbol].Price)
             self.reset = True
             
-            # Set up consolidators.
-            one_hour = TradeBarConsolidator(TimeSpan.FromMinutes(60))
-            one_hour.DataConsolidated += self.OnHour
-            
-            self.SubscriptionManager.AddConsolidator(self.contract.Symbol, one_hour)
-            
-            # Set up indicators.
-            self.slow_sma = self.SMA(self.contract.Symbol, self.slow_sma_period, Resolution.Hour)
-            self.fast_sma = self.SMA(self.contract.Symbol, self.fast_sma_period, Resolution.Hour)
-            
-            history = self.History(self.contract.Symbol, 50*60, Resolution.Minute).reset_index(drop=False)
-            
-            for bar in history.itertuples():
-                if bar.time.minute == 0 and ((self.Time-bar.time)/pd.Timedelta(minutes=1)) >= 2:
-                    self.slow_sma.Update(bar.time, bar.close)
-                    self.fast_sma.Update(bar.time, bar.close)
-            
-            return True
-        return False
+        self.new_day = False
+        return True
+        
+    def WarmUpIndicators(self):
+        # Use the cached continuous series if it covers the warm-up, otherwise consolidate the
+        # minute history of the first contract into the hourly bars the consolidator would
+        # have produced
+        bars = self.continuous.bars(self.slow_sma_period, self.Time)
+        times, closes = bars[0], bars[4]
+        if len(closes) < self.slow_sma_period:
+            bars = history_bars(self, self.contract.Symbol, self.slow_sma_period*60, Resolution.Minute)
+            times, closes = consolidate_bars(bars, self.Time, 60)
+        
+        load_sma(self.slow_sma, times, closes, self.slow_sma_period)
+        load_sma(self.fast_sma, times, closes, self.fast_sma_period)
         
     def OnHour(self, sender, bar):
-        if (self.slow_sma != None and self.slow_sma.IsReady and self.fast_sma != None and self.fast_sma.IsReady):
+        self.continuous.update(bar)
+        
+        if (self.slow_sma.IsReady and self.fast_sma.IsReady):
             if bar.Symbol == self.contract.Symbol:
                 price = bar.Close
+                self.journal.snapshot(bar.Symbol, fast_sma=self.fast_sma, slow_sma=self.slow_sma)
                 
                 holdings = self.Portfolio[self.contract.Symbol].Quantity
                 
@@ -109,9 +119,11 @@ class FuturesMovingAverageCrossOverExample2(QCAlgorithm):
                     # Go long
                     if self.fast_sma > self.slow_sma:
                         self.Log("BUY >> {}".format(price))
+                        self.journal.signal('BUY', bar.Symbol, price)
                         self.MarketOrder(self.contract.Symbol, 1)
                 if holdings > 0 and self.fast_sma < self.slow_sma:
                     self.Log("SELL >> {}".format(price))
+                    self.journal.signal('SELL', bar.Symbol, price)
                     self.Liquidate()
         else:
             self.Log('SMAs not ready yet')
@@ -119,3 +131,4 @@ class FuturesMovingAverageCrossOverExample2(QCAlgorithm):
         
     def OnEndOfDay(self):
         self.new_day = True
+        self.continuous.flush()
@@ -0,0 +1,199 @@
+from bisect import bisect_left, insort
+from datetime import timedelta
+
+
+class ContractPipeline:
+    '''
+    The consolidators and indicators attached to a single futures contract.
+    '''
+    __slots__ = ('symbol', 'consolidators', 'indicators')
+
+    def __init__(self, symbol):
+        self.symbol = symbol
+        self.consolidators = []     # (consolidator, handler) pairs
+        self.indicators = dict()
+
+
+class FuturesRollManager:
+    '''
+    Keeps the contracts of a futures chain in an expiry sorted index and selects the
+    front (and optionally next) contract with a binary search, rolling a fixed number
+    of days before expiry.
+
+    The manager owns the consolidator and indicator pipeline of every contract it selects.
+    When a contract is no longer the front or next contract its consolidators are removed
+    from the SubscriptionManager and unhooked, so nothing keeps being updated after a roll.
+
+        self.roll = FuturesRollManager(self, roll_days=3)
+        self.roll.add_consolidator(partial(TradeBarConsolidator, TimeSpan.FromMinutes(60)), self.OnHour)
+        self.roll.add_indicator('sma', partial(SimpleMovingAverage, 50))
+
+    With several futures subscribed, each root has a manager given its canonical symbol, which
+    selects from that root's chain rather than from the first chain of the slice.
+
+    Each roll is reported to on_roll(symbol, previous, price, previous_price), the signature of
+    TradeJournal.roll(), with previous None for the first contract:
+
+        self.roll = FuturesRollManager(self, roll_days=3, on_roll=journal_for(self).roll)
+    '''
+
+    def __init__(self, algorithm, roll_days=3, track_next=False, on_attach=None, canonical=None, on_roll=None):
+        self.algorithm = algorithm
+        self.roll_period = timedelta(days=roll_days)
+        self.track_next = track_next
+        self.on_attach = on_attach      # called with each newly created ContractPipeline
+        self.on_roll = on_roll          # called with each front contract change
+        self.canonical = canonical
+
+        self.contract = None
+        self.next_contract = None
+        self.rolled = False
+
+        # Expiry index: sorted (expiry, symbol value) keys, plus the contracts they refer to
+        self._keys = []
+        self._contracts = dict()        # symbol -> contract
+        self._key_of = dict()           # symbol -> key in self._keys
+        self._by_key = dict()           # key -> symbol
+
+        self._consolidator_specs = []   # (factory, handler)
+        self._indicator_specs = []      # (name, factory, consolidator index)
+        self._pipelines = dict()        # symbol -> ContractPipeline
+
+    def add_consolidator(self, factory, handler=None):
+        '''Registers a consolidator factory, created for every selected contract. Returns its index.'''
+        self._consolidator_specs.append((factory, handler))
+        return len(self._consolidator_specs) - 1
+
+    def add_indicator(self, name, factory, consolidator=0):
+        '''Registers an indicator factory, fed by the consolidator with the given index.'''
+        self._indicator_specs.append((name, factory, consolidator))
+
+    def update(self, slice):
+        '''
+        Syncs the expiry index with the slice's chain and rolls if the current contract is
+        within roll_days of expiry. Returns False while no contract can be selected.
+        '''
+        self.rolled = False
+        time = self.algorithm.Time
+
+        # rolling n days before expiry
+        if self.contract is not None and self.contract.Expiry - time >= self.roll_period:
+            return True
+
+        chains = slice.FutureChains
+        if self.canonical is not None:
+            if not chains.ContainsKey(self.canonical):
+                return False
+            self.sync(chains[self.canonical].Contracts.Values)
+            return self.select(time)
+        for chain in chains.Values:
+            self.sync(chain.Contracts.Values)
+            return self.select(time)
+        return False
+
+    def sync(self, contracts):
+        '''Inserts new contracts into the expiry index and drops the ones that left the chain.'''
+        seen = set()
+        for contract in contracts:
+            symbol = contract.Symbol
+            seen.add(symbol)
+            self._contracts[symbol] = contract
+            if symbol not in self._key_of:
+                key = (contract.Expiry, symbol.Value)
+                insort(self._keys, key)
+                self._key_of[symbol] = key
+                self._by_key[key] = symbol
+
+        if len(seen) != len(self._key_of):
+            for symbol in [s for s in self._key_of if s not in seen]:
+                key = self._key_of.pop(symbol)
+                del self._keys[bisect_left(self._keys, key)]
+                del self._by_key[key]
+                del self._contracts[symbol]
+
+    def select(self, time):
+        '''Selects the first contract expiring at least roll_days after time.'''
+        idx = bisect_left(self._keys, (time + self.roll_period,))
+        needed = 2 if self.track_next else 1
+        if len(self._keys) - idx < needed:
+            return False
+
+        front = self._contracts[self._by_key[self._keys[idx]]]
+        second = None
+        if idx + 1 < len(self._keys):
+            second = self._contracts[self._by_key[self._keys[idx + 1]]]
+
+        previous = self.contract
+        self.rolled = previous is None or previous.Symbol != front.Symbol
+        self.contract = front
+        if self.rolled and self.on_roll is not None:
+            self._report_roll(previous, front)
+        self.next_contract = second
+
+        wanted = [front.Symbol]
+        if self.track_next:
+            wanted.append(second.Symbol)
+        for symbol in [s for s in self._pipelines if s not in wanted]:
+            self.detach(symbol)
+        for symbol in wanted:
+            if symbol not in self._pipelines:
+                self.attach(symbol)
+        return True
+
+    def _report_roll(self, previous, front):
+        securities = self.algorithm.Securities
+        price = securities[front.Symbol].Price if securities.ContainsKey(front.Symbol) else 0.0
+        if previous is None:
+            self.on_roll(front.Symbol, None, price, 0.0)
+            return
+        previous_price = securities[previous.Symbol].Price if securities.ContainsKey(previous.Symbol) else 0.0
+        self.on_roll(front.Symbol, previous.Symbol, price, previous_price)
+
+    def attach(self, symbol):
+        '''Creates and subscribes the consolidators and indicators for a contract.'''
+        algorithm = self.algorithm
+        pipeline = ContractPipeline(symbol)
+
+        for factory, handler in self._consolidator_specs:
+            consolidator = factory()
+            algorithm.SubscriptionManager.AddConsolidator(symbol, consolidator)
+            pipeline.consolidators.append((consolidator, handler))
+
+        for name, factory, idx in self._indicator_specs:
+            indicator = factory()
+            algorithm.RegisterIndicator(symbol, indicator, pipeline.consolidators[idx][0])
+            pipeline.indicators[name] = indicator
+
+        # Handlers are hooked last so the indicators are already updated when they run
+        for consolidator, handler in pipeline.consolidators:
+            if handler is not None:
+                consolidator.DataConsolidated += handler
+
+        self._pipelines[symbol] = pipeline
+        if self.on_attach is not None:
+            self.on_attach(pipeline)
+        return pipeline
+
+    def detach(self, symbol):
+        '''Removes the consolidators of a contract so they stop receiving data.'''
+        pipeline = self._pipelines.pop(symbol, None)
+        if pipeline is None:
+            return
+        for consolidator, handler in pipeline.consolidators:
+            self.algorithm.SubscriptionManager.RemoveConsolidator(symbol, consolidator)
+            if handler is not None:
+                consolidator.DataConsolidated -= handler
+
+    def pipeline(self, symbol=None):
+        if symbol is None:
+            symbol = self.contract.Symbol
+        return self._pipelines.get(symbol)
+
+    def indicator(self, name, symbol=None):
+        '''Returns the named indicator of a contract, the front contract by default.'''
+        pipeline = self.pipeline(symbol)
+        return None if pipeline is None else pipeline.indicators[name]
+
+    def contracts(self):
+        '''Contracts in expiry order.'''
+        return [self._contracts[self._by_key[key]] for key in self._keys]
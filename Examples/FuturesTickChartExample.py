@@ -1,5 +1,8 @@
-import clr
-import decimal as d
+from AlgorithmBase import *
+
+from ArrayTickConsolidator import ArrayTickConsolidator
+from LazyLog import LazyLog, parse_level
+from TradeJournal import journal_for
 
 
 class FuturesTickChartExample(QCAlgorithm):
@@ -15,9 +18,12 @@ class FuturesTickChartExample(QCAlgorithm):
         self.SetTimeZone('America/Los_Angeles') # Set timezone
         self.SetWarmUp(5, Resolution.Day) # Wait 5 days before trading
         
-        self.fastPeriod = 50
-        self.slowPeriod = 100
-        self.tickLength = 512
+        self.fastPeriod = int(self.GetParameter('fastPeriod') or 50)
+        self.slowPeriod = int(self.GetParameter('slowPeriod') or 100)
+        self.tickLength = int(self.GetParameter('tickLength') or 512)
+        
+        # Define a small tolerance on our checks to avoid bouncing
+        self.tolerance = float(self.GetParameter('tolerance') or 0.00015)
         
         # Subscribe and set our expiry filter for the futures chain
         self.futureES = self.AddFuture(Futures.Indices.SP500EMini, Resolution.Tick)
@@ -25,44 +31,62 @@ class FuturesTickChartExample(QCAlgorithm):
         
         self.consolidators = dict()
         
+        # Signals are buffered and formatted at the end of each day
+        self.log = LazyLog(self, level=parse_level(self.GetParameter('log_level')))
+        self.signals = self.log.channel('signals', sink=self.Debug)
+        self.journal = journal_for(self)
+        
         # Indicators
         self.fastSMA = self.SMA(self.futureES.Symbol, self.fastPeriod)
         self.slowSMA = self.SMA(self.futureES.Symbol, self.slowPeriod)
         self.previous = None
         
-    def onData(self, slice):
-        pass
-        
-    def OnDataConsolidated(self, sender, bar):
-        self.fastSMA.Update(bar.EndTime, bar.Close)
-        self.slowSMA.Update(bar.EndTime, bar.Close)
-        
-        # Define a small tolerance on our checks to avoid bouncing
-        tolerance = 0.00015
-        
-        position = self.Portfolio[self.futureES.Symbol].Quantity
+    def OnData(self, slice):
+        # Feed the array backed consolidators the ticks of the slice in one call, they close
+        # a bar every tickLength quote ticks and hand the bars of the slice over as one batch
+        for symbol, consolidator in self.consolidators.items():
+            if slice.Ticks.ContainsKey(symbol):
+                consolidator.update_ticks(slice.Ticks[symbol])
         
-        # Only go long if not currently short or flat
-        if position <= 0:
-            if self.fastSMA.Current.Value > self.slowSMA.Current.Value * (1 + tolerance):
-                self.Debug("Buy >> {}".format(bar.Ask))
-                self.MarketOrder(self.futureES.Symbol, 1)
-                
-        # Liquidate position if we are currently long if the fast sma is less than the
-        # slow sma
-        if position > 0 and self.fastSMA.Current.Value < self.slowSMA.Current.Value:
-            self.Debug("Sell >> {}".format(bar.Bid))
-            self.Liquidate(self.futureES.Symbol)
+    def OnBars(self, sender, batch):
+        # The bars are columns of the batch, a bar object is only built for a signal's log
+        n = batch.count
+        ends = batch.end_time[:n].astype('datetime64[us]').tolist()
+        closes = batch.close.tolist()
+        for i in range(n):
+            self.fastSMA.Update(ends[i], closes[i])
+            self.slowSMA.Update(ends[i], closes[i])
+            
+            position = self.Portfolio[self.futureES.Symbol].Quantity
+            
+            # Only go long if not currently short or flat
+            if position <= 0:
+                if self.fastSMA.Current.Value > self.slowSMA.Current.Value * (1 + self.tolerance):
+                    bar = batch.bar(i)
+                    self.signals("Buy >> {}", bar.Ask)
+                    self.journal.signal('BUY', bar.Symbol, bar.Ask.Close)
+                    self.MarketOrder(self.futureES.Symbol, 1)
+                    
+            # Liquidate position if we are currently long if the fast sma is less than the
+            # slow sma
+            if position > 0 and self.fastSMA.Current.Value < self.slowSMA.Current.Value:
+                bar = batch.bar(i)
+                self.signals("Sell >> {}", bar.Bid)
+                self.journal.signal('SELL', bar.Symbol, bar.Bid.Close)
+                self.Liquidate(self.futureES.Symbol)
 
     def OnSecuritiesChanged(self, changes):
         for security in changes.AddedSecurities:
             # consolidator = QuoteBarConsolidator(timedelta(minutes=15))
-            consolidator = TickQuoteBarConsolidator(self.tickLength)
-            consolidator.DataConsolidated += self.OnDataConsolidated
-            self.SubscriptionManager.AddConsolidator(security.Symbol, consolidator)
+            consolidator = ArrayTickConsolidator(self.tickLength, batch_size=64, quote_type=TickType.Quote)
+            consolidator.DataConsolidated += self.OnBars
             self.consolidators[security.Symbol] = consolidator
             
         for security in changes.RemovedSecurities:
-            consolidator = self.consolidators.pop(security.Symbol)
-            self.SubscriptionManager.RemoveConsolidator(security.Symbol, consolidator)
-            consolidator.DataConsolidated -= self.OnDataConsolidated
+            self.consolidators.pop(security.Symbol, None)
+            
+    def OnEndOfDay(self):
+        self.log.flush()
+        
+    def OnEndOfAlgorithm(self):
+        self.log.flush()
@@ -0,0 +1,267 @@
+'''
+Low overhead profiling of algorithm event handlers, consolidators and indicators.
+
+attach() replaces the handlers of an algorithm instance (by default every method its class
+defines, OnData, OnHour, InitUpdateContract, ...) with timing wrappers stored on the
+instance, so handlers registered afterwards as bound methods (consolidator events) are timed
+too and no handler body changes. wrap_class() times a method of a class for all its
+instances, such as TradeBarConsolidator.Update or SimpleMovingAverage.Update.
+
+Every call costs two clock reads and a histogram increment. Latencies go into log-linear
+(HDR style) histograms with 32 sub-buckets per power of two, about 3% precision, and the
+slowest calls are kept with the algorithm time they happened at. One call in
+sample_every is also measured for allocations: the change in allocated blocks, and the peak
+traced memory if tracemalloc is tracing. Times are inclusive of nested handlers.
+
+    profiler = HandlerProfiler()
+    profiler.attach(algorithm)                  # before Initialize
+    profiler.wrap_class(SimpleMovingAverage, 'Update')
+    ...
+    print(profiler.report())
+
+LocalReplay does this with --profile.
+'''
+
+import heapq
+import sys
+import time as timer
+import tracemalloc
+
+
+SUB_BITS = 5
+SUB_BUCKETS = 1 << SUB_BITS
+BUCKETS = (64 - SUB_BITS) * SUB_BUCKETS
+
+
+def bucket_index(ns):
+    '''Log-linear bucket of a duration: exact below 64 ns, then 32 buckets per power of two.'''
+    bits = ns.bit_length()
+    if bits <= SUB_BITS + 1:
+        return ns
+    shift = bits - SUB_BITS - 1
+    return (shift << SUB_BITS) + (ns >> shift)
+
+
+def bucket_value(index):
+    '''The lowest duration of a bucket.'''
+    if index < 2 * SUB_BUCKETS:
+        return index
+    shift = (index >> SUB_BITS) - 1
+    return (index - (shift << SUB_BITS)) << shift
+
+
+class Histogram:
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.counts = [0] * BUCKETS
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, ns):
+        self.counts[bucket_index(ns)] += 1
+        self.count += 1
+        self.total += ns
+        if ns > self.max:
+            self.max = ns
+
+    def add_repeated(self, ns, count):
+        '''Adds count samples of the same duration.'''
+        self.counts[bucket_index(ns)] += count
+        self.count += count
+        self.total += ns * count
+        if ns > self.max:
+            self.max = ns
+
+    def percentile(self, p):
+        '''The duration in ns below which p percent of the calls fall, to the bucket precision.'''
+        if self.count == 0:
+            return 0
+        rank = max(1, int(self.count * p / 100.0 + 0.5))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bucket_value(index), self.max)
+        return self.max
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+
+class HandlerStats:
+    '''Calls, latency histogram, slowest calls and sampled allocations of one handler.'''
+    __slots__ = ('name', 'profiler', 'calls', 'histogram', 'worst', 'samples', 'blocks', 'traced', 'peak')
+
+    def __init__(self, name, profiler, worst):
+        self.name = name
+        self.profiler = profiler
+        self.calls = 0
+        self.histogram = Histogram()
+        # min-heap of (ns, call number, algorithm time) holding the slowest calls
+        self.worst = [(0, 0, None)] * worst
+        self.samples = 0
+        self.blocks = 0
+        self.traced = 0
+        self.peak = 0
+
+    def record(self, ns):
+        self.histogram.add(ns)
+        if ns > self.worst[0][0]:
+            # the algorithm time is only read for calls that make the list
+            time = getattr(self.profiler.algorithm, 'Time', None)
+            heapq.heapreplace(self.worst, (ns, self.calls, time))
+
+
+def format_ns(ns):
+    if ns >= 1e9:
+        return '{:.2f}s'.format(ns / 1e9)
+    if ns >= 1e6:
+        return '{:.2f}ms'.format(ns / 1e6)
+    if ns >= 1e3:
+        return '{:.1f}us'.format(ns / 1e3)
+    return '{:.0f}ns'.format(ns)
+
+
+class HandlerProfiler:
+
+    def __init__(self, sample_every=1000, worst=5):
+        self.sample_every = sample_every
+        self.worst = worst
+        self.stats = dict()
+        self.algorithm = None
+        self._restore = []
+
+    def _stats(self, name):
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = self.stats[name] = HandlerStats(name, self, self.worst)
+        return stats
+
+    def _wrap(self, stats, function):
+        clock = timer.perf_counter_ns
+        record = stats.record
+        sample_every = self.sample_every or sys.maxsize
+        sampled = self._sampled
+
+        def timed(*args, **kwargs):
+            calls = stats.calls = stats.calls + 1
+            if calls % sample_every == 0:
+                return sampled(stats, function, args, kwargs)
+            # a call that raises is not recorded
+            start = clock()
+            result = function(*args, **kwargs)
+            record(clock() - start)
+            return result
+
+        timed.__wrapped__ = function
+        timed.__name__ = getattr(function, '__name__', stats.name)
+        return timed
+
+    def _sampled(self, stats, function, args, kwargs):
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+        blocks = sys.getallocatedblocks()
+        start = timer.perf_counter_ns()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            elapsed = timer.perf_counter_ns() - start
+            stats.samples += 1
+            stats.blocks += sys.getallocatedblocks() - blocks
+            if tracing:
+                stats.traced += 1
+                stats.peak += tracemalloc.get_traced_memory()[1] - base
+            stats.record(elapsed)
+
+    def attach(self, algorithm, handlers=None):
+        '''
+        Times the named methods of an algorithm instance, by default every method defined by its
+        class and the classes between it and QCAlgorithm. Returns the algorithm.
+        '''
+        self.algorithm = algorithm
+        if handlers is None:
+            handlers = []
+            for cls in type(algorithm).__mro__:
+                if cls.__module__ in ('LocalLean', 'builtins') or cls.__name__ == 'QCAlgorithm':
+                    break
+                handlers.extend(n for n, v in vars(cls).items()
+                                if callable(v) and not n.startswith('__') and n not in handlers)
+        for name in handlers:
+            function = getattr(algorithm, name)
+            setattr(algorithm, name, self._wrap(self._stats(name), function))
+            self._restore.append((algorithm, name, None))
+        return algorithm
+
+    def wrap_class(self, cls, method, name=None):
+        '''Times a method of a class for every instance, until detach().'''
+        own = cls.__dict__.get(method)
+        function = getattr(cls, method)
+        setattr(cls, method, self._wrap(self._stats(name or '{}.{}'.format(cls.__name__, method)), function))
+        # an inherited method is restored by removing the wrapper
+        self._restore.append((cls, method, own))
+
+    def detach(self):
+        '''Removes every wrapper. The statistics are kept.'''
+        for owner, name, function in reversed(self._restore):
+            if function is None:
+                delattr(owner, name)
+            else:
+                setattr(owner, name, function)
+        self._restore = []
+
+    def report(self, top=20):
+        '''The handlers by total time, with latency percentiles and the slowest calls.'''
+        rows = sorted((s for s in self.stats.values() if s.calls), key=lambda s: -s.histogram.total)[:top]
+        if not rows:
+            return 'no handler calls'
+        header = ['handler', 'calls', 'total', 'mean', 'p50', 'p99', 'p99.9', 'max', 'blocks/call', 'peak/call']
+        lines = [header]
+        for s in rows:
+            h = s.histogram
+            lines.append([s.name, str(s.calls), format_ns(h.total), format_ns(h.mean),
+                          format_ns(h.percentile(50)), format_ns(h.percentile(99)),
+                          format_ns(h.percentile(99.9)), format_ns(h.max),
+                          '{:.1f}'.format(s.blocks / s.samples) if s.samples else '-',
+                          '{:.0f}B'.format(s.peak / s.traced) if s.traced else '-'])
+        widths = [max(len(line[i]) for line in lines) for i in range(len(header))]
+        text = ['  '.join(cell.ljust(w) if i == 0 else cell.rjust(w) for i, (cell, w) in enumerate(zip(line, widths)))
+                for line in lines]
+
+        worst = sorted(((ns, s.name, time) for s in rows for ns, _, time in s.worst if ns), reverse=True)
+        text.append('')
+        text.append('slowest calls:')
+        for ns, name, time in worst[:top]:
+            text.append('  {:>10}  {}  at {}'.format(format_ns(ns), name, time))
+        return '\n'.join(text)
+
+    def write_report(self, path, top=20):
+        with open(path, 'w') as f:
+            f.write(self.report(top) + '\n')
+
+
+def profile_replay(replay, sample_every=1000):
+    '''
+    A profiler attached to a LocalReplay's algorithm, also timing the LocalLean consolidators,
+    the FastIndicators updates and the ArrayTickConsolidator if the algorithm uses it.
+    '''
+    import FastIndicators
+    import LocalLean
+
+    profiler = HandlerProfiler(sample_every)
+    profiler.attach(replay.algorithm)
+    for cls in (LocalLean.TradeBarConsolidator, LocalLean.TickQuoteBarConsolidator):
+        profiler.wrap_class(cls, 'Update')
+    for cls in vars(FastIndicators).values():
+        if isinstance(cls, type) and issubclass(cls, FastIndicators.Indicator) and 'Update' in vars(cls):
+            profiler.wrap_class(cls, 'Update')
+    module = sys.modules.get('ArrayTickConsolidator')
+    if module is not None:
+        # Update() adds its tick through update_ticks(), which is timed instead so a tick isn't counted twice
+        profiler.wrap_class(module.ArrayTickConsolidator, 'update_ticks')
+        profiler.wrap_class(module.ArrayTickConsolidator, 'update_many')
+    return profiler
@@ -0,0 +1,292 @@
+'''
+On-disk cache of history requests, in front of a history_arrays() style provider.
+
+For each symbol and resolution the cache holds segments: time ranges in which every bar is
+known, each stored as one binary file of columns (a row count, the int64 end times in ns and
+the float64 open, high, low, close and volume columns). A request for the last n bars or for
+a period ending at some time is served from a segment that covers it; otherwise it is
+fetched from the provider and the new range is merged with the segments it overlaps or
+touches into a single file, so reruns and overlapping warm-ups grow a few segments rather
+than many small ones.
+
+    <cache>/<ticker>/<resolution>/<symbol>/<start ns>_<end ns>.bars
+
+Reading a segment touches its file, and when the cache grows past max_bytes the files used
+least recently are deleted. Files are written under a temporary name and renamed, so sweep
+workers can share a cache folder.
+
+    cache = HistoryCache('~/history-cache')
+    algorithm._history_arrays = cache.wrap(data.history_arrays)
+
+LocalReplay does this with --history-cache. In the cloud, attach() puts the cache in front
+of the algorithm's History() for history_bars().
+'''
+
+import os
+import uuid
+from datetime import timedelta
+
+import numpy as np
+
+
+# folder names by Resolution value, as in a data folder
+RESOLUTION_NAMES = ('tick', 'second', 'minute', 'hour', 'daily')
+
+EXTENSION = '.bars'
+# a segment that starts before all the data
+OPEN = 'min'
+
+
+def _empty():
+    empty = np.empty(0)
+    return np.empty(0, dtype='datetime64[ns]'), empty, empty, empty, empty, empty
+
+
+def _ns(time):
+    return int(np.datetime64(time, 'ns').astype(np.int64))
+
+
+def _times_ns(times):
+    times = np.asarray(times)
+    return times.astype('datetime64[ns]').view(np.int64) if times.dtype.kind == 'M' else times.astype(np.int64)
+
+
+def write_bars(path, times, *columns):
+    '''Writes end times and the open, high, low, close and volume columns to a file, atomically.'''
+    times = _times_ns(times)
+    temporary = '{}.{}.tmp'.format(path, uuid.uuid4().hex)
+    with open(temporary, 'wb') as f:
+        np.array([len(times)], dtype=np.int64).tofile(f)
+        times.tofile(f)
+        for column in columns:
+            np.asarray(column, dtype=np.float64).tofile(f)
+    os.replace(temporary, path)
+
+
+def read_bars(path):
+    '''The end times (datetime64[ns]) and open, high, low, close and volume of a column file.'''
+    data = np.fromfile(path, dtype=np.int64)
+    n = int(data[0])
+    times = data[1:1 + n].view('datetime64[ns]')
+    values = data[1 + n:].view(np.float64)
+    return (times,) + tuple(values[i * n:(i + 1) * n] for i in range(5))
+
+
+class Segment:
+    '''A stored range [start, end] of bar end times in ns; start is None if it has no beginning.'''
+    __slots__ = ('start', 'end', 'path')
+
+    def __init__(self, start, end, path):
+        self.start = start
+        self.end = end
+        self.path = path
+
+    def covers(self, start, end):
+        return (self.start is None or (start is not None and self.start <= start)) and end <= self.end
+
+
+class HistoryCache:
+
+    def __init__(self, root, max_bytes=1 << 30):
+        self.root = os.path.expanduser(root)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._segments = dict()
+        self._size = None
+
+    def folder(self, symbol, resolution):
+        return os.path.join(self.root, symbol.ID.Symbol.lower(), RESOLUTION_NAMES[int(resolution)], symbol.Value)
+
+    def segments(self, symbol, resolution, reload=False):
+        '''The stored segments of a symbol and resolution, in start order.'''
+        key = (symbol.Value, resolution)
+        segments = None if reload else self._segments.get(key)
+        if segments is None:
+            segments = []
+            folder = self.folder(symbol, resolution)
+            if os.path.isdir(folder):
+                for name in os.listdir(folder):
+                    if not name.endswith(EXTENSION):
+                        continue
+                    start, end = name[:-len(EXTENSION)].split('_')
+                    segments.append(Segment(None if start == OPEN else int(start), int(end),
+                                            os.path.join(folder, name)))
+            segments.sort(key=lambda s: -1 << 63 if s.start is None else s.start)
+            self._segments[key] = segments
+        return segments
+
+    # Requests
+
+    def get(self, symbol, periods, resolution, end, provider):
+        '''
+        The bars of history_arrays(symbol, periods, resolution, end): the last periods bars
+        (an int) or the bars of the last periods (a timedelta) ending at or before end.
+        '''
+        end_ns = _ns(end)
+        start_ns = _ns(end - periods) if isinstance(periods, timedelta) else None
+        try:
+            bars = self._lookup(self.segments(symbol, resolution), periods, start_ns, end_ns)
+        except FileNotFoundError:
+            # evicted by another process
+            bars = self._lookup(self.segments(symbol, resolution, reload=True), periods, start_ns, end_ns)
+        if bars is not None:
+            self.hits += 1
+            return bars
+
+        self.misses += 1
+        bars = provider(symbol, periods, resolution, end)
+        times = _times_ns(bars[0])
+        if start_ns is not None:
+            start = start_ns
+        elif len(times) < periods:
+            # everything there is up to end
+            start = None
+        else:
+            start = int(times[0])
+        self.put(symbol, resolution, start, end_ns, bars)
+        return bars
+
+    @staticmethod
+    def _lookup(segments, periods, start_ns, end_ns):
+        for segment in segments:
+            if segment.start is not None and segment.start > end_ns:
+                break
+            if end_ns > segment.end or (start_ns is not None and not segment.covers(start_ns, end_ns)):
+                continue
+            bars = read_bars(segment.path)
+            times = bars[0].view(np.int64)
+            hi = int(np.searchsorted(times, end_ns, 'right'))
+            if start_ns is not None:
+                lo = int(np.searchsorted(times, start_ns, 'left'))
+            elif hi >= periods:
+                lo = hi - periods
+            elif segment.start is None:
+                lo = 0
+            else:
+                continue
+            # the file time orders the least recently used for eviction
+            os.utime(segment.path)
+            return tuple(c[lo:hi] for c in bars)
+        return None
+
+    def wrap(self, provider):
+        '''A history_arrays() style function that serves provider's bars through the cache.'''
+        def history_arrays(symbol, periods, resolution, end):
+            return self.get(symbol, periods, resolution, end, provider)
+        return history_arrays
+
+    def attach(self, algorithm):
+        '''
+        Serves the algorithm's history_bars() requests through the cache, from its local
+        history arrays if it has them, otherwise from History(). Returns the algorithm.
+        '''
+        provider = getattr(algorithm, '_history_arrays', None)
+        if provider is None:
+            from IndicatorWarmUp import history_columns
+
+            def provider(symbol, periods, resolution, end):
+                history = algorithm.History(symbol, periods, resolution)
+                if history.empty:
+                    return _empty()
+                return history_columns(history, 'open', 'high', 'low', 'close', 'volume')
+        algorithm._history_arrays = self.wrap(provider)
+        return algorithm
+
+    # Storage
+
+    def put(self, symbol, resolution, start, end, bars):
+        '''
+        Stores the bars known to be every bar ending in [start, end] (start None for all up
+        to end), merged with the stored segments that overlap or touch that range.
+        '''
+        segments = self.segments(symbol, resolution, reload=True)
+        merged = [s for s in segments
+                  if (start is None or s.end >= start) and (s.start is None or s.start <= end)]
+        parts = []
+        for segment in merged:
+            try:
+                parts.append(read_bars(segment.path))
+            except FileNotFoundError:
+                continue
+            if segment.start is None or (start is not None and segment.start < start):
+                start = segment.start
+            end = max(end, segment.end)
+        parts.append(tuple(np.asarray(c) for c in bars))
+
+        times = np.concatenate([_times_ns(p[0]) for p in parts])
+        # the newest copy of a bar wins
+        order = np.argsort(times, kind='stable')
+        times = times[order]
+        keep = np.r_[times[1:] != times[:-1], True]
+        columns = [np.concatenate([p[i] for p in parts])[order][keep] for i in range(1, 6)]
+
+        folder = self.folder(symbol, resolution)
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, '{}_{}{}'.format(OPEN if start is None else start, end, EXTENSION))
+        added = -self._file_size(path)
+        write_bars(path, times[keep], *columns)
+        added += os.path.getsize(path)
+        for segment in merged:
+            if segment.path != path:
+                added -= self._remove(segment.path)
+        self._segments.pop((symbol.Value, resolution), None)
+
+        if self._size is not None:
+            self._size += added
+        if self.size > self.max_bytes:
+            self.evict(keep=path)
+
+    @staticmethod
+    def _file_size(path):
+        try:
+            return os.path.getsize(path)
+        except FileNotFoundError:
+            return 0
+
+    def _remove(self, path):
+        size = self._file_size(path)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return 0
+        return size
+
+    def _files(self):
+        files = []
+        for folder, _, names in os.walk(self.root):
+            for name in names:
+                if name.endswith(EXTENSION):
+                    path = os.path.join(folder, name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    files.append((stat.st_mtime, stat.st_size, path))
+        return files
+
+    @property
+    def size(self):
+        '''The bytes stored, counted once and then kept up to date.'''
+        if self._size is None:
+            self._size = sum(size for _, size, _ in self._files())
+        return self._size
+
+    def evict(self, target=None, keep=None):
+        '''
+        Deletes the least recently used segments, except keep, until at most target bytes (90%
+        of max_bytes by default) are left.
+        '''
+        target = int(self.max_bytes * 0.9) if target is None else target
+        files = sorted(self._files())
+        size = sum(size for _, size, _ in files)
+        for _, file_size, path in files:
+            if size <= target:
+                break
+            if path != keep:
+                size -= self._remove(path)
+        self._size = size
+        self._segments.clear()
+
+    def clear(self):
+        self.evict(0)
@@ -0,0 +1,159 @@
+'''
+Vectorized indicator warm-up from History() frames.
+
+Instead of walking a minute history frame with itertuples() and updating indicators
+one row at a time, the frame is consolidated into bars with a few NumPy passes, the
+final state of the indicators is computed over the whole array at once, and only the
+samples an indicator actually needs to reach that state are pushed into it, so any
+indicator, LEAN's included, is loaded in O(period) updates. FastIndicators take those
+samples in one update_many() call.
+
+    times, closes = consolidate_bars(history_bars(self, symbol, 50*60, Resolution.Minute), self.Time, 60)
+    load_sma(self.slow_sma, times, closes, 50)
+    load_bollinger(self.bands, times, closes, 20, exponential=True)
+'''
+
+from datetime import timedelta
+
+from AlgorithmBase import np
+
+
+def history_columns(history, *columns):
+    '''
+    Returns the bar times (datetime64[ns]) and the requested columns as float arrays from a
+    History() frame, without flattening its (symbol, time) index. History() frames are
+    indexed by bar end time.
+    '''
+    if 'time' in history.columns:
+        times = history['time'].to_numpy(dtype='datetime64[ns]')
+    else:
+        times = history.index.get_level_values('time').to_numpy(dtype='datetime64[ns]')
+    return (times,) + tuple(history[c].to_numpy(dtype=np.float64) for c in columns)
+
+
+def consolidate_arrays(times, open, high, low, close, volume, period, now=None):
+    '''
+    Aggregates bars, given by their end times, into period bars aligned to the clock like a
+    TradeBarConsolidator. Returns end times, open, high, low, close and volume arrays. Bars
+    that have not ended by now are dropped.
+    '''
+    if len(times) == 0:
+        empty = np.empty(0)
+        return np.empty(0, dtype='datetime64[ns]'), empty, empty, empty, empty, empty
+
+    period = period // timedelta(microseconds=1) * 1000
+    ticks = times.view(np.int64)
+    buckets = (ticks - 1) // period
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:], len(ticks)] - 1
+
+    end_times = (buckets[starts] + 1) * period
+    bars = (end_times.view('datetime64[ns]'),
+            open[starts],
+            np.maximum.reduceat(high, starts),
+            np.minimum.reduceat(low, starts),
+            close[ends],
+            np.add.reduceat(volume, starts))
+
+    if now is not None:
+        done = bars[0] <= np.datetime64(now, 'ns')
+        if not done.all():
+            bars = tuple(a[done] for a in bars)
+    return bars
+
+
+def history_bars(algorithm, symbol, periods, resolution):
+    '''
+    The bars of History(symbol, periods, resolution) as end times, open, high, low, close and
+    volume arrays. Running locally the data folder returns the arrays directly without building
+    a DataFrame, and over a BarStore they are read-only views of its memory-mapped columns.
+    '''
+    provider = getattr(algorithm, '_history_arrays', None)
+    if provider is not None:
+        return provider(symbol, periods, resolution, algorithm.Time)
+    history = algorithm.History(symbol, periods, resolution)
+    if history.empty:
+        empty = np.empty(0)
+        return np.empty(0, dtype='datetime64[ns]'), empty, empty, empty, empty, empty
+    return history_columns(history, 'open', 'high', 'low', 'close', 'volume')
+
+
+def consolidate_bars(bars, now, minutes=60):
+    '''
+    Consolidates minute bars from history_bars() into completed bars of the given number of
+    minutes and returns their end times and closes.
+    '''
+    bars = consolidate_arrays(*bars, timedelta(minutes=minutes), now)
+    return bars[0], bars[4]
+
+
+def consolidate(history, now, minutes=60):
+    '''
+    Consolidates a minute History() frame into completed bars of the given number of
+    minutes and returns their end times and closes.
+    '''
+    return consolidate_bars(history_columns(history, 'open', 'high', 'low', 'close', 'volume'), now, minutes)
+
+
+def ema_seed(values, period):
+    '''
+    The exponential moving average of values, seeded with the first value like the LEAN
+    ExponentialMovingAverage: ema = x[0] * (1 - k)^(n - 1) + sum(k * (1 - k)^(n - 1 - j) * x[j]).
+    '''
+    n = len(values)
+    if n == 0:
+        return None
+    k = 2.0 / (period + 1)
+    decay = (1.0 - k) ** np.arange(n - 1, -1, -1, dtype=np.float64)
+    weights = k * decay
+    weights[0] = decay[0]
+    return float(weights @ values)
+
+
+def ema_samples(values, period, tail=0):
+    '''
+    period + tail samples that leave an EMA of period where the whole series does, with the
+    last tail values as its latest inputs. The first period samples are a constant c, which
+    makes the EMA ready at c whether it starts from its first sample or from their average,
+    and c is chosen so the tail then brings it to ema_seed(values):
+    c * (1 - k)^m + sum(k * (1 - k)^(m - 1 - j) * tail[j]) = seed.
+    '''
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) <= period + tail:
+        return values
+    k = 2.0 / (period + 1)
+    rest = values[len(values) - tail:]
+    decay = (1.0 - k) ** np.arange(tail - 1, -1, -1, dtype=np.float64)
+    c = (ema_seed(values, period) - k * (decay @ rest)) / (1.0 - k) ** tail
+    return np.r_[np.full(period, c), rest]
+
+
+def _updates(indicator, times, values):
+    times = times.astype('datetime64[us]').tolist()
+    if hasattr(indicator, 'update_many'):
+        # FastIndicators compute their state from the array without per-sample updates
+        indicator.update_many(values, times)
+        return
+    for time, value in zip(times, values.tolist()):
+        indicator.Update(time, value)
+
+
+def load_sma(indicator, times, values, period):
+    '''A simple moving average only depends on its last period samples, so only those are pushed.'''
+    _updates(indicator, times[-period:], values[-period:])
+
+
+def load_ema(indicator, times, values, period):
+    '''An exponential moving average's state is its current value, so the seed value is pushed period times.'''
+    samples = ema_samples(values, period)
+    _updates(indicator, times[len(times) - len(samples):], samples)
+
+
+def load_bollinger(indicator, times, values, period, exponential=False):
+    '''
+    Bands over a simple average only need the last period samples. The exponential middle
+    band depends on the whole series, so it is loaded with ema_samples() ahead of the last
+    period samples, which are the window of the standard deviation.
+    '''
+    samples = ema_samples(values, period, period) if exponential else np.asarray(values)[-period:]
+    _updates(indicator, times[len(times) - len(samples):], samples)
@@ -0,0 +1,142 @@
+'''
+Buffered logging that keeps message formatting off the per-bar path.
+
+A record is the format template and its raw arguments, written into preallocated slots of a
+ring buffer. Nothing is formatted until flush(), which an algorithm calls from OnEndOfDay and
+OnEndOfAlgorithm; a full buffer is flushed as well. Records go through named channels, each
+with its own level and sampling, and a disabled channel returns on its first check:
+
+    self.log = LazyLog(self, level=INFO)
+    self.hourly = self.log.channel('hourly', every=4)
+    ...
+    self.hourly('contract: {} price: {} BBL: {}', symbol.Value, price, bb.LowerBand.Current.Value)
+
+Arguments are kept as given until the flush, so pass values rather than objects that keep
+changing, such as indicators.
+'''
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+LEVELS = {'DEBUG': DEBUG, 'INFO': INFO, 'WARNING': WARNING, 'ERROR': ERROR}
+
+
+def parse_level(value, default=INFO):
+    '''A level from its name or number, as given by GetParameter; default if value is empty.'''
+    if not value:
+        return default
+    value = str(value).upper()
+    return LEVELS[value] if value in LEVELS else int(value)
+
+
+class Channel:
+    '''A log category: calling it records template and args if the channel is enabled and sampled.'''
+    __slots__ = ('log', 'name', 'level', 'every', 'sink', 'enabled', 'count')
+
+    def __init__(self, log, name, level, every, sink):
+        self.log = log
+        self.name = name
+        self.level = level
+        self.every = every
+        self.sink = sink
+        self.enabled = False
+        self.count = 0
+
+    def __call__(self, template, *args):
+        if not self.enabled:
+            return
+        if self.every > 1:
+            # keep the first of every `every` records
+            self.count += 1
+            if self.count % self.every != 1:
+                return
+        self.log.record(self, template, args)
+
+
+class LazyLog:
+    '''
+    Ring buffer of log records for an algorithm. Records are flushed to the channel sink,
+    algorithm.Log by default, stamped with the algorithm time at which they were recorded.
+    When flush_when_full is False a full buffer overwrites its oldest records instead, which
+    keeps the last capacity records for a post mortem; dropped counts the overwritten ones.
+    '''
+
+    def __init__(self, algorithm, capacity=4096, level=INFO, enabled=True, flush_when_full=True, stamp=True):
+        self.algorithm = algorithm
+        self.capacity = capacity
+        self.level = level
+        self.enabled = enabled
+        self.flush_when_full = flush_when_full
+        self.stamp = stamp
+        self.channels = dict()
+        self.dropped = 0
+
+        self._times = [None] * capacity
+        self._channels = [None] * capacity
+        self._templates = [None] * capacity
+        self._args = [None] * capacity
+        self._start = 0
+        self._size = 0
+
+    def channel(self, name, level=INFO, every=1, sink=None):
+        '''Creates or reconfigures a channel. every keeps one record out of every `every`.'''
+        channel = self.channels.get(name)
+        if channel is None:
+            channel = self.channels[name] = Channel(self, name, level, every, sink or self.algorithm.Log)
+        else:
+            channel.level, channel.every = level, every
+            if sink is not None:
+                channel.sink = sink
+        channel.enabled = self.enabled and level >= self.level
+        return channel
+
+    def set_level(self, level, enabled=True):
+        '''Sets the minimum level of every channel; enabled=False turns logging off.'''
+        self.level = level
+        self.enabled = enabled
+        for channel in self.channels.values():
+            channel.enabled = enabled and channel.level >= level
+
+    def record(self, channel, template, args):
+        capacity = self.capacity
+        if self._size == capacity:
+            if self.flush_when_full:
+                self.flush()
+            else:
+                self._start = (self._start + 1) % capacity
+                self._size -= 1
+                self.dropped += 1
+        i = (self._start + self._size) % capacity
+        self._times[i] = self.algorithm.Time
+        self._channels[i] = channel
+        self._templates[i] = template
+        self._args[i] = args
+        self._size += 1
+
+    def __len__(self):
+        return self._size
+
+    def records(self):
+        '''Formats the buffered records, oldest first, as (time, channel, message) without flushing.'''
+        capacity = self.capacity
+        for k in range(self._size):
+            i = (self._start + k) % capacity
+            yield self._times[i], self._channels[i], self._templates[i].format(*self._args[i])
+
+    def flush(self):
+        '''Formats and writes the buffered records to their sinks. Returns the number written.'''
+        written = 0
+        for time, channel, message in self.records():
+            channel.sink('{} {}'.format(time, message) if self.stamp else message)
+            written += 1
+        self.clear()
+        return written
+
+    def clear(self):
+        # drop the references to the arguments
+        for k in range(self._size):
+            self._args[(self._start + k) % self.capacity] = None
+        self._start = 0
+        self._size = 0
@@ -0,0 +1,1208 @@
+'''
+Local stand-in for the parts of the LEAN QCAlgorithm API used by the algorithms in this folder.
+
+The classes below mirror the names and members the algorithms call (QCAlgorithm, Slice,
+FutureChains, TradeBarConsolidator, SMA/EMA/BB, Portfolio, ...) closely enough that the
+algorithm files run unmodified outside of the hosted platform. install() registers fake
+clr/System/QuantConnect modules so their imports resolve, and NAMESPACE holds the names the
+platform injects into every algorithm module. LocalReplay drives an algorithm from local data.
+
+Prices are floats rather than decimals and orders fill immediately at the last price.
+'''
+
+import sys
+import types
+from datetime import date, datetime, timedelta
+
+from FastIndicators import (IndicatorDataPoint, MovingAverageType, SimpleMovingAverage, ExponentialMovingAverage,
+                            LinearWeightedMovingAverage, HullMovingAverage, StandardDeviation, BollingerBands,
+                            AverageTrueRange, ParabolicStopAndReverse)
+
+
+class Resolution:
+    Tick = 0
+    Second = 1
+    Minute = 2
+    Hour = 3
+    Daily = 4
+    Day = Daily
+
+
+RESOLUTION_PERIODS = {
+    Resolution.Tick: timedelta(0),
+    Resolution.Second: timedelta(seconds=1),
+    Resolution.Minute: timedelta(minutes=1),
+    Resolution.Hour: timedelta(hours=1),
+    Resolution.Daily: timedelta(days=1),
+}
+
+RESOLUTION_NAMES = {
+    Resolution.Tick: 'tick',
+    Resolution.Second: 'second',
+    Resolution.Minute: 'minute',
+    Resolution.Hour: 'hour',
+    Resolution.Daily: 'daily',
+}
+
+
+class TimeSpan:
+    Zero = timedelta(0)
+
+    @staticmethod
+    def FromDays(days):
+        return timedelta(days=days)
+
+    @staticmethod
+    def FromHours(hours):
+        return timedelta(hours=hours)
+
+    @staticmethod
+    def FromMinutes(minutes):
+        return timedelta(minutes=minutes)
+
+    @staticmethod
+    def FromSeconds(seconds):
+        return timedelta(seconds=seconds)
+
+
+class Futures:
+    class Indices:
+        SP500EMini = 'ES'
+        NASDAQ100EMini = 'NQ'
+        Dow30EMini = 'YM'
+
+    class Energies:
+        CrudeOilWTI = 'CL'
+
+    class Metals:
+        Gold = 'GC'
+
+    class Financials:
+        Y10TreasuryNote = 'ZN'
+
+
+# Contract multipliers of the futures roots above
+CONTRACT_MULTIPLIERS = {'ES': 50.0, 'NQ': 20.0, 'YM': 5.0, 'CL': 1000.0, 'GC': 100.0, 'ZN': 1000.0}
+
+
+class SecurityType:
+    Base = 0
+    Equity = 1
+    Future = 5
+
+
+class BrokerageName:
+    Default = 0
+    InteractiveBrokersBrokerage = 1
+    TradierBrokerage = 2
+
+
+class AccountType:
+    Margin = 0
+    Cash = 1
+
+
+class OrderStatus:
+    New = 0
+    Submitted = 1
+    PartiallyFilled = 2
+    Filled = 3
+    Canceled = 5
+    Invalid = 7
+
+
+class OrderDirection:
+    Buy = 0
+    Sell = 1
+    Hold = 2
+
+
+class TickType:
+    Trade = 0
+    Quote = 1
+
+
+class SecurityIdentifier:
+    __slots__ = ('Symbol', 'SecurityType', 'Date')
+
+    def __init__(self, ticker, security_type, expiry=None):
+        self.Symbol = ticker
+        self.SecurityType = security_type
+        self.Date = expiry
+
+
+class Symbol:
+    '''
+    Symbols are interned by value, so equal symbols are the same object. They hash and compare
+    equal to their value string, which lets strings be used wherever a symbol is expected.
+    '''
+    __slots__ = ('Value', 'ID', 'SecurityType', '_hash')
+    _cache = dict()
+
+    def __init__(self, value, ticker, security_type, expiry=None):
+        self.Value = value
+        self.ID = SecurityIdentifier(ticker, security_type, expiry)
+        self.SecurityType = security_type
+        self._hash = hash(value)
+
+    @classmethod
+    def Create(cls, ticker, security_type=SecurityType.Equity, value=None, expiry=None):
+        value = ticker if value is None else value
+        symbol = cls._cache.get(value)
+        if symbol is None:
+            symbol = cls._cache[value] = cls(value, ticker, security_type, expiry)
+        return symbol
+
+    def __eq__(self, other):
+        if other is self:
+            return True
+        if isinstance(other, Symbol):
+            return other.Value == self.Value
+        if isinstance(other, str):
+            return other == self.Value
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    def __hash__(self):
+        return self._hash
+
+    def __str__(self):
+        return self.Value
+
+    __repr__ = __str__
+
+    def __reduce__(self):
+        return (Symbol.Create, (self.ID.Symbol, self.SecurityType, self.Value, self.ID.Date))
+
+
+class KeyValuePair:
+    __slots__ = ('Key', 'Value')
+
+    def __init__(self, key, value):
+        self.Key = key
+        self.Value = value
+
+
+class NetDictionary(dict):
+    '''A dict with the members of a .NET Dictionary; iterating it yields KeyValuePairs like pythonnet.'''
+
+    def __iter__(self):
+        for key, value in self.items():
+            yield KeyValuePair(key, value)
+
+    def ContainsKey(self, key):
+        return key in self
+
+    @property
+    def Count(self):
+        return len(self)
+
+    @property
+    def Keys(self):
+        return list(self.keys())
+
+    @property
+    def Values(self):
+        return list(self.values())
+
+
+class Event:
+    '''Multicast event supporting the C# style `event += handler` and `event -= handler`.'''
+    __slots__ = ('handlers',)
+
+    def __init__(self):
+        self.handlers = []
+
+    def __iadd__(self, handler):
+        self.handlers.append(handler)
+        return self
+
+    def __isub__(self, handler):
+        if handler in self.handlers:
+            self.handlers.remove(handler)
+        return self
+
+    def __call__(self, sender, data):
+        for handler in self.handlers:
+            handler(sender, data)
+
+    def __len__(self):
+        return len(self.handlers)
+
+
+# Market data
+
+class Bar:
+    __slots__ = ('Open', 'High', 'Low', 'Close')
+
+    def __init__(self, open=0.0, high=0.0, low=0.0, close=0.0):
+        self.Open = open
+        self.High = high
+        self.Low = low
+        self.Close = close
+
+    def Update(self, value):
+        if self.Open == 0:
+            self.Open = self.High = self.Low = value
+        if value > self.High:
+            self.High = value
+        if value < self.Low:
+            self.Low = value
+        self.Close = value
+
+    def __str__(self):
+        return 'O: {} H: {} L: {} C: {}'.format(self.Open, self.High, self.Low, self.Close)
+
+
+class TradeBar:
+    __slots__ = ('Symbol', 'Time', 'EndTime', 'Open', 'High', 'Low', 'Close', 'Volume', 'Period')
+
+    def __init__(self, time=None, symbol=None, open=0.0, high=0.0, low=0.0, close=0.0, volume=0.0, period=None):
+        period = timedelta(minutes=1) if period is None else period
+        self.Symbol = symbol
+        self.Time = time
+        self.EndTime = None if time is None else time + period
+        self.Open = open
+        self.High = high
+        self.Low = low
+        self.Close = close
+        self.Volume = volume
+        self.Period = period
+
+    @property
+    def Value(self):
+        return self.Close
+
+    @property
+    def Price(self):
+        return self.Close
+
+    def Clone(self):
+        bar = TradeBar(self.Time, self.Symbol, self.Open, self.High, self.Low, self.Close, self.Volume, self.Period)
+        bar.EndTime = self.EndTime
+        return bar
+
+    def __str__(self):
+        return '{}: O: {} H: {} L: {} C: {} V: {}'.format(
+            self.Symbol, self.Open, self.High, self.Low, self.Close, self.Volume)
+
+
+class QuoteBar:
+    __slots__ = ('Symbol', 'Time', 'EndTime', 'Bid', 'Ask', 'LastBidSize', 'LastAskSize', 'Period')
+
+    def __init__(self, time=None, symbol=None, bid=None, last_bid_size=0.0, ask=None, last_ask_size=0.0, period=None):
+        period = timedelta(0) if period is None else period
+        self.Symbol = symbol
+        self.Time = time
+        self.EndTime = None if time is None else time + period
+        self.Bid = bid
+        self.Ask = ask
+        self.LastBidSize = last_bid_size
+        self.LastAskSize = last_ask_size
+        self.Period = period
+
+    def _mid(self, field):
+        bid, ask = self.Bid, self.Ask
+        if bid is None:
+            return getattr(ask, field) if ask is not None else 0.0
+        if ask is None:
+            return getattr(bid, field)
+        return (getattr(bid, field) + getattr(ask, field)) / 2.0
+
+    @property
+    def Open(self):
+        return self._mid('Open')
+
+    @property
+    def High(self):
+        return self._mid('High')
+
+    @property
+    def Low(self):
+        return self._mid('Low')
+
+    @property
+    def Close(self):
+        return self._mid('Close')
+
+    Value = Close
+    Price = Close
+
+    def __str__(self):
+        return '{}: Bid: {} Ask: {}'.format(self.Symbol, self.Bid, self.Ask)
+
+
+class Tick:
+    __slots__ = ('Symbol', 'Time', 'TickType', 'BidPrice', 'AskPrice', 'BidSize', 'AskSize', 'LastPrice', 'Quantity')
+
+    def __init__(self, time, symbol, bid=0.0, ask=0.0, bid_size=0.0, ask_size=0.0, last=0.0, quantity=0.0):
+        self.Symbol = symbol
+        self.Time = time
+        self.BidPrice = bid
+        self.AskPrice = ask
+        self.BidSize = bid_size
+        self.AskSize = ask_size
+        self.Quantity = quantity
+        self.TickType = TickType.Quote if bid > 0 and ask > 0 else TickType.Trade
+        self.LastPrice = last if last > 0 else (bid + ask) / 2.0
+
+    @property
+    def EndTime(self):
+        return self.Time
+
+    @property
+    def Value(self):
+        return self.LastPrice
+
+    Price = Value
+
+    def __str__(self):
+        return '{}: {} Bid: {} Ask: {}'.format(self.Symbol, self.LastPrice, self.BidPrice, self.AskPrice)
+
+
+# Consolidators
+
+def round_down(time, period):
+    '''Rounds a time down to a multiple of period, counted from 0001-01-01 like .NET ticks.'''
+    return time - (time - datetime.min) % period
+
+
+class _Consolidator:
+    '''Common members of the consolidators: the DataConsolidated event and the working bar.'''
+
+    def __init__(self):
+        self.DataConsolidated = Event()
+        self.WorkingData = None
+        self.Consolidated = None
+
+    def _emit(self):
+        bar = self.WorkingData
+        self.WorkingData = None
+        self.Consolidated = bar
+        self.DataConsolidated(self, bar)
+
+    def Scan(self, time):
+        pass
+
+
+class TradeBarConsolidator(_Consolidator):
+    '''Consolidates trade bars into bars of a fixed period (timedelta) or a fixed number of bars (int).'''
+
+    def __init__(self, period):
+        _Consolidator.__init__(self)
+        if isinstance(period, int):
+            self.Period = None
+            self._max_count = period
+        else:
+            self.Period = period
+            self._max_count = 0
+        self._count = 0
+        self._end = None
+
+    def Update(self, data):
+        working = self.WorkingData
+        if self.Period is not None:
+            if working is not None and data.Time >= self._end:
+                self._emit()
+                working = None
+            if working is None:
+                start = round_down(data.Time, self.Period)
+                working = self.WorkingData = TradeBar(start, data.Symbol, data.Open, data.High, data.Low,
+                                                      data.Close, data.Volume, self.Period)
+                self._end = working.EndTime
+            else:
+                self._aggregate(working, data)
+            if data.EndTime >= self._end:
+                self._emit()
+            return
+
+        if working is None:
+            working = self.WorkingData = TradeBar(data.Time, data.Symbol, data.Open, data.High, data.Low,
+                                                  data.Close, data.Volume, data.Period)
+        else:
+            self._aggregate(working, data)
+            working.EndTime = data.EndTime
+            working.Period = working.EndTime - working.Time
+        self._count += 1
+        if self._count >= self._max_count:
+            self._count = 0
+            self._emit()
+
+    @staticmethod
+    def _aggregate(working, data):
+        if data.High > working.High:
+            working.High = data.High
+        if data.Low < working.Low:
+            working.Low = data.Low
+        working.Close = data.Close
+        working.Volume += data.Volume
+
+    def Scan(self, time):
+        if self.Period is not None and self.WorkingData is not None and time >= self._end:
+            self._emit()
+
+
+class TickQuoteBarConsolidator(_Consolidator):
+    '''Consolidates quote ticks into quote bars of a fixed number of ticks.'''
+
+    def __init__(self, max_count):
+        _Consolidator.__init__(self)
+        self._max_count = max_count
+        self._count = 0
+
+    def Update(self, tick):
+        if tick.TickType != TickType.Quote:
+            return
+        working = self.WorkingData
+        if working is None:
+            working = self.WorkingData = QuoteBar(tick.Time, tick.Symbol, Bar(), 0.0, Bar(), 0.0)
+        working.Bid.Update(tick.BidPrice)
+        working.Ask.Update(tick.AskPrice)
+        working.LastBidSize = tick.BidSize
+        working.LastAskSize = tick.AskSize
+        working.EndTime = tick.Time
+        working.Period = tick.Time - working.Time
+        self._count += 1
+        if self._count >= self._max_count:
+            self._count = 0
+            self._emit()
+
+
+# Securities and portfolio
+
+class SymbolProperties:
+    __slots__ = ('ContractMultiplier', 'MinimumPriceVariation')
+
+    def __init__(self, multiplier=1.0, tick_size=0.01):
+        self.ContractMultiplier = multiplier
+        self.MinimumPriceVariation = tick_size
+
+
+class SecurityHolding:
+
+    def __init__(self, security):
+        self.Security = security
+        self.Symbol = security.Symbol
+        self.Quantity = 0
+        self.AveragePrice = 0.0
+        self.TotalFees = 0.0
+        self.Profit = 0.0
+        self.LastTradeProfit = 0.0
+
+    @property
+    def Price(self):
+        return self.Security.Price
+
+    @property
+    def AbsoluteQuantity(self):
+        return abs(self.Quantity)
+
+    @property
+    def Invested(self):
+        return self.Quantity != 0
+
+    @property
+    def IsLong(self):
+        return self.Quantity > 0
+
+    @property
+    def IsShort(self):
+        return self.Quantity < 0
+
+    @property
+    def HoldingsCost(self):
+        return self.AveragePrice * self.Quantity * self.Security.SymbolProperties.ContractMultiplier
+
+    @property
+    def AbsoluteHoldingsCost(self):
+        return abs(self.HoldingsCost)
+
+    @property
+    def HoldingsValue(self):
+        return self.Security.Price * self.Quantity * self.Security.SymbolProperties.ContractMultiplier
+
+    @property
+    def AbsoluteHoldingsValue(self):
+        return abs(self.HoldingsValue)
+
+    @property
+    def UnrealizedProfit(self):
+        return (self.Security.Price - self.AveragePrice) * self.Quantity * \
+            self.Security.SymbolProperties.ContractMultiplier
+
+    @property
+    def UnrealizedProfitPercent(self):
+        cost = self.AbsoluteHoldingsCost
+        return 0.0 if cost == 0 else self.UnrealizedProfit / cost
+
+    @property
+    def NetProfit(self):
+        return self.Profit - self.TotalFees
+
+
+class Security:
+
+    def __init__(self, symbol, security_type, resolution, multiplier=1.0, expiry=None):
+        self.Symbol = symbol
+        self.Type = security_type
+        self.Resolution = resolution
+        self.Expiry = expiry
+        self.SymbolProperties = SymbolProperties(multiplier)
+        self.Leverage = 1.0
+        self.Holdings = SecurityHolding(self)
+        self._last = None
+        self.Price = 0.0
+        self.Open = self.High = self.Low = self.Close = 0.0
+        self.Volume = 0.0
+        self.BidPrice = self.AskPrice = 0.0
+
+    def SetMarketPrice(self, data):
+        self._last = data
+        if data.__class__ is Tick:
+            if data.TickType == TickType.Quote:
+                self.BidPrice = data.BidPrice
+                self.AskPrice = data.AskPrice
+            else:
+                self.Volume += data.Quantity
+            price = data.LastPrice
+            self.Close = price
+            if price > self.High:
+                self.High = price
+            if price < self.Low or self.Low == 0:
+                self.Low = price
+        else:
+            self.Open = data.Open
+            self.High = data.High
+            self.Low = data.Low
+            self.Close = price = data.Close
+            self.Volume = getattr(data, 'Volume', 0.0)
+            if data.__class__ is QuoteBar:
+                self.BidPrice = data.Bid.Close
+                self.AskPrice = data.Ask.Close
+        self.Price = price
+
+    def GetLastData(self):
+        return self._last
+
+    @property
+    def HasData(self):
+        return self._last is not None
+
+    @property
+    def Invested(self):
+        return self.Holdings.Quantity != 0
+
+    def SetLeverage(self, leverage):
+        self.Leverage = float(leverage)
+
+
+class Future(Security):
+    '''The canonical security of a futures chain, carrying the universe filter.'''
+
+    def __init__(self, symbol, resolution):
+        Security.__init__(self, symbol, SecurityType.Future, resolution, CONTRACT_MULTIPLIERS.get(symbol.ID.Symbol, 1.0))
+        self.FilterRange = (timedelta(0), timedelta(days=35))
+
+    def SetFilter(self, min_expiry, max_expiry):
+        self.FilterRange = (min_expiry, max_expiry)
+
+
+class SecurityManager(dict):
+
+    def ContainsKey(self, symbol):
+        return symbol in self
+
+    @property
+    def Values(self):
+        return list(self.values())
+
+
+class SecurityPortfolioManager:
+    '''
+    Holdings and cash. Equity fills move cash, futures fills only realize profit into cash,
+    so TotalPortfolioValue is cash plus equity holdings value plus futures unrealized profit.
+    '''
+
+    def __init__(self, securities):
+        self.Securities = securities
+        self.Cash = 100000.0
+
+    def __getitem__(self, symbol):
+        return self.Securities[symbol].Holdings
+
+    def __contains__(self, symbol):
+        return symbol in self.Securities
+
+    def ContainsKey(self, symbol):
+        return symbol in self.Securities
+
+    @property
+    def Values(self):
+        return [security.Holdings for security in self.Securities.values()]
+
+    @property
+    def Invested(self):
+        return any(security.Holdings.Quantity != 0 for security in self.Securities.values())
+
+    @property
+    def TotalUnrealizedProfit(self):
+        return sum(s.Holdings.UnrealizedProfit for s in self.Securities.values() if s.Holdings.Quantity)
+
+    @property
+    def TotalHoldingsValue(self):
+        return sum(s.Holdings.AbsoluteHoldingsValue for s in self.Securities.values() if s.Holdings.Quantity)
+
+    @property
+    def TotalPortfolioValue(self):
+        value = self.Cash
+        for security in self.Securities.values():
+            holding = security.Holdings
+            if holding.Quantity:
+                value += holding.UnrealizedProfit if security.Type == SecurityType.Future else holding.HoldingsValue
+        return value
+
+    @property
+    def TotalFees(self):
+        return sum(s.Holdings.TotalFees for s in self.Securities.values())
+
+    @property
+    def TotalProfit(self):
+        return sum(s.Holdings.Profit for s in self.Securities.values())
+
+    @property
+    def TotalNetProfit(self):
+        return self.TotalProfit - self.TotalFees
+
+    def ProcessFill(self, security, quantity, price, fee):
+        '''Applies a fill to the holding and cash. Returns the profit realized by it.'''
+        holding = security.Holdings
+        multiplier = security.SymbolProperties.ContractMultiplier
+        old = holding.Quantity
+        new = old + quantity
+        realized = 0.0
+
+        if old == 0 or (old > 0) == (quantity > 0):
+            # opening or adding
+            holding.AveragePrice = (holding.AveragePrice * old + price * quantity) / new
+        else:
+            closed = min(abs(quantity), abs(old)) * (1 if old > 0 else -1)
+            realized = (price - holding.AveragePrice) * closed * multiplier
+            if new == 0:
+                holding.AveragePrice = 0.0
+            elif (new > 0) != (old > 0):
+                # flipped through zero
+                holding.AveragePrice = price
+
+        holding.Quantity = new
+        holding.Profit += realized
+        holding.TotalFees += fee
+        if realized != 0:
+            holding.LastTradeProfit = realized
+
+        if security.Type == SecurityType.Future:
+            self.Cash += realized - fee
+        else:
+            self.Cash -= quantity * price * multiplier + fee
+        return realized
+
+
+# Orders
+
+class OrderTicket:
+    __slots__ = ('OrderId', 'Symbol', 'Quantity', 'QuantityFilled', 'AverageFillPrice', 'Status', 'Time', 'Tag')
+
+    def __init__(self, order_id, symbol, quantity, time, tag=''):
+        self.OrderId = order_id
+        self.Symbol = symbol
+        self.Quantity = quantity
+        self.QuantityFilled = 0
+        self.AverageFillPrice = 0.0
+        self.Status = OrderStatus.New
+        self.Time = time
+        self.Tag = tag
+
+
+class OrderEvent:
+    __slots__ = ('OrderId', 'Symbol', 'UtcTime', 'Status', 'Direction', 'FillPrice', 'FillQuantity', 'OrderFee', 'Message')
+
+    def __init__(self, order_id, symbol, time, status, fill_price=0.0, fill_quantity=0, fee=0.0, message=''):
+        self.OrderId = order_id
+        self.Symbol = symbol
+        self.UtcTime = time
+        self.Status = status
+        self.Direction = OrderDirection.Buy if fill_quantity > 0 else OrderDirection.Sell if fill_quantity < 0 \
+            else OrderDirection.Hold
+        self.FillPrice = fill_price
+        self.FillQuantity = fill_quantity
+        self.OrderFee = fee
+        self.Message = message
+
+    def __str__(self):
+        return 'OrderId: {} {} Status: {} Quantity: {} FillPrice: {}'.format(
+            self.OrderId, self.Symbol, self.Status, self.FillQuantity, self.FillPrice)
+
+
+# Slices and chains
+
+class FuturesContract:
+    __slots__ = ('Symbol', 'Expiry', 'UnderlyingSymbol', '_security')
+
+    def __init__(self, security, canonical):
+        self.Symbol = security.Symbol
+        self.Expiry = security.Expiry
+        self.UnderlyingSymbol = canonical
+        self._security = security
+
+    @property
+    def LastPrice(self):
+        return self._security.Price
+
+    @property
+    def BidPrice(self):
+        return self._security.BidPrice
+
+    @property
+    def AskPrice(self):
+        return self._security.AskPrice
+
+    @property
+    def Volume(self):
+        return self._security.Volume
+
+    @property
+    def OpenInterest(self):
+        return 0
+
+    def __str__(self):
+        return self.Symbol.Value
+
+
+class FuturesChain:
+
+    def __init__(self, canonical, contracts):
+        self.Symbol = canonical
+        self.Contracts = NetDictionary((c.Symbol, c) for c in contracts)
+        self.Time = None
+
+    def __iter__(self):
+        return iter(self.Contracts.values())
+
+    def __len__(self):
+        return len(self.Contracts)
+
+
+class SecurityChanges:
+
+    def __init__(self, added, removed):
+        self.AddedSecurities = added
+        self.RemovedSecurities = removed
+
+    def __str__(self):
+        return 'SecurityChanges: Added: {} Removed: {}'.format(
+            [s.Symbol.Value for s in self.AddedSecurities], [s.Symbol.Value for s in self.RemovedSecurities])
+
+
+class Slice:
+
+    def __init__(self, time, bars, quote_bars, ticks, future_chains):
+        self.Time = time
+        self.Bars = bars
+        self.QuoteBars = quote_bars
+        self.Ticks = ticks
+        self.FutureChains = future_chains
+
+    def ContainsKey(self, symbol):
+        return symbol in self.Bars or symbol in self.QuoteBars or symbol in self.Ticks
+
+    def __getitem__(self, symbol):
+        if symbol in self.Bars:
+            return self.Bars[symbol]
+        if symbol in self.QuoteBars:
+            return self.QuoteBars[symbol]
+        return self.Ticks[symbol]
+
+    @property
+    def HasData(self):
+        return bool(self.Bars or self.QuoteBars or self.Ticks)
+
+
+# Subscriptions
+
+class _IndicatorFeed:
+    '''Feeds an indicator registered directly on a subscription, without a consolidator.'''
+    __slots__ = ('indicator',)
+
+    def __init__(self, indicator):
+        self.indicator = indicator
+
+    def Update(self, data):
+        if self.indicator.BAR_INPUT:
+            self.indicator.Update(data)
+        else:
+            self.indicator.Update(data.EndTime, data.Value)
+
+    def Scan(self, time):
+        pass
+
+
+class _IndicatorHandler:
+    '''Updates an indicator with the bars of a consolidator, a class rather than a lambda so it pickles.'''
+    __slots__ = ('indicator', 'selector')
+
+    def __init__(self, indicator, selector=None):
+        self.indicator = indicator
+        self.selector = selector
+
+    def __call__(self, sender, bar):
+        if self.indicator.BAR_INPUT:
+            self.indicator.Update(bar)
+        elif self.selector is None:
+            self.indicator.Update(bar.EndTime, bar.Value)
+        else:
+            self.indicator.Update(bar.EndTime, self.selector(bar))
+
+
+class SubscriptionManager:
+
+    def __init__(self, algorithm):
+        self._algorithm = algorithm
+        self.Consolidators = dict()     # symbol -> list of consolidators
+
+    def AddConsolidator(self, symbol, consolidator):
+        symbol = self._algorithm.Symbol(symbol)
+        self.Consolidators.setdefault(symbol, []).append(consolidator)
+
+    def RemoveConsolidator(self, symbol, consolidator):
+        symbol = self._algorithm.Symbol(symbol)
+        consolidators = self.Consolidators.get(symbol)
+        if consolidators and consolidator in consolidators:
+            consolidators.remove(consolidator)
+            if not consolidators:
+                del self.Consolidators[symbol]
+
+
+# Algorithm
+
+class QCAlgorithm:
+    '''
+    The subset of QCAlgorithm the algorithms in this folder use. The engine fields (Time,
+    IsWarmingUp, the history provider and the log sink) are set by LocalReplay.
+    '''
+
+    def __init__(self):
+        self.Time = datetime(1998, 1, 1)
+        self.StartDate = datetime(1998, 1, 1)
+        self.EndDate = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        self.TimeZone = 'America/New_York'
+        self.WarmUpPeriod = timedelta(0)
+        self.IsWarmingUp = False
+        self.LiveMode = False
+        self.Securities = SecurityManager()
+        self.Portfolio = SecurityPortfolioManager(self.Securities)
+        self.SubscriptionManager = SubscriptionManager(self)
+        self.FeePerContract = 0.0
+        self._parameters = dict()
+        self._order_id = 0
+        self._history_provider = None
+        self._history_arrays = None
+        self._log_sink = None
+
+    def __getstate__(self):
+        # the engine fields belong to the replay and are set again on resume
+        state = self.__dict__.copy()
+        state['_history_provider'] = state['_history_arrays'] = state['_log_sink'] = None
+        return state
+
+    # Events, overridden by algorithms
+
+    def Initialize(self):
+        pass
+
+    def OnData(self, slice):
+        pass
+
+    def OnEndOfDay(self):
+        pass
+
+    def OnEndOfAlgorithm(self):
+        pass
+
+    def OnSecuritiesChanged(self, changes):
+        pass
+
+    def OnOrderEvent(self, order_event):
+        pass
+
+    # Settings
+
+    def SetStartDate(self, year, month=None, day=None):
+        self.StartDate = year if month is None else datetime(year, month, day)
+
+    def SetEndDate(self, year, month=None, day=None):
+        self.EndDate = year if month is None else datetime(year, month, day)
+
+    def SetCash(self, cash):
+        self.Portfolio.Cash = float(cash)
+
+    def SetWarmUp(self, period, resolution=None):
+        if isinstance(period, timedelta):
+            self.WarmUpPeriod = period
+        else:
+            self.WarmUpPeriod = period * RESOLUTION_PERIODS[Resolution.Minute if resolution is None else resolution]
+
+    def SetTimeZone(self, time_zone):
+        self.TimeZone = time_zone
+
+    def SetBrokerageModel(self, brokerage, account_type=None):
+        pass
+
+    def SetBenchmark(self, symbol):
+        pass
+
+    def GetParameter(self, name):
+        value = self._parameters.get(name)
+        return None if value is None else str(value)
+
+    # Securities
+
+    def Symbol(self, symbol):
+        '''Resolves a ticker string to the symbol of a subscribed security.'''
+        if isinstance(symbol, Symbol):
+            return symbol
+        return Symbol._cache.get(symbol) or Symbol.Create(symbol)
+
+    def AddEquity(self, ticker, resolution=Resolution.Minute, market=None, fillDataForward=True, leverage=1.0):
+        symbol = Symbol.Create(ticker, SecurityType.Equity)
+        security = Security(symbol, SecurityType.Equity, resolution)
+        security.SetLeverage(leverage)
+        self.Securities[symbol] = security
+        return security
+
+    def AddFuture(self, ticker, resolution=Resolution.Minute, market=None, fillDataForward=True, leverage=1.0):
+        symbol = Symbol.Create(ticker, SecurityType.Future, '/' + ticker)
+        security = Future(symbol, resolution)
+        self.Securities[symbol] = security
+        return security
+
+    def AddSecurity(self, security_type, ticker, resolution=Resolution.Minute, *args):
+        if security_type == SecurityType.Future:
+            return self.AddFuture(ticker, resolution)
+        return self.AddEquity(ticker, resolution)
+
+    def AddFutureContract(self, symbol, expiry, resolution=Resolution.Minute):
+        '''Adds a single contract of a chain, called by the engine as contracts enter the universe.'''
+        root = symbol.ID.Symbol
+        security = Security(symbol, SecurityType.Future, resolution, CONTRACT_MULTIPLIERS.get(root, 1.0), expiry)
+        self.Securities[symbol] = security
+        return security
+
+    # Data
+
+    def History(self, symbol, periods, resolution=None):
+        symbol = self.Symbol(symbol)
+        if resolution is None:
+            resolution = self.Securities[symbol].Resolution
+        return self._history_provider(symbol, periods, resolution, self.Time)
+
+    # Indicators
+
+    def RegisterIndicator(self, symbol, indicator, resolution=None, selector=None):
+        symbol = self.Symbol(symbol)
+        if resolution is None or isinstance(resolution, int):
+            security = self.Securities.get(symbol)
+            if resolution is None or security is None or resolution == security.Resolution:
+                self.SubscriptionManager.AddConsolidator(symbol, _IndicatorFeed(indicator))
+                return
+            resolution = TradeBarConsolidator(RESOLUTION_PERIODS[resolution])
+            self.SubscriptionManager.AddConsolidator(symbol, resolution)
+        elif isinstance(resolution, timedelta):
+            resolution = TradeBarConsolidator(resolution)
+            self.SubscriptionManager.AddConsolidator(symbol, resolution)
+
+        resolution.DataConsolidated += _IndicatorHandler(indicator, selector)
+
+    def SMA(self, symbol, period, resolution=None, selector=None):
+        indicator = SimpleMovingAverage('SMA({},{})'.format(symbol, period), period)
+        self.RegisterIndicator(symbol, indicator, resolution, selector)
+        return indicator
+
+    def EMA(self, symbol, period, resolution=None, selector=None):
+        indicator = ExponentialMovingAverage('EMA({},{})'.format(symbol, period), period)
+        self.RegisterIndicator(symbol, indicator, resolution, selector)
+        return indicator
+
+    def LWMA(self, symbol, period, resolution=None, selector=None):
+        indicator = LinearWeightedMovingAverage('LWMA({},{})'.format(symbol, period), period)
+        self.RegisterIndicator(symbol, indicator, resolution, selector)
+        return indicator
+
+    def HMA(self, symbol, period, resolution=None, selector=None):
+        indicator = HullMovingAverage('HMA({},{})'.format(symbol, period), period)
+        self.RegisterIndicator(symbol, indicator, resolution, selector)
+        return indicator
+
+    def STD(self, symbol, period, resolution=None, selector=None):
+        indicator = StandardDeviation('STD({},{})'.format(symbol, period), period)
+        self.RegisterIndicator(symbol, indicator, resolution, selector)
+        return indicator
+
+    def BB(self, symbol, period, k, movingAverageType=MovingAverageType.Simple, resolution=None, selector=None):
+        indicator = BollingerBands('BB({},{},{})'.format(symbol, period, k), period, k, movingAverageType)
+        self.RegisterIndicator(symbol, indicator, resolution, selector)
+        return indicator
+
+    def ATR(self, symbol, period, movingAverageType=MovingAverageType.Wilders, resolution=None):
+        indicator = AverageTrueRange('ATR({},{})'.format(symbol, period), period, movingAverageType)
+        self.RegisterIndicator(symbol, indicator, resolution)
+        return indicator
+
+    def PSAR(self, symbol, afStart=0.02, afIncrement=0.02, afMax=0.2, resolution=None):
+        indicator = ParabolicStopAndReverse('PSAR({},{},{},{})'.format(symbol, afStart, afIncrement, afMax),
+                                            afStart, afIncrement, afMax)
+        self.RegisterIndicator(symbol, indicator, resolution)
+        return indicator
+
+    # Orders
+
+    def MarketOrder(self, symbol, quantity, asynchronous=False, tag=''):
+        symbol = self.Symbol(symbol)
+        quantity = int(quantity)
+        self._order_id += 1
+        ticket = OrderTicket(self._order_id, symbol, quantity, self.Time, tag)
+        security = self.Securities.get(symbol)
+
+        message = ''
+        if self.IsWarmingUp:
+            message = 'This operation is not allowed during warm up'
+        elif security is None or isinstance(security, Future):
+            message = 'Unable to place an order for {}'.format(symbol)
+        elif not security.HasData:
+            message = 'No data for {}'.format(symbol)
+        elif quantity == 0:
+            message = 'Unable to place an order for zero quantity'
+        if message:
+            ticket.Status = OrderStatus.Invalid
+            self.Log('Order Error: id: {}, {}'.format(ticket.OrderId, message))
+            self.OnOrderEvent(OrderEvent(ticket.OrderId, symbol, self.Time, OrderStatus.Invalid, message=message))
+            return ticket
+
+        price = security.Price
+        if security.AskPrice > 0 and security.BidPrice > 0:
+            price = security.AskPrice if quantity > 0 else security.BidPrice
+        fee = self.FeePerContract * abs(quantity)
+        self.Portfolio.ProcessFill(security, quantity, price, fee)
+
+        ticket.Status = OrderStatus.Filled
+        ticket.QuantityFilled = quantity
+        ticket.AverageFillPrice = price
+        self.OnOrderEvent(OrderEvent(ticket.OrderId, symbol, self.Time, OrderStatus.Filled, price, quantity, fee))
+        return ticket
+
+    def Liquidate(self, symbol=None, tag='Liquidated'):
+        tickets = []
+        if symbol is not None:
+            symbol = self.Symbol(symbol)
+        for key, security in list(self.Securities.items()):
+            quantity = security.Holdings.Quantity
+            if quantity and (symbol is None or key == symbol):
+                tickets.append(self.MarketOrder(key, -quantity, tag=tag).OrderId)
+        return tickets
+
+    def CalculateOrderQuantity(self, symbol, target):
+        security = self.Securities[self.Symbol(symbol)]
+        unit_value = security.Price * security.SymbolProperties.ContractMultiplier / security.Leverage
+        if unit_value == 0:
+            return 0
+        target_quantity = int(self.Portfolio.TotalPortfolioValue * target / unit_value)
+        return target_quantity - security.Holdings.Quantity
+
+    def SetHoldings(self, symbol, percentage, liquidateExistingHoldings=False):
+        symbol = self.Symbol(symbol)
+        if liquidateExistingHoldings:
+            for key, security in list(self.Securities.items()):
+                if key != symbol and security.Holdings.Quantity:
+                    self.Liquidate(key)
+        quantity = self.CalculateOrderQuantity(symbol, percentage)
+        if quantity != 0:
+            self.MarketOrder(symbol, quantity)
+
+    # Logging and charting
+
+    def Log(self, message):
+        if self._log_sink is not None:
+            self._log_sink(self.Time, str(message))
+
+    Debug = Log
+    Error = Log
+
+    def Plot(self, *args):
+        pass
+
+    def PlotIndicator(self, *args):
+        pass
+
+
+NAMESPACE = {
+    'QCAlgorithm': QCAlgorithm,
+    'Resolution': Resolution,
+    'TimeSpan': TimeSpan,
+    'timedelta': timedelta,
+    'datetime': datetime,
+    'date': date,
+    'Futures': Futures,
+    'SecurityType': SecurityType,
+    'MovingAverageType': MovingAverageType,
+    'BrokerageName': BrokerageName,
+    'AccountType': AccountType,
+    'OrderStatus': OrderStatus,
+    'OrderDirection': OrderDirection,
+    'TickType': TickType,
+    'Symbol': Symbol,
+    'Bar': Bar,
+    'TradeBar': TradeBar,
+    'QuoteBar': QuoteBar,
+    'Tick': Tick,
+    'Slice': Slice,
+    'TradeBarConsolidator': TradeBarConsolidator,
+    'TickQuoteBarConsolidator': TickQuoteBarConsolidator,
+    'IndicatorDataPoint': IndicatorDataPoint,
+    'SimpleMovingAverage': SimpleMovingAverage,
+    'ExponentialMovingAverage': ExponentialMovingAverage,
+    'LinearWeightedMovingAverage': LinearWeightedMovingAverage,
+    'HullMovingAverage': HullMovingAverage,
+    'StandardDeviation': StandardDeviation,
+    'BollingerBands': BollingerBands,
+    'AverageTrueRange': AverageTrueRange,
+    'ParabolicStopAndReverse': ParabolicStopAndReverse,
+    'OrderTicket': OrderTicket,
+    'OrderEvent': OrderEvent,
+    'SecurityChanges': SecurityChanges,
+}
+
+_MODULES = ('clr', 'System', 'QuantConnect', 'QuantConnect.Python', 'QuantConnect.Data', 'QuantConnect.Data.Custom',
+            'QuantConnect.Data.Market', 'QuantConnect.Data.Consolidators', 'QuantConnect.Algorithm',
+            'QuantConnect.Indicators', 'QuantConnect.Securities', 'QuantConnect.Orders', 'QuantConnect.Brokerages')
+
+
+class PythonQuandl:
+    pass
+
+
+def install():
+    '''Registers stand-in clr, System and QuantConnect modules exporting NAMESPACE.'''
+    for name in _MODULES:
+        if name in sys.modules and getattr(sys.modules[name], '__local_lean__', False):
+            continue
+        module = types.ModuleType(name)
+        module.__dict__.update(NAMESPACE)
+        module.__local_lean__ = True
+        module.AddReference = lambda *args: None
+        module.PythonQuandl = PythonQuandl
+        module.__all__ = list(NAMESPACE)
+        sys.modules[name] = module
+        parent, _, child = name.rpartition('.')
+        if parent:
+            setattr(sys.modules[parent], child, module)
@@ -0,0 +1,583 @@
+'''
+Streaming replay of local bar and tick files through an algorithm running on LocalLean.
+
+Data folder layout, times in the algorithm's time zone:
+
+    <data>/<ticker>/contracts.csv               futures only: symbol,expiry
+    <data>/<ticker>/<resolution>/<symbol>.csv   time,open,high,low,close,volume (bar start time)
+    <data>/<ticker>/tick/<symbol>.csv           time,bid,ask,bidsize,asksize[,last,quantity]
+
+Tickers are lower case (es, spy) and resolution folders are tick, second, minute, hour and
+daily. Files may also be .parquet with the same columns, which needs pyarrow. Times are
+either ISO strings or integer nanoseconds since the epoch.
+
+Files are read in chunks and merged one day at a time, so memory use is bounded by a day of
+data regardless of the length of the backtest.
+
+    python LocalReplay.py FuturesMovingAverageCrossOverExample2.py --data ~/data --quiet
+'''
+
+import argparse
+import csv
+import importlib.util
+import inspect
+import os
+import sys
+import time as timer
+import types
+from collections import deque
+from datetime import datetime, timedelta
+
+import LocalLean
+from AlgorithmBase import np
+from LocalLean import (NetDictionary, QCAlgorithm, Future, FuturesChain, FuturesContract, Resolution,
+                       RESOLUTION_NAMES, RESOLUTION_PERIODS, SecurityChanges, SecurityType, Slice, Symbol,
+                       Tick, TradeBar)
+
+
+BAR_COLUMNS = ('open', 'high', 'low', 'close', 'volume')
+TICK_COLUMNS = ('bid', 'ask', 'bidsize', 'asksize', 'last', 'quantity')
+
+ONE_DAY = timedelta(days=1)
+
+
+def to_ns(time):
+    return np.datetime64(time, 'ns').astype(np.int64)
+
+
+def to_datetimes(ns):
+    return ns.view('datetime64[ns]').astype('datetime64[us]').tolist()
+
+
+def _parse_times(values):
+    if values.dtype.kind in 'iu':
+        return values.astype(np.int64)
+    if values.dtype.kind == 'M':
+        return values.astype('datetime64[ns]').view(np.int64)
+    import pandas as pd
+    return pd.to_datetime(values).to_numpy(dtype='datetime64[ns]').view(np.int64)
+
+
+def _frames(path, chunk_size):
+    '''Yields dicts of column name to numpy array from a csv or parquet file.'''
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+            yield {name: batch.column(i).to_numpy(zero_copy_only=False)
+                   for i, name in enumerate(batch.schema.names)}
+    else:
+        import pandas as pd
+        for frame in pd.read_csv(path, chunksize=chunk_size):
+            yield {name: frame[name].to_numpy() for name in frame.columns}
+
+
+def read_chunks(path, columns, period=timedelta(0), start=None, end=None, chunk_size=200000):
+    '''
+    Yields (end times in ns, column arrays...) chunks of a data file, restricted to end times in
+    [start, end]. Missing optional columns are filled with zeros.
+    '''
+    offset = int(period / timedelta(microseconds=1)) * 1000
+    start = None if start is None else to_ns(start)
+    end = None if end is None else to_ns(end)
+
+    for frame in _frames(path, chunk_size):
+        times = _parse_times(frame['time']) + offset
+        lo, hi = 0, len(times)
+        if start is not None:
+            lo = np.searchsorted(times, start, 'left')
+        if end is not None:
+            hi = np.searchsorted(times, end, 'right')
+        if lo >= hi:
+            if end is not None and len(times) and times[0] > end:
+                return
+            continue
+        chunk = [times[lo:hi]]
+        for name in columns:
+            values = frame.get(name)
+            chunk.append(np.zeros(hi - lo) if values is None else values[lo:hi].astype(np.float64))
+        yield tuple(chunk)
+        if hi < len(times):
+            return
+
+
+class LocalDataFolder:
+    '''Locates and reads the files of a local data folder.'''
+
+    def __init__(self, root, chunk_size=200000):
+        self.root = os.path.expanduser(root)
+        self.chunk_size = chunk_size
+        self._contracts = dict()
+
+    def path(self, ticker, resolution, value):
+        folder = os.path.join(self.root, ticker.lower(), RESOLUTION_NAMES[resolution])
+        for extension in ('.csv', '.parquet'):
+            path = os.path.join(folder, value + extension)
+            if os.path.exists(path):
+                return path
+        return None
+
+    def contracts(self, ticker):
+        '''(symbol value, expiry) of every contract listed for a futures root, in expiry order.'''
+        contracts = self._contracts.get(ticker)
+        if contracts is None:
+            contracts = []
+            path = os.path.join(self.root, ticker.lower(), 'contracts.csv')
+            if os.path.exists(path):
+                with open(path) as f:
+                    for row in csv.DictReader(f):
+                        contracts.append((row['symbol'], datetime.fromisoformat(row['expiry'].strip())))
+            contracts.sort(key=lambda c: c[1])
+            self._contracts[ticker] = contracts
+        return contracts
+
+    def chunks(self, symbol, resolution, start=None, end=None):
+        path = self.path(symbol.ID.Symbol, resolution, symbol.Value)
+        if path is None:
+            return iter(())
+        columns = TICK_COLUMNS if resolution == Resolution.Tick else BAR_COLUMNS
+        return read_chunks(path, columns, RESOLUTION_PERIODS[resolution], start, end, self.chunk_size)
+
+    def history_arrays(self, symbol, periods, resolution, end):
+        '''
+        The last periods bars (an int) or the bars of the last periods (a timedelta) ending at or
+        before end, as bar end times (datetime64[ns]) and open, high, low, close and volume
+        arrays. Coarser resolutions without their own files are consolidated from minute bars.
+        Data read as a single chunk is returned as views, without copying.
+        '''
+        from IndicatorWarmUp import consolidate_arrays
+
+        source = resolution
+        if self.path(symbol.ID.Symbol, resolution, symbol.Value) is None:
+            source = Resolution.Minute
+        count = periods
+        if source != resolution and not isinstance(periods, timedelta):
+            count = periods * int(RESOLUTION_PERIODS[resolution] / RESOLUTION_PERIODS[source])
+
+        if isinstance(periods, timedelta):
+            data = self._join(list(self.chunks(symbol, source, end - periods, end)))
+        else:
+            data = self._tail(self.chunks(symbol, source, None, end), count)
+
+        if data is None or len(data[0]) == 0:
+            empty = np.empty(0)
+            return np.empty(0, dtype='datetime64[ns]'), empty, empty, empty, empty, empty
+        times, open, high, low, close, volume = data
+        times = times.view('datetime64[ns]')
+        if source != resolution:
+            data = consolidate_arrays(times, open, high, low, close, volume, RESOLUTION_PERIODS[resolution], end)
+            if not isinstance(periods, timedelta):
+                data = tuple(a[-periods:] for a in data)
+            return data
+        return times, open, high, low, close, volume
+
+    def history(self, symbol, periods, resolution, end):
+        '''history_arrays() as a History() style frame indexed by (symbol, bar end time).'''
+        return history_frame(symbol, self.history_arrays(symbol, periods, resolution, end))
+
+    @staticmethod
+    def _join(parts):
+        if not parts:
+            return None
+        if len(parts) == 1:
+            return parts[0]
+        return tuple(np.concatenate(c) for c in zip(*parts))
+
+    @staticmethod
+    def _tail(chunks, n):
+        parts = deque()
+        size = 0
+        for chunk in chunks:
+            parts.append(chunk)
+            size += len(chunk[0])
+            while size - len(parts[0][0]) >= n:
+                size -= len(parts.popleft()[0])
+        data = LocalDataFolder._join(list(parts))
+        return None if data is None else tuple(c[-n:] for c in data)
+
+
+def history_frame(symbol, bars):
+    '''A History() style frame of history_arrays() bars.'''
+    import pandas as pd
+
+    times, open, high, low, close, volume = bars
+    if len(times) == 0:
+        return pd.DataFrame(columns=['close', 'high', 'low', 'open', 'volume'])
+    index = pd.MultiIndex.from_arrays([[symbol.Value] * len(times), times], names=['symbol', 'time'])
+    return pd.DataFrame({'close': close, 'high': high, 'low': low, 'open': open, 'volume': volume}, index=index)
+
+
+class _Stream:
+    '''A cursor over the chunks of one security's data file.'''
+    __slots__ = ('security', 'tick', 'period', 'chunks', 'buffer', 'pos')
+
+    def __init__(self, security, chunks, tick, period):
+        self.security = security
+        self.tick = tick
+        self.period = period
+        self.chunks = chunks
+        self.buffer = None
+        self.pos = 0
+
+    def take_until(self, end_ns):
+        '''Returns the rows with end time before end_ns, reading as many chunks as needed.'''
+        parts = []
+        while True:
+            if self.buffer is None:
+                self.buffer = next(self.chunks, None)
+                self.pos = 0
+                if self.buffer is None:
+                    break
+            times = self.buffer[0]
+            idx = np.searchsorted(times, end_ns, 'left')
+            if idx > self.pos:
+                parts.append(tuple(column[self.pos:idx] for column in self.buffer))
+            if idx < len(times):
+                self.pos = idx
+                break
+            self.buffer = None
+        if not parts:
+            return None
+        if len(parts) == 1:
+            return parts[0]
+        return tuple(np.concatenate(c) for c in zip(*parts))
+
+    def make(self, rows):
+        '''Builds the TradeBar or Tick objects of a block of rows.'''
+        symbol = self.security.Symbol
+        times = to_datetimes(rows[0])
+        columns = [c.tolist() for c in rows[1:]]
+        if self.tick:
+            return [Tick(t, symbol, b, a, bs, as_, l, q) for t, b, a, bs, as_, l, q in zip(times, *columns)]
+        period = self.period
+        return [TradeBar(t - period, symbol, o, h, l, c, v, period) for t, o, h, l, c, v in zip(times, *columns)]
+
+
+class LocalReplay:
+    '''
+    Runs an algorithm over a local data folder: Initialize, then one day at a time the futures
+    universe is refreshed from the chain filters, the day's rows of every subscription are
+    merged by time, and each time step updates prices and consolidators, scans the consolidators
+    for bars whose period has passed, and calls OnData. OnEndOfDay is called after every day with data.
+    '''
+
+    def __init__(self, algorithm, data, parameters=None, log=None, history_cache=None):
+        if isinstance(algorithm, type):
+            algorithm = algorithm()
+        self.algorithm = algorithm
+        self.data = LocalDataFolder(data) if isinstance(data, (str, os.PathLike)) else data
+        self.parameters = parameters or dict()
+        self.log = log
+        self.history_cache = history_cache
+        self.start = None
+        self.end = None
+
+        self.events = 0
+        self.steps = 0
+        self.elapsed = 0.0
+
+        self._streams = dict()      # symbol -> _Stream
+        self._universe = dict()     # canonical symbol -> list of contract securities
+        self._chains = NetDictionary()
+
+    def run(self, start=None, end=None, checkpoints=None):
+        '''Runs the algorithm from its start date, saving a snapshot to checkpoints after each day if given.'''
+        algorithm = self.algorithm
+        begin = self.initialize(start, end)
+        algorithm.Time = begin
+        algorithm.IsWarmingUp = begin < self.start
+
+        for security in list(algorithm.Securities.values()):
+            if security.Type != SecurityType.Future:
+                self._open(security, begin)
+
+        return self._loop(datetime(begin.year, begin.month, begin.day), begin, checkpoints)
+
+    def initialize(self, start=None, end=None):
+        '''Calls Initialize and sets the replay's dates. Returns the time the data starts at, warm-up included.'''
+        algorithm = self.algorithm
+        self._attach(algorithm)
+        algorithm.Initialize()
+        self.start = start or algorithm.StartDate
+        self.end = (end or algorithm.EndDate) + ONE_DAY
+        return self.start - algorithm.WarmUpPeriod
+
+    def resume(self, snapshot, end=None, checkpoints=None):
+        '''
+        Runs the algorithm of a snapshot from the day it was taken before, without Initialize
+        or warm-up. The replay's parameters are applied on top of the snapshot's, and end can
+        move the end date.
+        '''
+        algorithm = self.algorithm = snapshot['algorithm']
+        self._attach(algorithm)
+        self._universe = snapshot['universe']
+        self._chains = snapshot['chains']
+        self.start = snapshot['start']
+        self.end = snapshot['end'] if end is None else end + ONE_DAY
+        day = snapshot['day']
+
+        for security in list(algorithm.Securities.values()):
+            if security.Type != SecurityType.Future:
+                self._open(security, day)
+        for members in self._universe.values():
+            for security in members:
+                self._open(security, day)
+
+        return self._loop(day, day, checkpoints)
+
+    def snapshot(self, day):
+        '''The state needed to carry on from day: the algorithm and its futures universe.'''
+        return dict(algorithm=self.algorithm, universe=self._universe, chains=self._chains, day=day,
+                    start=self.start, end=self.end)
+
+    def _attach(self, algorithm):
+        algorithm._parameters.update(self.parameters)
+        algorithm._history_provider = self.data.history
+        algorithm._history_arrays = self.data.history_arrays
+        if self.history_cache is not None:
+            arrays = algorithm._history_arrays = self.history_cache.wrap(self.data.history_arrays)
+            algorithm._history_provider = lambda symbol, *args: history_frame(symbol, arrays(symbol, *args))
+        algorithm._log_sink = self.log
+
+    def _loop(self, day, begin, checkpoints):
+        algorithm = self.algorithm
+        clock = timer.perf_counter()
+        while day < self.end:
+            next_day = day + ONE_DAY
+            self._refresh_universe(day, begin)
+            if self._replay(min(next_day, self.end)):
+                algorithm.OnEndOfDay()
+                if checkpoints is not None and next_day < self.end:
+                    checkpoints.end_of_day(self, next_day)
+            day = next_day
+        algorithm.OnEndOfAlgorithm()
+        self.elapsed = timer.perf_counter() - clock
+        return algorithm
+
+    def _open(self, security, start):
+        tick = security.Resolution == Resolution.Tick
+        period = RESOLUTION_PERIODS[security.Resolution]
+        chunks = self.data.chunks(security.Symbol, security.Resolution, start, self.end)
+        self._streams[security.Symbol] = _Stream(security, chunks, tick, period)
+
+    def _refresh_universe(self, day, begin):
+        '''Adds the contracts that entered each chain filter and removes the ones that left it.'''
+        algorithm = self.algorithm
+        added, removed = [], []
+
+        for canonical in [s for s in algorithm.Securities.values() if isinstance(s, Future)]:
+            root = canonical.Symbol.ID.Symbol
+            lo, hi = canonical.FilterRange
+            members = self._universe.setdefault(canonical.Symbol, [])
+            wanted = set()
+            for value, expiry in self.data.contracts(root):
+                if expiry >= day and day + lo <= expiry <= day + hi:
+                    wanted.add(value)
+
+            for security in [s for s in members if s.Symbol.Value not in wanted]:
+                members.remove(security)
+                self._streams.pop(security.Symbol, None)
+                removed.append(security)
+
+            current = set(s.Symbol.Value for s in members)
+            for value, expiry in self.data.contracts(root):
+                if value in wanted and value not in current:
+                    symbol = Symbol.Create(root, SecurityType.Future, value, expiry)
+                    security = algorithm.Securities.get(symbol) or \
+                        algorithm.AddFutureContract(symbol, expiry, canonical.Resolution)
+                    members.append(security)
+                    self._open(security, max(day, begin))
+                    added.append(security)
+
+            members.sort(key=lambda s: s.Expiry)
+            if added or removed or canonical.Symbol not in self._chains:
+                self._chains[canonical.Symbol] = FuturesChain(
+                    canonical.Symbol, [FuturesContract(s, canonical.Symbol) for s in members])
+
+        if added or removed:
+            algorithm.OnSecuritiesChanged(SecurityChanges(added, removed))
+
+    def _replay(self, until):
+        '''Merges the rows of every stream up to until and replays them. Returns False if there were none.'''
+        end_ns = to_ns(until)
+        times, items = [], []
+        for stream in self._streams.values():
+            rows = stream.take_until(end_ns)
+            if rows is not None:
+                times.append(rows[0])
+                items.extend(stream.make(rows))
+        if not times:
+            return False
+
+        times = np.concatenate(times)
+        order = np.argsort(times, kind='stable')
+        times = times[order]
+        items = [items[i] for i in order.tolist()]
+        bounds = np.flatnonzero(np.diff(times)) + 1
+        starts = np.r_[0, bounds].tolist()
+        stops = np.r_[bounds, len(times)].tolist()
+        step_times = to_datetimes(times[starts])
+        warming = (times[starts] < to_ns(self.start)).tolist()
+
+        algorithm = self.algorithm
+        securities = algorithm.Securities
+        consolidators = algorithm.SubscriptionManager.Consolidators
+        chains = self._chains
+
+        for time, warm, a, b in zip(step_times, warming, starts, stops):
+            algorithm.Time = time
+            algorithm.IsWarmingUp = warm
+            bars = NetDictionary()
+            ticks = NetDictionary()
+            for item in items[a:b]:
+                symbol = item.Symbol
+                securities[symbol].SetMarketPrice(item)
+                if item.__class__ is Tick:
+                    if symbol in ticks:
+                        ticks[symbol].append(item)
+                    else:
+                        ticks[symbol] = [item]
+                else:
+                    bars[symbol] = item
+                attached = consolidators.get(symbol)
+                if attached:
+                    for consolidator in tuple(attached):
+                        consolidator.Update(item)
+            # like LEAN, emit the bars whose period has passed without data that closes them, after the
+            # step's updates so a bar ending at this time is still added to its bucket first
+            for attached in tuple(consolidators.values()):
+                for consolidator in tuple(attached):
+                    consolidator.Scan(time)
+            algorithm.OnData(Slice(time, bars, NetDictionary(), ticks, chains))
+
+        self.events += len(items)
+        self.steps += len(step_times)
+        return True
+
+
+def load_algorithm(path, class_name=None):
+    '''
+    Imports an algorithm file the way the platform does, with the LEAN names injected into its
+    module, and returns its QCAlgorithm subclass (the one named after the file if there are several).
+    '''
+    LocalLean.install()
+    path = os.path.abspath(path)
+    folder = os.path.dirname(path)
+    if folder not in sys.path:
+        sys.path.insert(0, folder)
+
+    name = os.path.splitext(os.path.basename(path))[0]
+    spec = importlib.util.spec_from_file_location(name.replace(' ', '_'), path)
+    module = importlib.util.module_from_spec(spec)
+    module.__dict__.update(LocalLean.NAMESPACE)
+    # registered so the algorithm's instances pickle for checkpoints
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+
+    # modules are skipped first: looking at a lazily imported one would import it
+    classes = [c for c in vars(module).values() if not isinstance(c, types.ModuleType)
+               and inspect.isclass(c) and issubclass(c, QCAlgorithm) and c is not QCAlgorithm]
+    for c in classes:
+        if c.__name__ == (class_name or name):
+            return c
+    if class_name is None and len(classes) == 1:
+        return classes[0]
+    raise ValueError('No algorithm class {} in {}'.format(class_name or name, path))
+
+
+def print_log(time, message):
+    sys.stdout.write('{} {}\n'.format(time, message))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replay an algorithm over local data files.')
+    parser.add_argument('algorithm', help='algorithm file')
+    parser.add_argument('--data', required=True, help='local data folder')
+    parser.add_argument('--store', action='store_true', help='the data folder is a BarStore')
+    parser.add_argument('--class', dest='class_name', help='algorithm class, if not named after the file')
+    parser.add_argument('--start', type=datetime.fromisoformat, help='override the start date')
+    parser.add_argument('--end', type=datetime.fromisoformat, help='override the end date')
+    parser.add_argument('--param', action='append', default=[], metavar='NAME=VALUE',
+                        help='algorithm parameter returned by GetParameter')
+    parser.add_argument('--quiet', action='store_true', help='discard Log/Debug output')
+    parser.add_argument('--profile', metavar='REPORT', help='time the handlers, consolidators and indicators and '
+                                                             'write a report to this file')
+    parser.add_argument('--history-cache', metavar='FOLDER', help='serve history requests from an on-disk cache '
+                                                                   'in this folder')
+    parser.add_argument('--metrics', action='store_true', help='print the return, drawdown, exposure and trade '
+                                                               'statistics of the run')
+    parser.add_argument('--checkpoint', metavar='FOLDER', help='save a snapshot of the algorithm to this folder '
+                                                                'at the end of each day')
+    parser.add_argument('--checkpoint-every', type=int, default=1, metavar='DAYS',
+                        help='days with data between snapshots')
+    parser.add_argument('--resume', metavar='DATE|FILE', help='carry on from a snapshot file, or from the latest '
+                                                              'snapshot in the --checkpoint folder at or before a date')
+    parser.add_argument('--journal', metavar='FOLDER', help='record the orders, rolls, signals and indicator '
+                                                             'snapshots of the run in a journal in this folder')
+    parser.add_argument('--run', help='run id in the journal, the start time of the run by default')
+    args = parser.parse_args(argv)
+    if (args.checkpoint or args.resume) and (args.profile or args.metrics or args.journal):
+        parser.error('--checkpoint and --resume cannot be combined with --profile, --metrics or --journal')
+    if args.resume and not os.path.isfile(args.resume) and not args.checkpoint:
+        parser.error('--resume DATE needs the --checkpoint folder')
+
+    parameters = dict(p.split('=', 1) for p in args.param)
+    data = args.data
+    if args.store:
+        from BarStore import BarStore
+        data = BarStore(data)
+    cache = None
+    if args.history_cache:
+        from HistoryCache import HistoryCache
+        cache = HistoryCache(args.history_cache)
+    replay = LocalReplay(load_algorithm(args.algorithm, args.class_name), data, parameters,
+                         None if args.quiet else print_log, cache)
+    profiler = None
+    if args.profile:
+        from HandlerProfiler import profile_replay
+        profiler = profile_replay(replay)
+    metrics = None
+    if args.metrics:
+        from StreamingMetrics import StreamingMetrics
+        metrics = StreamingMetrics().attach(replay.algorithm)
+    journal = None
+    if args.journal:
+        from TradeJournal import TradeJournal
+        run = args.run or datetime.now().strftime('%Y%m%d-%H%M%S')
+        journal = TradeJournal(args.journal, run, parameters).attach(replay.algorithm)
+    checkpoints = None
+    if args.checkpoint:
+        from Checkpoint import Checkpoints
+        checkpoints = Checkpoints(args.checkpoint, args.checkpoint_every)
+    if args.resume:
+        from Checkpoint import load_snapshot
+        if os.path.isfile(args.resume):
+            snapshot = load_snapshot(args.resume)
+        else:
+            snapshot = checkpoints.load(datetime.fromisoformat(args.resume))
+        print('resuming from {}'.format(snapshot['day'].date()))
+        algorithm = replay.resume(snapshot, args.end, checkpoints)
+    else:
+        algorithm = replay.run(args.start, args.end, checkpoints)
+    if journal is not None:
+        journal.close()
+    if profiler is not None:
+        profiler.detach()
+        profiler.write_report(args.profile)
+
+    rate = replay.events / replay.elapsed if replay.elapsed else 0.0
+    print('events: {}  steps: {}  seconds: {:.2f}  events/sec: {:,.0f}'.format(
+        replay.events, replay.steps, replay.elapsed, rate))
+    print('portfolio value: {:.2f}  net profit: {:.2f}'.format(
+        algorithm.Portfolio.TotalPortfolioValue, algorithm.Portfolio.TotalNetProfit))
+    if metrics is not None:
+        print(metrics.report())
+    if journal is not None:
+        print('journal: {} events in {}'.format(journal.events, journal.folder))
+    if checkpoints is not None:
+        print('checkpoints: {} saved in {}'.format(checkpoints.saved, checkpoints.folder))
+    if cache is not None:
+        print('history cache: {} hits  {} misses'.format(cache.hits, cache.misses))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,18 +1,32 @@
-from QuantConnect.Python import PythonQuandl
-from QuantConnect.Data.Custom import *
-from System import *
-from QuantConnect import *
-from QuantConnect.Data import *
-from QuantConnect.Algorithm import *
-from QuantConnect.Indicators import *
-from QuantConnect.Securities import *
-from QuantConnect.Data.Consolidators import *
-from datetime import timedelta
-from collections import deque
-from QuantConnect.Orders import OrderStatus
-import pandas as pd
-import numpy as np
-from datetime import timedelta, datetime
+from AlgorithmBase import *
+
+from ContinuousFuture import ContinuousFuture
+from FuturesRollManager import FuturesRollManager
+from IndicatorWarmUp import consolidate_bars, history_bars
+from LazyLog import LazyLog, DEBUG, INFO, parse_level
+from TradeJournal import journal_for
+from UniverseEngine import UniverseEngine
+
+
+class FuturesRoot:
+    '''
+    A futures root of the algorithm: its chain, roll schedule, front contract and continuous
+    series. Its hourly bars and bands are the slot of the root in the UniverseEngine.
+    '''
+
+    def __init__(self, algorithm, ticker, slot, roll_days, adjustment, store):
+        self.future = algorithm.AddFuture(ticker, Resolution.Minute)
+        self.future.SetFilter(TimeSpan.Zero, TimeSpan.FromDays(185))
+        self.ticker = ticker
+        self.slot = slot
+        self.contract = None
+        self.next_contract = None
+        self.new_day = True
+        self.roll = FuturesRollManager(algorithm, roll_days=roll_days, canonical=self.future.Symbol,
+                                       on_roll=journal_for(algorithm).roll)
+        self.continuous = ContinuousFuture(ticker, Resolution.Hour, adjustment, store=store,
+                                           schedule='roll{}d'.format(roll_days))
+
 
 ### <summary>
 ### Example structure for structuring an algorithm with indicator and consolidator data for many tickers.
@@ -22,150 +36,146 @@ from datetime import timedelta, datetime
 ### <meta name="tag" content="using data" />
 ### <meta name="tag" content="strategy example" />
 class MultipleSymbolConsolidationAlgorithm(QCAlgorithm):
-    
+
     # Initialise the data and resolution required, as well as the cash and start-end dates for your algorithm. All algorithms must initialized.
     def Initialize(self):
-        
-        self._contract = None
-        self._nextContract = None
-        
-        self._bb = None
-        self._nextBb = None
-        
-        self._newDay = True
+
         self.reset = True
-        
+
         # brokerage model
         self.SetBrokerageModel(BrokerageName.InteractiveBrokersBrokerage,
-                               AccountType.Margin)        
-        
+                               AccountType.Margin)
+
         self.SetStartDate(2014, 12, 1)
         self.SetEndDate(2016, 2, 1)
         self.SetCash(100000)
         self.SetWarmUp(TimeSpan.FromDays(5))
-        
-        future = self.AddFuture(Futures.Indices.SP500EMini, Resolution.Minute)
-        future.SetFilter(TimeSpan.Zero, TimeSpan.FromDays(185))  
-        
+
+        # Logs are buffered and formatted at the end of each day. The hourly heartbeat is
+        # only recorded at the DEBUG level.
+        self._log = LazyLog(self, level=parse_level(self.GetParameter('log_level')))
+        self._heartbeat = self._log.channel('heartbeat', DEBUG)
+        self._hourly = self._log.channel('hourly', INFO, every=int(self.GetParameter('log_every') or 1))
+        self._events = self._log.channel('events', INFO)
+        self._journal = journal_for(self)
+
+        # The hourly bars and Bollinger bands of the front contract of every root are
+        # columns of one engine, updated for all the roots at once at the end of each hour.
+        # The bands run over the back-adjusted continuous series, so they carry over each
+        # roll without a second pipeline warming up on the next contract.
+        self._engine = UniverseEngine(TimeSpan.FromMinutes(60), 20, 2, exponential=True)
+        self._engine.DataConsolidated += self.OnHour
+
+        # a comma separated list of roots, ES,NQ,CL,GC,ZN...
+        roll_days = int(self.GetParameter('roll_days') or 3)
+        adjustment = self.GetParameter('adjustment') or 'ratio'
+        store = self.GetParameter('continuous_store')
+        self._roots = []
+        for ticker in (self.GetParameter('roots') or Futures.Indices.SP500EMini).split(','):
+            ticker = ticker.strip()
+            self._roots.append(FuturesRoot(self, ticker, self._engine.add(ticker), roll_days, adjustment, store))
+        self._by_slot = {root.slot: root for root in self._roots}
+
     def OnData(self, slice):
-        
+
         if (self.Time.minute==0):
-            self.Log('OnData')
-            
-        if not self.InitContract(slice): return
-    
+            self._heartbeat('OnData')
+
+        # the bars of the contracts tracked so far, before any roll of this step
+        self._engine.update_bars(slice.Bars)
+
+        for root in self._roots:
+            self.InitContract(root, slice)
+
         if self.reset:
             self.reset=False
-            
+
         if (self.Time.minute==0):
-            
-            if (self._bb != None and self._bb.IsReady):
-            
-                price = 0.
-                if (slice.Bars.ContainsKey(self._contract.Symbol)):
-                    
-                    #self.Log(self._contract.Symbol)
-                    
-                    price = slice.Bars[self._contract.Symbol].Close
-
-                    args = (self.Time,self._contract,price,self._bb.LowerBand,self._bb.MiddleBand,self._bb.UpperBand)
-                    self.Log('onData: {} contract: {}, price: {}, BBL: {}, BBM: {}, BBU: {}'.format(*args))
-                    
-                if (slice.Bars.ContainsKey(self._nextContract.Symbol)):
-
-                    price = slice.Bars[self._nextContract.Symbol].Close
-
-                    args = (self.Time,self._nextContract,price,self._nextBb.LowerBand,self._nextBb.MiddleBand,self._nextBb.UpperBand)
-                    self.Log('onData: {} contract: {}, price: {}, BBL: {}, BBM: {}, BBU: {}'.format(*args))                    
-
-                    
-            else:
-                self.Log('BB not ready')
-        
+
+            for root in self._roots:
+                if root.contract is None:
+                    continue
+
+                if self._engine.is_ready(root.slot):
+
+                    if (slice.Bars.ContainsKey(root.contract.Symbol)):
+
+                        price = slice.Bars[root.contract.Symbol].Close
+
+                        self.LogBands(root, price)
+
+                else:
+                    self._hourly('BB not ready')
+
         return
-    
-    def InitContract(self, slice):
-        
-        if not self._newDay:
-            return True
 
-        if (self._contract != None and (self._contract.Expiry - self.Time).days >=3):
+    def LogBands(self, root, price):
+        slot = root.slot
+        lower = float(self._engine.lower[slot])
+        middle = float(self._engine.middle[slot])
+        upper = float(self._engine.upper[slot])
+        self._journal.snapshot(root.contract.Symbol, price=price, bb_lower=lower, bb_middle=middle, bb_upper=upper)
+        if self._hourly.enabled:
+            self._hourly('onData: contract: {}, price: {}, BBL: {}, BBM: {}, BBU: {}', root.contract.Symbol.Value,
+                         price, lower, middle, upper)
+
+    def InitContract(self, root, slice):
+
+        if not root.new_day:
             return True
-            
-        for chain in slice.FutureChains.Values:
-            contracts = chain.Contracts.Values
-            
-            #self.Log(str(chain))
-            
-            skip = 0
-            if (self._contract != None):
-                self.Log('Expiry days away {} - {} - {}'.format((self._contract.Expiry-self.Time).days, self._contract.Expiry, self.Time.date))
-            if (self._contract != None and (self._contract.Expiry-self.Time).days <= 3):
-                skip = 1
-                
-            chainContracts = list(contracts) #[contract for contract in chain]
-            chainContracts = sorted(chainContracts, key=lambda x: x.Expiry)
-                
-            if (len(chainContracts) < skip+2):
-                return False
-                
-            first = chainContracts[skip]
-            second = chainContracts[skip+1]
-            
-            if (first != None and second != None):
-                
-                self.Log('RESET: ' + first.Symbol.Value + ' - ' + second.Symbol.Value)
-                self.reset=True
-                
-                if (first != None and (self._contract == None or self._contract.Symbol != first.Symbol)):
-                    
-                    if (self._nextContract != None):
-                        
-                        self._bb = self._nextBb
-                        self._contract = self._nextContract
-                        
-                    else:
-                        
-                        self._contract = first
-                        
-                        oneHour = TradeBarConsolidator(TimeSpan.FromMinutes(60))
-                        oneHour.DataConsolidated += self.OnHour
-                        
-                        self.SubscriptionManager.AddConsolidator(self._contract.Symbol, oneHour)
-                        self._bb = self.BB(self._contract.Symbol, 20, 2, MovingAverageType.Exponential, Resolution.Hour)
-                        
-                        history = self.History(self._contract.Symbol, 50*60, Resolution.Minute).reset_index(drop=False)
-                        self.Log(len(history))
-                        
-                        for bar in history.itertuples():
-
-                            #if (bar.EndTime.Minute == 0 and (self.Time-bar.EndTime).TotalMinutes >=2):
-
-                            if (bar.time.minute == 0 and ((self.Time-bar.time)/pd.Timedelta(minutes=1)) >=2):
-                                
-                                self.Log(str(bar))
-                                #self._bb.Update(self._contract.Symbol, bar.time, bar.close)
-                                self._bb.Update(bar.time, bar.close)
-                                
-                        self.Log(str(self._bb.IsReady))
-
-                if (second != None and (self._nextContract == None or (self._nextContract.Symbol != second.Symbol))):
-                    
-                    self._nextContract = second
-                    oneHour = TradeBarConsolidator(TimeSpan.FromMinutes(60))
-                    oneHour.DataConsolidated += self.OnHour
-                    
-                    self.SubscriptionManager.AddConsolidator(self._nextContract.Symbol, oneHour)
-                    self._nextBb = self.BB(self._nextContract.Symbol, 20, 2, MovingAverageType.Exponential, Resolution.Hour)
-                    
-                self._newDay=False
-                return True
-                
-        return False
-        
-        
-    def OnHour(self, sender, TradeBar):
-        pass
-    
+
+        contract = root.contract
+        if (contract != None and (contract.Expiry - self.Time).days < 3):
+            self._events('Expiry days away {} - {} - {}', (contract.Expiry-self.Time).days, contract.Expiry, self.Time.date)
+
+        if not root.roll.update(slice):
+            return False
+
+        if root.roll.rolled:
+
+            previous = root.contract
+            root.contract = root.roll.contract
+            root.next_contract = root.roll.next_contract
+            self._engine.track(root.slot, root.contract.Symbol)
+            if previous is None:
+                self.WarmUpBands(root)
+            else:
+                roll = root.continuous.roll(self.Time, root.contract.Symbol, self.Securities[previous.Symbol].Price,
+                                            self.Securities[root.contract.Symbol].Price)
+                if roll is not None:
+                    self._engine.adjust(root.slot, roll.factor, roll.offset)
+
+            self._events('RESET: {} - {}', root.contract.Symbol.Value,
+                         root.next_contract.Symbol.Value if root.next_contract is not None else None)
+            self._journal.signal('RESET', root.contract.Symbol)
+            self.reset=True
+
+        root.new_day=False
+        return True
+
+    def WarmUpBands(self, root):
+
+        # the cached continuous series if there is one, otherwise the first contract's history
+        bars = root.continuous.bars(50, self.Time)
+        times, closes = bars[0], bars[4]
+        if len(closes) < 50:
+            bars = history_bars(self, root.contract.Symbol, 50*60, Resolution.Minute)
+            times, closes = consolidate_bars(bars, self.Time, 60)
+        self._events('{} bars, {} hourly bars', len(bars[0]), len(closes))
+
+        self._engine.load(root.slot, closes)
+
+        self._events('{}', self._engine.is_ready(root.slot))
+
+    def OnHour(self, engine, slots):
+        for slot in slots.tolist():
+            self._by_slot[slot].continuous.update(engine.bar(slot))
+
     def OnEndOfDay(self):
-        self._newDay=True                        
+        for root in self._roots:
+            root.new_day=True
+            root.continuous.flush()
+        self._log.flush()
+
+    def OnEndOfAlgorithm(self):
+        self._log.flush()
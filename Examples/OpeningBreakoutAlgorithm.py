@@ -0,0 +1,355 @@
+from AlgorithmBase import *
+from bisect import bisect_left
+from datetime import datetime, time, timedelta
+from functools import partial
+
+from IndicatorWarmUp import history_bars
+from LazyLog import LazyLog, DEBUG, INFO, parse_level
+from StopTargetEngine import StopTargetEngine, STOP
+from TradeJournal import journal_for
+
+
+# session phases, in the order they happen each day
+CLOSED = 0
+OPENING = 1
+ENTRY = 2
+MANAGE = 3
+
+# calendar events
+SESSION = 0
+RANGE = 1
+CUTOFF = 2
+HALF_HOUR = 3
+CLOSE = 4
+
+
+class SessionCalendar:
+    '''
+    The intraday events of every weekday from start to end, computed once, as two parallel
+    lists of times and event kinds in time order. Each event is timed at the first bar it
+    applies to, so the per-second test is a single comparison against the next event time.
+    '''
+
+    def __init__(self, start, end, period, open=time(9, 30), close=time(16, 0), span_minutes=3,
+                 cutoff=time(10, 0), bar_minutes=30):
+        self.times = []
+        self.kinds = []
+        day = datetime(start.year, start.month, start.day)
+        while day <= end:
+            if day.weekday() < 5:
+                session_open = datetime.combine(day.date(), open)
+                session_close = datetime.combine(day.date(), close)
+                events = [(session_open + period, SESSION),
+                          (session_open + timedelta(minutes=span_minutes) + period, RANGE),
+                          (datetime.combine(day.date(), cutoff), CUTOFF)]
+                boundary = session_open + timedelta(minutes=bar_minutes)
+                while boundary <= session_close:
+                    events.append((boundary + period, HALF_HOUR))
+                    boundary += timedelta(minutes=bar_minutes)
+                events.append((session_close + period, CLOSE))
+                # stable, so the last half hour bar is taken before the session closes
+                events.sort(key=lambda e: e[0])
+                for event_time, kind in events:
+                    self.times.append(event_time)
+                    self.kinds.append(kind)
+            day += timedelta(days=1)
+
+    def index(self, now):
+        '''The index of the first event at or after now.'''
+        return bisect_left(self.times, now)
+
+
+class SymbolState:
+    '''The indicators, session aggregates and position of one traded symbol.'''
+    __slots__ = ('symbol', 'hma', 'atr', 'std', 'smoothed_atr', 'smoothed_std', 'psar',
+                 'open', 'high', 'low', 'close', 'sampled', 'range_high', 'range_low',
+                 'ceiling', 'capture', 'exit', 'done')
+
+    def __init__(self, symbol, smoothing):
+        ticker = symbol.Value
+        self.symbol = symbol
+        # the trend, on 30 minute closes
+        self.hma = HullMovingAverage(ticker + '_HMA14', 4)
+        # the daily volatility, smoothed over a week of market hours
+        self.atr = AverageTrueRange(ticker + '_ATR14', 14)
+        self.std = StandardDeviation(ticker + '_STD14', 14)
+        self.smoothed_atr = ExponentialMovingAverage('Smoothed_' + self.atr.Name, smoothing)
+        self.smoothed_std = ExponentialMovingAverage('Smoothed_' + self.std.Name, smoothing)
+        self.psar = ParabolicStopAndReverse(ticker, afStart=0, afIncrement=0.000025)
+
+        self.open = self.high = self.low = self.close = 0.0
+        self.sampled = True
+        self.range_high = self.range_low = 0.0
+        self.ceiling = 0.0
+        self.capture = 0.0
+        self.exit = None
+        self.done = True
+
+    def add_day(self, start, open, high, low, close):
+        '''Updates the daily indicators with a session and returns its end time.'''
+        bar = TradeBar(start, self.symbol, open, high, low, close, 0, timedelta(days=1))
+        end = bar.EndTime
+        self.atr.Update(bar)
+        self.std.Update(end, close)
+        self.smoothed_atr.Update(end, self.atr.Current.Value)
+        self.smoothed_std.Update(end, self.std.Current.Value)
+        return end
+
+
+### <summary>
+### QCU: Opening Breakout Algorithm, ported from OpeningRangeBreakout.cs for many symbols
+### at second resolution.
+###
+### The opening range is the high and low of the first minutes of the session, kept from the
+### feed, and each symbol may trade a breakout of it in the direction of its 30 minute HMA
+### before 10am, if its recent daily ATR or STD are large enough. Positions are sized by the
+### ATR, start with a fixed stop loss and switch to a PSAR trailing stop once in profit,
+### both held by a StopTargetEngine.
+###
+### Everything time of day related runs off a SessionCalendar, so a second costs one time
+### comparison plus the work for the symbols in the slice. The volatility gates only change
+### once a day and are kept as a price ceiling per symbol. Stops are checked against each
+### bar, exiting with a market order, rather than resting stop orders that would be updated
+### every second.
+### </summary>
+class OpeningBreakoutAlgorithm(QCAlgorithm):
+
+    def Initialize(self):
+
+        self.SetStartDate(2015, 1, 1)    #Set Start Date
+        self.SetEndDate(2015, 6, 1)      #Set End Date
+        self.SetCash(100000)             #Set Strategy Cash
+
+        # leverage tradier $1 traders
+        self.SetBrokerageModel(BrokerageName.TradierBrokerage)
+
+        # risk control
+        self.maximum_leverage = float(self.GetParameter('maximum_leverage') or 4)
+        self.profit_start_psar = float(self.GetParameter('profit_start_psar') or 0.0005)  # @100k order size this is 50 bucks
+        self.risk_per_position = float(self.GetParameter('risk_per_position') or 0.0025)
+        self.use_volatility = (self.GetParameter('use_volatility') or 'true').lower() != 'false'
+
+        # entrance criteria
+        span_minutes = int(self.GetParameter('opening_span') or 3)
+        self.breakout_threshold = float(self.GetParameter('breakout_threshold') or 0.00005)
+        self.atr_threshold = float(self.GetParameter('atr_threshold') or 0.002)
+        self.std_threshold = float(self.GetParameter('std_threshold') or 0.0025)
+
+        self._exits = StopTargetEngine(self, on_exit=self.OnExit)
+
+        self._log = LazyLog(self, level=parse_level(self.GetParameter('log_level')))
+        self._ranges = self._log.channel('ranges', DEBUG)
+        self._trades = self._log.channel('trades', INFO)
+        self._journal = journal_for(self)
+
+        # request high resolution equity data for each symbol
+        one_week_in_market_hours = int(5*6.5)
+        self._states = dict()
+        for ticker in (self.GetParameter('symbols') or 'SPY').split(','):
+            security = self.AddEquity(ticker.strip(), Resolution.Second)
+            security.SetLeverage(self.maximum_leverage)
+            state = SymbolState(security.Symbol, one_week_in_market_hours)
+            self._states[security.Symbol] = state
+
+        self._period = timedelta(seconds=1)
+        self._calendar = SessionCalendar(self.StartDate - timedelta(days=7), self.EndDate + timedelta(days=1),
+                                         self._period, span_minutes=span_minutes)
+        self._event = None
+        self._next_event = None
+        self._phase = CLOSED
+        self._session_start = None
+
+    def WarmUpSymbol(self, state):
+        '''Feeds the last 20 daily bars to the trend and volatility indicators, like the original.'''
+        times, opens, highs, lows, closes, _ = history_bars(self, state.symbol, 20, Resolution.Daily)
+        period = timedelta(days=1)
+        for end, open, high, low, close in zip(times.astype('datetime64[us]').tolist(), opens.tolist(),
+                                               highs.tolist(), lows.tolist(), closes.tolist()):
+            end = state.add_day(end - period, open, high, low, close)
+            state.hma.Update(end, close)
+        self.UpdateGates(state)
+
+    def UpdateGates(self, state):
+        '''
+        Caches the day's volatility requirement as the price below which it is met, and the
+        expected capture that sizes positions.
+        '''
+        if not self.use_volatility:
+            state.ceiling = float('inf')
+        else:
+            state.ceiling = max(state.smoothed_atr.Current.Value / self.atr_threshold,
+                                state.smoothed_std.Current.Value / self.std_threshold)
+        # expect to capture 10% of the daily range
+        state.capture = 0.1 * state.atr.Current.Value
+
+    def OnData(self, slice):
+
+        time = self.Time
+        if self._next_event is None or time >= self._next_event:
+            self.OnCalendar(time)
+
+        phase = self._phase
+        states = self._states
+        for bar in slice.Bars.Values:
+            state = states.get(bar.Symbol)
+            if state is None:
+                continue
+            high, low, close = bar.High, bar.Low, bar.Close
+
+            if phase:
+                # the session so far, which is the opening range until the RANGE event
+                if state.open == 0.0:
+                    state.open, state.high, state.low = bar.Open, high, low
+                else:
+                    if high > state.high:
+                        state.high = high
+                    if low < state.low:
+                        state.low = low
+                state.close = close
+                state.sampled = False
+
+            state.psar.Update(bar)
+
+            if state.exit is not None:
+                # the stop rested through this bar, then it may trail the PSAR
+                self._exits.update(state.symbol, high, low, close)
+            elif phase == ENTRY and not state.done and not self._exits.entering(state.symbol):
+                self.ScanForEntrance(state, low, high, close)
+
+    def OnCalendar(self, now):
+        '''Runs the calendar events up to now and moves to the next one.'''
+        calendar = self._calendar
+        if self._event is None:
+            # the first data: warm up as of now and skip the events before it
+            for state in self._states.values():
+                self.WarmUpSymbol(state)
+            self._event = calendar.index(now)
+        times, kinds = calendar.times, calendar.kinds
+        i = self._event
+        while i < len(times) and times[i] <= now:
+            kind = kinds[i]
+            if kind == SESSION:
+                self.OnSessionOpen(times[i])
+            elif kind == RANGE:
+                self.OnOpeningRange()
+            elif kind == CUTOFF:
+                self._phase = MANAGE
+            elif kind == HALF_HOUR:
+                self.OnHalfHour(times[i])
+            else:
+                self.OnSessionClose()
+            i += 1
+        self._event = i
+        self._next_event = times[i] if i < len(times) else datetime.max
+
+    def OnSessionOpen(self, event_time):
+        self._phase = OPENING
+        self._session_start = datetime(event_time.year, event_time.month, event_time.day)
+        for state in self._states.values():
+            state.open = state.high = state.low = state.close = 0.0
+            state.sampled = True
+            state.done = False
+            state.psar.Reset()
+
+    def OnOpeningRange(self):
+        self._phase = ENTRY
+        for state in self._states.values():
+            if state.open == 0.0:
+                # no trades in the opening span, nothing to break out of today
+                state.done = True
+                continue
+            # widen the range when looking for breakouts
+            state.range_low = state.low * (1 - self.breakout_threshold)
+            state.range_high = state.high * (1 + self.breakout_threshold)
+            self._ranges('OpeningBarRange: {} Low: {:.2f} High: {:.2f}', state.symbol.Value,
+                         state.range_low, state.range_high)
+            self._journal.snapshot(state.symbol, range_low=state.range_low, range_high=state.range_high,
+                                   hma=state.hma)
+
+    def OnHalfHour(self, event_time):
+        # the event runs one bar after the boundary, so the 30 minute bar ends at the boundary
+        end = event_time - self._period
+        for state in self._states.values():
+            if not state.sampled:
+                state.hma.Update(end, state.close)
+                state.sampled = True
+
+    def OnSessionClose(self):
+        self._phase = CLOSED
+        for state in self._states.values():
+            if state.open != 0.0:
+                state.add_day(self._session_start, state.open, state.high, state.low, state.close)
+                self.UpdateGates(state)
+
+    def ScanForEntrance(self, state, low, high, close):
+
+        # we're looking for a breakout of the opening range bar in the direction of the medium
+        # term trend, if there's been enough recent volatility for this strategy to work
+        if close > state.range_high:
+            if close >= state.ceiling or close <= state.hma.Current.Value:
+                return
+            direction = 1
+        elif close < state.range_low:
+            if close >= state.ceiling or close >= state.hma.Current.Value:
+                return
+            direction = -1
+        else:
+            return
+
+        if state.capture <= 0 or self.Portfolio[state.symbol].Quantity != 0:
+            return
+        allowed_dollar_loss = self.risk_per_position * self.Portfolio.TotalPortfolioValue
+        shares = int(allowed_dollar_loss / state.capture)
+
+        # max out at a little below our stated max, prevents margin calls and such
+        max_shares = abs(self.CalculateOrderQuantity(state.symbol, .75 * self.maximum_leverage * direction))
+        shares = min(shares, max_shares)
+        if shares <= 0:
+            return
+
+        # the stop percentage defined by dollars loss
+        stop_loss_percentage = allowed_dollar_loss / (shares * close)
+
+        # we'll start with a global, non-trailing stop loss, and once we're up a certain
+        # percentage the PSAR controls our stop. The stop is set when the order fills.
+        if direction > 0:
+            stop = low * (1 - stop_loss_percentage)
+        else:
+            stop = high * (1 + stop_loss_percentage)
+        self._exits.enter(state.symbol, direction * shares, partial(self.OnEntry, state, stop))
+
+    def OnEntry(self, state, stop, symbol, quantity, entry):
+        if quantity > 0:
+            activation = entry * (1 + self.profit_start_psar)
+        else:
+            activation = entry * (1 - self.profit_start_psar)
+        state.exit = self._exits.add(symbol, quantity, stop=stop, trailing=state.psar, activation=activation)
+        self._trades('Enter {} {} @ {:.2f} Shares: {} Stop: {:.2f}', 'long' if quantity > 0 else 'short',
+                     symbol.Value, entry, abs(quantity), stop)
+        self._journal.signal('ENTER_LONG' if quantity > 0 else 'ENTER_SHORT', symbol, entry)
+        self.Plot(symbol.Value, 'Enter', entry)
+
+    def OnOrderEvent(self, order_event):
+        self._exits.on_order_event(order_event, order_event.Status in (OrderStatus.Canceled, OrderStatus.Invalid))
+
+    def OnExit(self, exit, kind, ticket):
+        state = self._states[exit.symbol]
+        state.exit = None
+        if kind == STOP:
+            # we only trade max once per day
+            state.done = True
+        self._trades('Exit {} {} @ {:.2f}', exit.symbol.Value, kind, ticket.AverageFillPrice)
+        self._journal.signal('EXIT_' + kind.upper(), exit.symbol, ticket.AverageFillPrice)
+        self.Plot(exit.symbol.Value, 'Exit', ticket.AverageFillPrice)
+
+    def OnEndOfDay(self):
+        # if we're still invested by the end of the day, liquidate
+        for state in self._states.values():
+            if state.exit is not None:
+                self._exits.cancel(state.exit)
+                ticket = self.MarketOrder(state.symbol, -state.exit.quantity, tag='EndOfDay')
+                self.OnExit(state.exit, 'EndOfDay', ticket)
+        self._log.flush()
+
+    def OnEndOfAlgorithm(self):
+        self._log.flush()
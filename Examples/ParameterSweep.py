@@ -0,0 +1,420 @@
+'''
+Parallel parameter sweeps of an algorithm over a local data folder.
+
+The data folder is read once into a single memory-mapped file, and every worker process maps
+that file read-only, so the market data is never pickled per task and the page cache holds
+one copy of it. Parameter sets are handed to a process pool and each run is a LocalReplay
+with the set passed to GetParameter, and its StreamingMetrics (Sharpe ratio, drawdown, win
+rate) are kept as it runs. Results stream back as runs complete and are ranked by the
+objective as they arrive.
+
+    python ParameterSweep.py FuturesMovingAverageCrossOverExample2.py --data ~/data \\
+        --grid fast_sma_period=10,14,18 --grid slow_sma_period=40,50,60 --workers 8
+
+    for result, rank in ParameterSweep(path, data).run(grid(fast_sma_period=[10, 14, 18])):
+        ...
+'''
+
+import argparse
+import itertools
+import multiprocessing
+import os
+import random
+import tempfile
+import time as timer
+from bisect import bisect
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from LocalReplay import (BAR_COLUMNS, TICK_COLUMNS, LocalDataFolder, LocalReplay, load_algorithm, read_chunks,
+                         to_ns)
+from LocalLean import RESOLUTION_NAMES, RESOLUTION_PERIODS, Resolution
+from HistoryCache import HistoryCache
+from StreamingMetrics import StreamingMetrics
+from TradeJournal import TradeJournal
+
+
+OBJECTIVES = ('net_profit', 'portfolio_value', 'sharpe')
+COLUMNS = ('net_profit', 'portfolio_value', 'fees', 'orders', 'sharpe', 'max_drawdown', 'trades', 'win_rate')
+
+
+# Parameter spaces
+
+def grid(**axes):
+    '''Every combination of the values of each parameter, as a list of dicts.'''
+    names = list(axes)
+    return [dict(zip(names, values)) for values in itertools.product(*(axes[n] for n in names))]
+
+
+def random_search(count, seed=None, **axes):
+    '''
+    count random parameter sets. An axis given as a (low, high) tuple is sampled uniformly,
+    as integers if both bounds are integers. Any other sequence is sampled by choice.
+    '''
+    rng = random.Random(seed)
+    sets = []
+    for _ in range(count):
+        parameters = dict()
+        for name, axis in axes.items():
+            if isinstance(axis, tuple) and len(axis) == 2:
+                low, high = axis
+                if isinstance(low, int) and isinstance(high, int):
+                    parameters[name] = rng.randint(low, high)
+                else:
+                    parameters[name] = rng.uniform(low, high)
+            else:
+                parameters[name] = rng.choice(list(axis))
+        sets.append(parameters)
+    return sets
+
+
+# Shared data
+
+def _shared_directory():
+    return '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+
+
+class SharedDataFolder(LocalDataFolder):
+    '''
+    A LocalDataFolder loaded into one flat file of 8 byte columns. manifest maps (ticker,
+    resolution name, symbol value) to (offset, rows, columns) in the file, where the first
+    column holds the int64 end times and the others the float64 values. Pickling only carries
+    the file name and the manifest; the file is mapped on first use in each process.
+
+    The file holds the end times in [start, end] of the loaded files. Reads it doesn't cover,
+    such as a history request reaching further back or a resolution that wasn't loaded, go to
+    the files of the folder.
+    '''
+
+    def __init__(self, path, manifest, contracts, root, start=None, end=None):
+        LocalDataFolder.__init__(self, root)
+        self.file = path
+        self.manifest = manifest
+        self.start = start
+        self.end = end
+        self._contracts = contracts
+        self._files = LocalDataFolder(root)
+        self._map = None
+
+    @classmethod
+    def load(cls, root, start=None, end=None, directory=None, subscriptions=None):
+        '''
+        Reads the files of a data folder, restricted to end times in [start, end] and, if
+        subscriptions is given, to its (ticker, resolution) pairs.
+        '''
+        folder = LocalDataFolder(root)
+        if subscriptions is not None:
+            subscriptions = set((ticker.lower(), resolution) for ticker, resolution in subscriptions)
+        fd, path = tempfile.mkstemp(prefix='sweep-', suffix='.bin', dir=directory or _shared_directory())
+        manifest = dict()
+        contracts = dict()
+        offset = 0
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for ticker in sorted(os.listdir(folder.root)):
+                    if not os.path.isdir(os.path.join(folder.root, ticker)):
+                        continue
+                    resolutions = [r for r in RESOLUTION_NAMES
+                                   if subscriptions is None or (ticker, r) in subscriptions]
+                    if not resolutions:
+                        continue
+                    contracts[ticker] = folder.contracts(ticker)
+                    for resolution in resolutions:
+                        name = RESOLUTION_NAMES[resolution]
+                        files = os.path.join(folder.root, ticker, name)
+                        if not os.path.isdir(files):
+                            continue
+                        columns = TICK_COLUMNS if resolution == Resolution.Tick else BAR_COLUMNS
+                        for file_name in sorted(os.listdir(files)):
+                            value, extension = os.path.splitext(file_name)
+                            if extension not in ('.csv', '.parquet') or (ticker, name, value) in manifest:
+                                continue
+                            chunks = list(read_chunks(os.path.join(files, file_name), columns,
+                                                      RESOLUTION_PERIODS[resolution], start, end))
+                            rows = sum(len(c[0]) for c in chunks)
+                            for i in range(len(columns) + 1):
+                                for chunk in chunks:
+                                    chunk[i].astype(np.int64 if i == 0 else np.float64).tofile(f)
+                            manifest[(ticker, name, value)] = (offset, rows, len(columns) + 1)
+                            offset += rows * (len(columns) + 1)
+        except BaseException:
+            os.remove(path)
+            raise
+        return cls(path, manifest, contracts, folder.root, start, end)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['_map'] = None
+        return state
+
+    def _arrays(self, key):
+        if self._map is None:
+            size = os.path.getsize(self.file)
+            self._map = np.memmap(self.file, dtype=np.float64, mode='r') if size else np.empty(0)
+        offset, rows, columns = self.manifest[key]
+        block = self._map[offset:offset + rows * columns]
+        return [block[i * rows:(i + 1) * rows].view(np.int64) if i == 0 else block[i * rows:(i + 1) * rows]
+                for i in range(columns)]
+
+    def path(self, ticker, resolution, value):
+        key = (ticker.lower(), RESOLUTION_NAMES[resolution], value)
+        return key if key in self.manifest else self._files.path(ticker, resolution, value)
+
+    def contracts(self, ticker):
+        contracts = self._contracts.get(ticker.lower())
+        return self._files.contracts(ticker) if contracts is None else contracts
+
+    def chunks(self, symbol, resolution, start=None, end=None):
+        '''
+        The rows of the file in [start, end], or of the data folder if the file doesn't hold
+        them. A start of None reads from the start of the file.
+        '''
+        key = (symbol.ID.Symbol.lower(), RESOLUTION_NAMES[resolution], symbol.Value)
+        if key not in self.manifest or not self._covers(start, end):
+            return self._files.chunks(symbol, resolution, start, end)
+        arrays = self._arrays(key)
+        times = arrays[0]
+        lo = 0 if start is None else np.searchsorted(times, to_ns(start), 'left')
+        hi = len(times) if end is None else np.searchsorted(times, to_ns(end), 'right')
+        if lo >= hi:
+            return iter(())
+        return iter([tuple(a[lo:hi] for a in arrays)])
+
+    def _covers(self, start, end):
+        return ((self.start is None or start is None or start >= self.start) and
+                (self.end is None or (end is not None and end <= self.end)))
+
+    def history_arrays(self, symbol, periods, resolution, end):
+        '''
+        LocalDataFolder.history_arrays() from the file, or from the data folder when a count
+        of bars reaches back before the file's start.
+        '''
+        data = LocalDataFolder.history_arrays(self, symbol, periods, resolution, end)
+        if self.start is None or isinstance(periods, timedelta) or len(data[0]) >= periods:
+            return data
+        return self._files.history_arrays(symbol, periods, resolution, end)
+
+    def close(self):
+        '''Removes the shared file. Only the process that loaded the folder should call this.'''
+        self._map = None
+        if os.path.exists(self.file):
+            os.remove(self.file)
+
+
+# Workers
+
+_worker = None
+
+
+def _initialize_worker(algorithm, class_name, data, start, end, history_cache, journal):
+    global _worker
+    cache = None if history_cache is None else HistoryCache(history_cache)
+    _worker = (load_algorithm(algorithm, class_name), data, start, end, cache, journal)
+
+
+def _run(task):
+    run, parameters = task
+    algorithm_class, data, start, end, cache, journal_folder = _worker
+    result = dict(run=run, parameters=parameters, error=None)
+    clock = timer.perf_counter()
+    try:
+        replay = LocalReplay(algorithm_class, data, dict(parameters), history_cache=cache)
+        metrics = StreamingMetrics().attach(replay.algorithm)
+        journal = None
+        if journal_folder is not None:
+            journal = TradeJournal(journal_folder, run, parameters).attach(replay.algorithm)
+        algorithm = replay.run(start, end)
+        if journal is not None:
+            journal.close()
+        portfolio = algorithm.Portfolio
+        result.update(net_profit=portfolio.TotalNetProfit, portfolio_value=portfolio.TotalPortfolioValue,
+                      fees=portfolio.TotalFees, orders=algorithm._order_id, events=replay.events,
+                      sharpe=metrics.sharpe, max_drawdown=metrics.max_drawdown, trades=metrics.trades,
+                      win_rate=metrics.win_rate)
+    except Exception as e:
+        result['error'] = '{}: {}'.format(type(e).__name__, e)
+    result['seconds'] = timer.perf_counter() - clock
+    return result
+
+
+# Ranking
+
+class Ranking:
+    '''Results kept in descending order of an objective; failed runs are kept apart.'''
+
+    def __init__(self, objective='net_profit'):
+        self.objective = objective
+        self.results = []
+        self.failed = []
+        self._keys = []
+
+    def add(self, result):
+        '''Adds a result and returns its rank, from 1, or None if the run failed.'''
+        if result['error'] is not None:
+            self.failed.append(result)
+            return None
+        key = -result[self.objective]
+        index = bisect(self._keys, key)
+        self._keys.insert(index, key)
+        self.results.insert(index, result)
+        return index + 1
+
+    def table(self, top=20):
+        rows = self.results[:top]
+        if not rows:
+            return 'no completed runs'
+        names = sorted(set(name for r in rows for name in r['parameters']))
+        header = ['rank'] + names + list(COLUMNS) + ['seconds']
+        lines = [header]
+        for rank, r in enumerate(rows, 1):
+            lines.append([str(rank)] + [str(r['parameters'].get(n, '')) for n in names] +
+                         ['{:.2f}'.format(r['net_profit']), '{:.2f}'.format(r['portfolio_value']),
+                          '{:.2f}'.format(r['fees']), str(r['orders']), '{:.2f}'.format(r['sharpe']),
+                          '{:.2%}'.format(r['max_drawdown']), str(r['trades']), '{:.1%}'.format(r['win_rate']),
+                          '{:.1f}'.format(r['seconds'])])
+        widths = [max(len(line[i]) for line in lines) for i in range(len(header))]
+        return '\n'.join('  '.join(cell.rjust(w) for cell, w in zip(line, widths)) for line in lines)
+
+
+class ParameterSweep:
+    '''
+    Runs an algorithm file once per parameter set over a process pool. run() yields (result,
+    rank) as runs complete; ranking holds every result so far. data may be a path or an
+    already loaded SharedDataFolder, which is reused and left open. history_cache is a
+    HistoryCache folder the workers share for their history requests. journal is a folder
+    each run records a TradeJournal in, under the run id of its result.
+
+    A data path is loaded for the subscriptions the algorithm makes in Initialize with each
+    parameter set, from its first warm-up bar less history_margin, which covers history
+    requests made as it starts, through its last day. Earlier history is read from the files.
+    '''
+
+    def __init__(self, algorithm, data, class_name=None, start=None, end=None, workers=None,
+                 objective='net_profit', history_cache=None, journal=None, history_margin=timedelta(days=7)):
+        if objective not in OBJECTIVES:
+            raise ValueError('objective must be one of {}'.format(', '.join(OBJECTIVES)))
+        self.algorithm = os.path.abspath(algorithm)
+        self.data = data
+        self.class_name = class_name
+        self.start = start
+        self.end = end
+        self.workers = workers or os.cpu_count() or 1
+        self.history_cache = history_cache
+        self.journal = journal
+        self.history_margin = history_margin
+        self.ranking = Ranking(objective)
+        self.elapsed = 0.0
+
+    def data_window(self, parameter_sets):
+        '''
+        (start, end, subscriptions) of the data the runs of parameter_sets read, where
+        subscriptions holds the (ticker, resolution) pairs of the securities they add.
+        '''
+        algorithm_class = load_algorithm(self.algorithm, self.class_name)
+        start, end, subscriptions = None, None, set()
+        seen = set()
+        for parameters in parameter_sets:
+            key = tuple(sorted(parameters.items()))
+            if key in seen:
+                continue
+            seen.add(key)
+            replay = LocalReplay(algorithm_class, self.data, dict(parameters))
+            begin = replay.initialize(self.start, self.end) - self.history_margin
+            start = begin if start is None else min(start, begin)
+            end = replay.end if end is None else max(end, replay.end)
+            for security in replay.algorithm.Securities.values():
+                subscriptions.add((security.Symbol.ID.Symbol, security.Resolution))
+        return start, end, subscriptions
+
+    def run(self, parameter_sets):
+        # fail here rather than in every worker if the algorithm can't be loaded
+        load_algorithm(self.algorithm, self.class_name)
+
+        data = self.data
+        owned = not isinstance(data, SharedDataFolder)
+        if owned:
+            parameter_sets = list(parameter_sets)
+            start, end, subscriptions = self.data_window(parameter_sets)
+            data = SharedDataFolder.load(data, start, end, subscriptions=subscriptions)
+        clock = timer.perf_counter()
+        try:
+            pool = multiprocessing.Pool(self.workers, _initialize_worker,
+                                        (self.algorithm, self.class_name, data, self.start, self.end,
+                                         self.history_cache, self.journal))
+            # run ids sort in the order of the parameter sets, after the runs of earlier sweeps
+            prefix = datetime.now().strftime('%Y%m%d-%H%M%S')
+            tasks = [('{}-{:05d}'.format(prefix, i), parameters) for i, parameters in enumerate(parameter_sets)]
+            try:
+                for result in pool.imap_unordered(_run, tasks):
+                    yield result, self.ranking.add(result)
+            finally:
+                pool.terminate()
+                pool.join()
+        finally:
+            self.elapsed = timer.perf_counter() - clock
+            if owned:
+                data.close()
+
+
+def _parse_value(text):
+    for kind in (int, float):
+        try:
+            return kind(text)
+        except ValueError:
+            pass
+    return text
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run a parameter sweep of an algorithm over local data files.')
+    parser.add_argument('algorithm', help='algorithm file')
+    parser.add_argument('--data', required=True, help='local data folder')
+    parser.add_argument('--class', dest='class_name', help='algorithm class, if not named after the file')
+    parser.add_argument('--start', type=datetime.fromisoformat, help='override the start date')
+    parser.add_argument('--end', type=datetime.fromisoformat, help='override the end date')
+    parser.add_argument('--grid', action='append', default=[], metavar='NAME=V1,V2,...',
+                        help='values of a parameter, every combination is run')
+    parser.add_argument('--random', action='append', default=[], metavar='NAME=LOW:HIGH|V1,V2,...',
+                        help='range or values of a parameter sampled by --samples random runs')
+    parser.add_argument('--samples', type=int, default=20, help='number of random runs')
+    parser.add_argument('--seed', type=int, help='random search seed')
+    parser.add_argument('--workers', type=int, help='worker processes, the number of cores by default')
+    parser.add_argument('--objective', default='net_profit', choices=OBJECTIVES, help='ranking objective')
+    parser.add_argument('--history-cache', metavar='FOLDER', help='share an on-disk history cache between runs')
+    parser.add_argument('--journal', metavar='FOLDER', help='record a journal of every run in this folder')
+    parser.add_argument('--history-days', type=float, default=7,
+                        help='days of data loaded before the warm-up for history requests')
+    parser.add_argument('--top', type=int, default=20, help='rows of the final table')
+    args = parser.parse_args(argv)
+
+    if args.random:
+        axes = dict()
+        for spec in args.random:
+            name, values = spec.split('=', 1)
+            if ':' in values:
+                axes[name] = tuple(_parse_value(v) for v in values.split(':', 1))
+            else:
+                axes[name] = [_parse_value(v) for v in values.split(',')]
+        parameter_sets = random_search(args.samples, args.seed, **axes)
+    else:
+        parameter_sets = grid(**{name: [_parse_value(v) for v in values.split(',')]
+                                 for name, values in (spec.split('=', 1) for spec in args.grid)})
+
+    sweep = ParameterSweep(args.algorithm, args.data, args.class_name, args.start, args.end, args.workers,
+                           args.objective, args.history_cache, args.journal, timedelta(days=args.history_days))
+    for done, (result, rank) in enumerate(sweep.run(parameter_sets), 1):
+        if rank is None:
+            status = 'failed: {}'.format(result['error'])
+        else:
+            status = 'rank {:>3}  {} {:.2f}'.format(rank, args.objective, result[args.objective])
+        print('[{}/{}] {:.1f}s  {}  {}'.format(done, len(parameter_sets), result['seconds'],
+                                               result['parameters'], status), flush=True)
+
+    print()
+    print(sweep.ranking.table(args.top))
+    print('{} runs on {} workers in {:.1f}s'.format(len(parameter_sets), sweep.workers, sweep.elapsed))
+
+
+if __name__ == '__main__':
+    main()
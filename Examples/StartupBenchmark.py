@@ -0,0 +1,154 @@
+'''
+Cold start cost of the algorithms: how long a fresh process takes to import an algorithm
+file, and which modules that import pulls in.
+
+Each algorithm is loaded the way LocalReplay loads it, in repeat fresh interpreters run with
+-X importtime, after a first run that compiles its bytecode. The time of a process is split
+into the interpreter start, the harness (LocalLean and LocalReplay) and the algorithm file,
+and the slowest modules the algorithm file imported are listed by their median cumulative
+import time. numpy and pandas are reported as loaded only if they were executed, not just
+registered by AlgorithmBase.lazy_import():
+
+    python Examples/StartupBenchmark.py                          # every algorithm in Examples
+    python Examples/StartupBenchmark.py MultipleSymbolConsolidationAlgorithm.py --repeat 20
+
+With a sweep of short runs every worker pays this before Initialize, so an algorithm should
+leave pandas and the like to the code that needs them.
+'''
+
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time as timer
+
+from HandlerProfiler import format_ns
+
+
+FOLDER = os.path.dirname(os.path.abspath(__file__))
+
+MARKER = '-- algorithm --'
+
+HEAVY = ('numpy', 'pandas')
+
+# run in the fresh interpreter: the harness, then the algorithm after the marker
+CHILD = '''
+import json, sys, time
+start = time.perf_counter_ns()
+sys.path.insert(0, {folder!r})
+from LocalReplay import load_algorithm
+from AlgorithmBase import is_loaded
+harness = time.perf_counter_ns()
+sys.stderr.write({marker!r} + '\\n')
+sys.stderr.flush()
+load_algorithm({path!r})
+done = time.perf_counter_ns()
+print(json.dumps({{'harness': harness - start, 'algorithm': done - harness,
+                  'loaded': [m for m in {heavy!r} if is_loaded(m)]}}))
+'''
+
+
+def algorithm_files(folder=FOLDER):
+    '''The files of a folder that define a QCAlgorithm.'''
+    files = []
+    for name in sorted(os.listdir(folder)):
+        if name.endswith('.py'):
+            with open(os.path.join(folder, name)) as f:
+                if re.search(r'^class \w+\(QCAlgorithm\)', f.read(), re.M):
+                    files.append(os.path.join(folder, name))
+    return files
+
+
+def parse_importtime(text):
+    '''The cumulative ns of the top level imports after the marker in -X importtime output.'''
+    imports = dict()
+    _, _, text = text.partition(MARKER)
+    for line in text.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative, name = line.split('|', 2)
+        if not cumulative.strip().isdigit():
+            continue        # the header
+        name = name[1:]
+        if name.startswith(' '):
+            continue        # imported by another module of the algorithm's
+        imports[name] = imports.get(name, 0) + int(cumulative) * 1000
+    return imports
+
+
+def run_once(path, python=sys.executable):
+    '''One fresh process importing an algorithm: its wall time, harness and algorithm ns and imports.'''
+    code = CHILD.format(folder=FOLDER, marker=MARKER, path=os.path.abspath(path), heavy=HEAVY)
+    start = timer.perf_counter_ns()
+    result = subprocess.run([python, '-X', 'importtime', '-c', code], capture_output=True, text=True)
+    wall = timer.perf_counter_ns() - start
+    if result.returncode:
+        raise RuntimeError('{} failed to load:\n{}'.format(path, result.stderr[-2000:]))
+    times = json.loads(result.stdout.strip().splitlines()[-1])
+    return wall, times, parse_importtime(result.stderr)
+
+
+def interpreter_ns(repeat, python=sys.executable):
+    '''The median wall time of a process that does nothing.'''
+    walls = []
+    for _ in range(repeat):
+        start = timer.perf_counter_ns()
+        subprocess.run([python, '-c', 'pass'], check=True)
+        walls.append(timer.perf_counter_ns() - start)
+    return statistics.median(walls)
+
+
+def benchmark(path, repeat=10, python=sys.executable):
+    '''The median times of importing an algorithm in repeat fresh processes.'''
+    run_once(path, python)      # compiles the bytecode
+    walls, harness, algorithm, loaded, imports = [], [], [], set(), dict()
+    for _ in range(repeat):
+        wall, times, modules = run_once(path, python)
+        walls.append(wall)
+        harness.append(times['harness'])
+        algorithm.append(times['algorithm'])
+        loaded.update(times['loaded'])
+        for name, ns in modules.items():
+            imports.setdefault(name, []).append(ns)
+    return dict(name=os.path.basename(path), wall=statistics.median(walls), harness=statistics.median(harness),
+                algorithm=statistics.median(algorithm), best=min(algorithm), loaded=sorted(loaded),
+                imports=sorted(((statistics.median(v), k) for k, v in imports.items()), reverse=True))
+
+
+def report(results, interpreter, top=3):
+    header = ['algorithm', 'process', 'harness', 'import', 'best', 'loads', 'slowest imports']
+    lines = [header]
+    for r in results:
+        slowest = ', '.join('{} {}'.format(name, format_ns(ns)) for ns, name in r['imports'][:top])
+        lines.append([r['name'], format_ns(r['wall']), format_ns(r['harness']), format_ns(r['algorithm']),
+                      format_ns(r['best']), ' '.join(r['loaded']) or '-', slowest or '-'])
+    widths = [max(len(line[i]) for line in lines) for i in range(len(header) - 1)]
+    text = ['interpreter start: {} (median of a bare process)'.format(format_ns(interpreter))]
+    for line in lines:
+        cells = [cell.ljust(w) if i == 0 else cell.rjust(w) for i, (cell, w) in enumerate(zip(line, widths))]
+        text.append('  '.join(cells + [line[-1]]))
+    return '\n'.join(text)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure the cold start import cost of the algorithms.')
+    parser.add_argument('algorithms', nargs='*', help='algorithm files (every algorithm in Examples by default)')
+    parser.add_argument('--repeat', type=int, default=10, help='fresh processes per algorithm')
+    parser.add_argument('--top', type=int, default=3, help='slowest imports listed per algorithm')
+    parser.add_argument('--python', default=sys.executable, help='interpreter to measure')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args(argv)
+
+    results = [benchmark(path, args.repeat, args.python) for path in args.algorithms or algorithm_files()]
+    print(report(results, interpreter_ns(args.repeat, args.python), args.top))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=1)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
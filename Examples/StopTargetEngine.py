@@ -0,0 +1,288 @@
+'''
+Stop loss and take profit exits held as price levels, checked against each bar.
+
+An exit is registered once, at entry, with absolute stop and target prices. The levels of a
+symbol are kept in two sorted lists: the ones a falling price hits (long stops, short
+targets) and the ones a rising price hits (long targets, short stops). A bar is checked
+against the highest of the first and the lowest of the second, so a bar that crosses
+nothing costs two comparisons however many exits are open, and symbols without exits
+aren't looked at. When a level is crossed its position is closed with a market
+order, its other level is removed, and on_exit is called with the exit, STOP or TARGET and
+the ticket:
+
+    self.exits = StopTargetEngine(self, on_exit=self.OnExit)
+    ...
+    ticket = self.MarketOrder(symbol, 1)
+    self.exits.add(symbol, 1, stop=price * 0.98, target=price * 1.02)
+    ...
+    self.exits.on_data(slice)                   # in OnData
+
+An order may fill after MarketOrder returns (live, or when the market is closed), so an
+entry can be placed with enter() instead, which calls back with the filled quantity and
+price once the algorithm's order events report the fill, and the exit is registered then:
+
+    self.exits.enter(symbol, 1, self.OnEntry)   # OnEntry(symbol, quantity, price) adds the exit
+    ...
+    def OnOrderEvent(self, order_event):
+        closed = order_event.Status in (OrderStatus.Canceled, OrderStatus.Invalid)
+        self.exits.on_order_event(order_event, closed)
+
+A stop can trail an indicator such as a PSAR: once the close has moved past the activation
+price and the indicator is on the right side of the close and tighter than the stop, the
+stop follows the indicator on every bar.
+'''
+
+from bisect import bisect_left, bisect_right
+
+
+STOP = 'Stop'
+TARGET = 'Target'
+
+
+class Exit:
+    '''The stop and target of a position of quantity (negative if short) in symbol.'''
+    __slots__ = ('symbol', 'quantity', 'stop', 'target', 'tag', 'trailing', 'activation', 'active', 'open')
+
+    def __init__(self, symbol, quantity, stop, target, tag, trailing, activation):
+        self.symbol = symbol
+        self.quantity = quantity
+        self.stop = stop
+        self.target = target
+        self.tag = tag
+        self.trailing = trailing
+        self.activation = activation
+        self.active = False
+        self.open = True
+
+    @property
+    def IsLong(self):
+        return self.quantity > 0
+
+
+class _Entry:
+    '''An entry order of quantity and what has filled of it.'''
+    __slots__ = ('quantity', 'on_fill', 'order_id', 'filled', 'cost')
+
+    def __init__(self, quantity, on_fill):
+        self.quantity = quantity
+        self.on_fill = on_fill
+        self.order_id = None
+        self.filled = 0
+        self.cost = 0.0
+
+
+class _Book:
+    '''The levels of one symbol: falling ones hit when low <= level, rising ones when high >= level.'''
+    __slots__ = ('falling', 'falling_exits', 'rising', 'rising_exits', 'trailing')
+
+    def __init__(self):
+        self.falling = []
+        self.falling_exits = []
+        self.rising = []
+        self.rising_exits = []
+        self.trailing = []
+
+    def __bool__(self):
+        return bool(self.falling or self.rising or self.trailing)
+
+    @staticmethod
+    def _insert(levels, exits, level, exit):
+        i = bisect_right(levels, level)
+        levels.insert(i, level)
+        exits.insert(i, exit)
+
+    @staticmethod
+    def _remove(levels, exits, level, exit):
+        i = bisect_left(levels, level)
+        while exits[i] is not exit:
+            i += 1
+        del levels[i]
+        del exits[i]
+
+    def add(self, exit, level, falling):
+        if falling:
+            self._insert(self.falling, self.falling_exits, level, exit)
+        else:
+            self._insert(self.rising, self.rising_exits, level, exit)
+
+    def remove(self, exit, level, falling):
+        if falling:
+            self._remove(self.falling, self.falling_exits, level, exit)
+        else:
+            self._remove(self.rising, self.rising_exits, level, exit)
+
+
+class StopTargetEngine:
+    '''
+    Exits of an algorithm's positions. on_exit(exit, kind, ticket) is called after an exit's
+    market order is placed, kind being STOP or TARGET.
+    '''
+
+    def __init__(self, algorithm, on_exit=None):
+        self.algorithm = algorithm
+        self.on_exit = on_exit
+        self._books = dict()
+        self._count = 0
+        self._entries = dict()      # symbol -> the _Entry of its open entry order
+
+    def __len__(self):
+        return self._count
+
+    def enter(self, symbol, quantity, on_fill, tag=''):
+        '''
+        Places the market order of an entry. on_fill(symbol, quantity, price) is called with the
+        filled quantity and average fill price by on_order_event() once the order has filled,
+        which may be after this returns. Until then entering(symbol) is true.
+        '''
+        entry = _Entry(quantity, on_fill)
+        self._entries[symbol] = entry
+        ticket = self.algorithm.MarketOrder(symbol, quantity, tag=tag)
+        if self._entries.get(symbol) is entry:
+            entry.order_id = ticket.OrderId
+        return ticket
+
+    def entering(self, symbol=None):
+        '''Whether an entry order of symbol, or of any symbol, is waiting for its fill.'''
+        return bool(self._entries) if symbol is None else symbol in self._entries
+
+    def on_order_event(self, order_event, closed=False):
+        '''
+        Follows the fills of the orders placed with enter(), given the algorithm's order events.
+        closed is whether the order was canceled or is invalid, which ends the entry with what
+        filled of it.
+        '''
+        symbol = order_event.Symbol
+        entry = self._entries.get(symbol)
+        # the order id is only known once MarketOrder has returned
+        if entry is None or entry.order_id not in (None, order_event.OrderId):
+            return
+        fill = order_event.FillQuantity
+        if fill:
+            entry.filled += fill
+            entry.cost += fill * order_event.FillPrice
+        if entry.filled == entry.quantity or closed:
+            del self._entries[symbol]
+            if entry.filled:
+                entry.on_fill(symbol, entry.filled, entry.cost / entry.filled)
+
+    def add(self, symbol, quantity, stop=None, target=None, tag='', trailing=None, activation=None):
+        '''
+        Registers the exit of a position of quantity, negative if short. stop and target are
+        prices, either may be None. trailing is an indicator the stop follows once the close
+        is past the activation price, or right away if activation is None.
+        '''
+        exit = Exit(symbol, quantity, stop, target, tag, trailing, activation)
+        book = self._books.get(symbol)
+        if book is None:
+            book = self._books[symbol] = _Book()
+        long = quantity > 0
+        if stop is not None:
+            book.add(exit, stop, long)
+        if target is not None:
+            book.add(exit, target, not long)
+        if trailing is not None:
+            book.trailing.append(exit)
+        self._count += 1
+        return exit
+
+    def cancel(self, exit):
+        '''Removes an exit without trading, when its position was closed some other way.'''
+        if not exit.open:
+            return
+        exit.open = False
+        book = self._books[exit.symbol]
+        long = exit.quantity > 0
+        if exit.stop is not None:
+            book.remove(exit, exit.stop, long)
+        if exit.target is not None:
+            book.remove(exit, exit.target, not long)
+        if exit.trailing is not None:
+            book.trailing.remove(exit)
+        self._count -= 1
+        if not book:
+            del self._books[exit.symbol]
+
+    def move_stop(self, exit, stop):
+        '''Moves the stop of an open exit to a new price.'''
+        if stop == exit.stop:
+            return
+        book = self._books[exit.symbol]
+        long = exit.quantity > 0
+        if exit.stop is not None:
+            book.remove(exit, exit.stop, long)
+        exit.stop = stop
+        book.add(exit, stop, long)
+
+    def exits(self, symbol=None):
+        '''The open exits, of one symbol or of all.'''
+        books = self._books.values() if symbol is None else [self._books.get(symbol)]
+        found = dict()
+        for book in books:
+            if book:
+                for exit in book.falling_exits + book.rising_exits + book.trailing:
+                    found[id(exit)] = exit
+        return list(found.values())
+
+    def update(self, symbol, high, low, close):
+        '''Checks the exits of symbol against a bar, then moves the trailing stops.'''
+        book = self._books.get(symbol)
+        if book is None:
+            return
+
+        falling = book.falling
+        while falling and low <= falling[-1]:
+            self._fire(book.falling_exits[-1], falling[-1])
+            book = self._books.get(symbol)
+            if book is None:
+                return
+            falling = book.falling
+
+        rising = book.rising
+        while rising and high >= rising[0]:
+            self._fire(book.rising_exits[0], rising[0])
+            book = self._books.get(symbol)
+            if book is None:
+                return
+            rising = book.rising
+
+        for exit in book.trailing:
+            self._trail(exit, close)
+
+    def update_bar(self, bar):
+        self.update(bar.Symbol, bar.High, bar.Low, bar.Close)
+
+    def on_data(self, slice):
+        '''Checks the bars of a slice for the symbols with open exits.'''
+        if not self._count:
+            return
+        bars = slice.Bars
+        for symbol in list(self._books):
+            if bars.ContainsKey(symbol):
+                bar = bars[symbol]
+                self.update(symbol, bar.High, bar.Low, bar.Close)
+
+    def _fire(self, exit, level):
+        kind = STOP if level == exit.stop else TARGET
+        self.cancel(exit)
+        ticket = self.algorithm.MarketOrder(exit.symbol, -exit.quantity, tag=exit.tag or kind)
+        if self.on_exit is not None:
+            self.on_exit(exit, kind, ticket)
+
+    def _trail(self, exit, close):
+        indicator = exit.trailing
+        if not indicator.IsReady:
+            return
+        level = indicator.Current.Value
+        stop = exit.stop
+        if not exit.active:
+            long = exit.quantity > 0
+            activation = exit.activation
+            if long:
+                exit.active = (activation is None or close > activation) and \
+                    (stop is None or stop < level) and level < close
+            else:
+                exit.active = (activation is None or close < activation) and \
+                    (stop is None or level < stop) and close < level
+            if not exit.active:
+                return
+        self.move_stop(exit, level)
@@ -0,0 +1,291 @@
+'''
+Performance statistics of a run, kept as it goes in constant memory.
+
+The equity is sampled at the end of each bar with update(), and fills come in through
+on_order_event(). From them the metrics keep a running mean and variance of the period
+returns (Welford), the peak equity and the deepest and longest drawdowns, the time spent
+invested and the average gross exposure, and the count and size of winning and losing
+round trip trades. Nothing is stored per bar or per trade, so a tick replay or every run of
+a sweep can report them without keeping an equity curve:
+
+    self.metrics = StreamingMetrics(self)                       # in Initialize
+    self.metrics.on_order_event(order_event)                    # in OnOrderEvent
+    self.metrics.update(self.Time, self.Portfolio.TotalPortfolioValue,
+                        self.Portfolio.TotalHoldingsValue)      # at the end of OnData
+    self.Log(self.metrics.report())                             # in OnEndOfAlgorithm
+
+attach() does the same for an algorithm instance by wrapping its OnOrderEvent and OnData.
+LocalReplay does this with --metrics, and ParameterSweep for every run.
+'''
+
+import math
+from datetime import datetime, timedelta
+
+from AlgorithmBase import order_fee
+
+
+EPOCH = datetime(1970, 1, 1)
+
+
+class RunningStats:
+    '''Count, mean and variance of a stream of values (Welford's algorithm).'''
+    __slots__ = ('count', 'mean', 'm2')
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, x):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+
+    @property
+    def variance(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance)
+
+
+class _Position:
+    '''The open round trip of one symbol.'''
+    __slots__ = ('quantity', 'price', 'profit')
+
+    def __init__(self):
+        self.quantity = 0
+        self.price = 0.0
+        self.profit = 0.0
+
+
+class StreamingMetrics:
+    '''
+    Returns are taken over each interval (a day by default) from the last equity sampled in
+    it, and annualized with periods_per_year. risk_free is an annual rate. The algorithm, if
+    given, supplies the contract multipliers of the traded symbols.
+    '''
+
+    def __init__(self, algorithm=None, interval=timedelta(days=1), periods_per_year=252, risk_free=0.0):
+        self.algorithm = algorithm
+        self.interval = interval
+        self.periods_per_year = periods_per_year
+        self.risk_free = risk_free
+
+        self.returns = RunningStats()
+        self.samples = 0
+        self.start_equity = None
+        self.equity = None
+        self.start_time = None
+        self.time = None
+
+        self.peak = None
+        self.peak_time = None
+        self.max_drawdown = 0.0
+        self.max_drawdown_duration = timedelta(0)
+
+        self.invested_time = timedelta(0)
+        self.exposure_seconds = 0.0
+        self.exposure = 0.0
+
+        self.trades = 0
+        self.wins = 0
+        self.losses = 0
+        self.gross_profit = 0.0
+        self.gross_loss = 0.0
+        self.largest_win = 0.0
+        self.largest_loss = 0.0
+        self.fills = 0
+        self.fees = 0.0
+
+        self._period_equity = None
+        self._next_period = None
+        self._positions = dict()
+
+    # Equity
+
+    def update(self, time, equity, exposure=0.0):
+        '''
+        Samples the equity at the end of a bar. exposure is the gross holdings value at that
+        time; the algorithm is counted as invested until the next sample if it isn't zero.
+        '''
+        last_time = self.time
+        if last_time is None:
+            self.start_time = self.peak_time = time
+            self.start_equity = self.peak = self._period_equity = equity
+            self._next_period = self._period_end(time)
+        else:
+            if time >= self._next_period:
+                # the period closed at the last sample before the boundary
+                if self._period_equity:
+                    self.returns.add(self.equity / self._period_equity - 1.0)
+                self._period_equity = self.equity
+                self._next_period = self._period_end(time)
+            if self.exposure:
+                elapsed = time - last_time
+                self.invested_time += elapsed
+                if self.equity:
+                    self.exposure_seconds += elapsed.total_seconds() * self.exposure / self.equity
+
+        if equity >= self.peak:
+            self.peak = equity
+            self.peak_time = time
+        else:
+            if self.peak > 0:
+                drawdown = 1.0 - equity / self.peak
+                if drawdown > self.max_drawdown:
+                    self.max_drawdown = drawdown
+            if time - self.peak_time > self.max_drawdown_duration:
+                self.max_drawdown_duration = time - self.peak_time
+
+        self.equity = equity
+        self.exposure = abs(exposure)
+        self.time = time
+        self.samples += 1
+
+    def _period_end(self, time):
+        return time - (time - EPOCH) % self.interval + self.interval
+
+    # Trades
+
+    def on_order_event(self, order_event, multiplier=None):
+        '''
+        Counts a fill. A round trip closes when the position of its symbol goes back to zero,
+        or flips, and is a win if its profit after fees is positive.
+        '''
+        quantity = order_event.FillQuantity
+        if not quantity:
+            return
+        symbol = order_event.Symbol
+        price = order_event.FillPrice
+        fee = order_fee(order_event)
+        if multiplier is None:
+            multiplier = self._multiplier(symbol)
+        self.fills += 1
+        self.fees += fee
+
+        position = self._positions.get(symbol)
+        if position is None:
+            position = self._positions[symbol] = _Position()
+        old = position.quantity
+        new = old + quantity
+        position.profit -= fee
+
+        if old == 0 or (old > 0) == (quantity > 0):
+            position.price = (position.price * old + price * quantity) / new
+            position.quantity = new
+            return
+
+        closed = min(abs(quantity), abs(old)) * (1 if old > 0 else -1)
+        position.profit += (price - position.price) * closed * multiplier
+        if (new > 0) == (old > 0) and new != 0:
+            position.quantity = new
+            return
+
+        self._close_trade(position.profit)
+        position.quantity = new
+        position.price = price
+        position.profit = 0.0
+        if new == 0:
+            del self._positions[symbol]
+
+    def _close_trade(self, profit):
+        self.trades += 1
+        if profit > 0:
+            self.wins += 1
+            self.gross_profit += profit
+            self.largest_win = max(self.largest_win, profit)
+        else:
+            self.losses += 1
+            self.gross_loss -= profit
+            self.largest_loss = max(self.largest_loss, -profit)
+
+    def _multiplier(self, symbol):
+        algorithm = self.algorithm
+        if algorithm is None or not algorithm.Securities.ContainsKey(symbol):
+            return 1.0
+        return float(algorithm.Securities[symbol].SymbolProperties.ContractMultiplier)
+
+    # Hooks
+
+    def attach(self, algorithm, sample='OnData'):
+        '''
+        Counts the fills of the algorithm's order events and samples its equity after every
+        call of the sample handler. Returns the metrics.
+        '''
+        self.algorithm = algorithm
+        portfolio = algorithm.Portfolio
+        on_order_event = algorithm.OnOrderEvent
+        handler = getattr(algorithm, sample)
+        update = self.update
+
+        def OnOrderEvent(order_event):
+            self.on_order_event(order_event)
+            return on_order_event(order_event)
+
+        def sampled(*args):
+            result = handler(*args)
+            update(algorithm.Time, portfolio.TotalPortfolioValue, portfolio.TotalHoldingsValue)
+            return result
+
+        algorithm.OnOrderEvent = OnOrderEvent
+        setattr(algorithm, sample, sampled)
+        return self
+
+    # Results
+
+    @property
+    def sharpe(self):
+        std = self.returns.std
+        if std == 0:
+            return 0.0
+        excess = self.returns.mean - self.risk_free / self.periods_per_year
+        return excess / std * math.sqrt(self.periods_per_year)
+
+    @property
+    def total_return(self):
+        return self.equity / self.start_equity - 1.0 if self.start_equity else 0.0
+
+    @property
+    def win_rate(self):
+        return self.wins / self.trades if self.trades else 0.0
+
+    @property
+    def profit_factor(self):
+        return self.gross_profit / self.gross_loss if self.gross_loss else 0.0
+
+    @property
+    def time_invested(self):
+        '''The fraction of the sampled time with holdings.'''
+        if self.time is None or self.time == self.start_time:
+            return 0.0
+        return self.invested_time / (self.time - self.start_time)
+
+    @property
+    def average_exposure(self):
+        '''The time weighted gross holdings value over equity.'''
+        if self.time is None or self.time == self.start_time:
+            return 0.0
+        return self.exposure_seconds / (self.time - self.start_time).total_seconds()
+
+    def summary(self):
+        return dict(total_return=self.total_return, sharpe=self.sharpe,
+                    annual_volatility=self.returns.std * math.sqrt(self.periods_per_year),
+                    max_drawdown=self.max_drawdown, max_drawdown_duration=self.max_drawdown_duration,
+                    time_invested=self.time_invested, average_exposure=self.average_exposure,
+                    trades=self.trades, wins=self.wins, losses=self.losses, win_rate=self.win_rate,
+                    profit_factor=self.profit_factor, largest_win=self.largest_win,
+                    largest_loss=self.largest_loss, fills=self.fills, fees=self.fees)
+
+    def report(self):
+        s = self.summary()
+        return '\n'.join([
+            'return: {:.2%}  sharpe: {:.2f}  volatility: {:.2%}'.format(
+                s['total_return'], s['sharpe'], s['annual_volatility']),
+            'max drawdown: {:.2%}  longest drawdown: {}'.format(s['max_drawdown'], s['max_drawdown_duration']),
+            'time invested: {:.1%}  average exposure: {:.2f}'.format(s['time_invested'], s['average_exposure']),
+            'trades: {}  win rate: {:.1%}  profit factor: {:.2f}  largest win: {:.2f}  largest loss: {:.2f}'.format(
+                s['trades'], s['win_rate'], s['profit_factor'], s['largest_win'], s['largest_loss']),
+            'fills: {}  fees: {:.2f}'.format(s['fills'], s['fees'])])
@@ -0,0 +1,492 @@
+'''
+Asyncio ingestion of live ticks in micro-batches, with bounded queues and backpressure.
+
+Ticks are read from a socket (or replayed from a tick file) by one task and queued per
+symbol; a consumer task takes up to batch_size queued ticks of a symbol at a time and
+consolidates them with ArrayTickConsolidator.update_many, so the bar handlers and their
+indicators run once per completed bar instead of the per-tick callbacks keeping up with
+every quote of a burst. Each symbol's queue holds at most maxsize ticks, and what happens
+to a tick arriving at a full queue is the policy:
+
+    block        the reader waits for room, which stops it reading the socket and pushes
+                 back on the sender through TCP flow control
+    drop         the new tick is dropped
+    drop_oldest  the oldest queued tick is dropped
+    conflate     the new tick is merged into the newest queued one: its prices, sizes and
+                 time replace the queued ones and the traded quantity is added, so only the
+                 number of quotes changes (which moves the bars of a count consolidator)
+
+The pipeline counts the received, processed, dropped and conflated ticks and keeps
+histograms of the queue depth at each batch and of the end-to-end latency of every tick,
+from the time it was sent (or read) to the end of the batch that consolidated it.
+
+The wire format is text lines: `@<ns>` sets the send time of the lines after it, and a tick
+is `symbol,time,bid,ask,bidsize,asksize,quantity` with the time in ns since the epoch. The
+replay server streams tick files of a LocalReplay data folder in that format, at a fixed
+rate or as fast as the reader takes them:
+
+    python TickIngest.py serve ~/data/es/tick/ESM19.csv --port 7001 --rate 200000
+    python TickIngest.py ingest --port 7001 --policy conflate --queue 4096
+    python TickIngest.py load ~/data/es/tick/ESM19.csv --rate 0 --policy block
+
+load runs both in one process against a local port. ingest and load feed the bars to the
+moving average crossover of FuturesTickChartExample (fastPeriod, slowPeriod, tickLength and
+tolerance) and print the signals and metrics at the end.
+'''
+
+import argparse
+import asyncio
+import os
+import time as timer
+from collections import deque
+from itertools import groupby, repeat
+from datetime import datetime
+
+import numpy as np
+
+from ArrayTickConsolidator import ArrayTickConsolidator, for_each_bar
+from FastIndicators import SimpleMovingAverage
+from HandlerProfiler import Histogram, format_ns
+from LocalReplay import TICK_COLUMNS, read_chunks
+
+
+BLOCK = 'block'
+DROP = 'drop'
+DROP_OLDEST = 'drop_oldest'
+CONFLATE = 'conflate'
+POLICIES = (BLOCK, DROP, DROP_OLDEST, CONFLATE)
+
+# fields of a queued tick
+TIME, BID, ASK, BID_SIZE, ASK_SIZE, QUANTITY, STAMP = range(7)
+
+
+class TickQueue:
+    '''The bounded queue of a symbol's ticks and its counters.'''
+    __slots__ = ('symbol', 'ticks', 'maxsize', 'received', 'processed', 'dropped', 'conflated', 'peak', 'space')
+
+    def __init__(self, symbol, maxsize):
+        self.symbol = symbol
+        self.ticks = deque()
+        self.maxsize = maxsize
+        self.received = 0
+        self.processed = 0
+        self.dropped = 0
+        self.conflated = 0
+        self.peak = 0
+        self.space = asyncio.Event()
+        self.space.set()
+
+    def offer(self, ticks, policy, start=0):
+        '''
+        Queues ticks[start:] as the policy allows and returns how many were taken, which is
+        fewer than offered only when they have to wait for room (block).
+        '''
+        queue = self.ticks
+        count = len(ticks) - start
+        room = self.maxsize - len(queue)
+        if count <= room:
+            queue.extend(ticks[start:] if start else ticks)
+            self.received += count
+        elif policy == BLOCK:
+            queue.extend(ticks[start:start + room])
+            self.received += room
+            self.space.clear()
+            count = room
+        else:
+            self.received += count
+            extra = count - room
+            if policy == DROP:
+                queue.extend(ticks[start:start + room])
+                self.dropped += extra
+            elif policy == DROP_OLDEST:
+                queue.extend(ticks[start:])
+                for _ in range(extra):
+                    queue.popleft()
+                self.dropped += extra
+            else:
+                queue.extend(ticks[start:start + room])
+                # the newest tick takes the place of the queued one and the rest, with their
+                # quantity added and the older send time, so the latency includes the wait
+                rest = ticks[start + room:]
+                last = queue.pop() if queue else rest[0][:QUANTITY] + (0.0, rest[0][STAMP])
+                quantity = last[QUANTITY] + sum(tick[QUANTITY] for tick in rest)
+                queue.append(rest[-1][:QUANTITY] + (quantity, last[STAMP]))
+                self.conflated += extra
+        if len(queue) > self.peak:
+            self.peak = len(queue)
+        return count
+
+
+class TickPipeline:
+    '''
+    Queues ticks per symbol and consolidates them in micro-batches. consolidator(symbol) is
+    called the first time a symbol is seen and returns its ArrayTickConsolidator, with the
+    handlers already hooked; add_consolidator() sets one up front instead.
+    '''
+
+    def __init__(self, consolidator=None, maxsize=8192, batch_size=512, policy=BLOCK, clock=timer.time_ns):
+        if policy not in POLICIES:
+            raise ValueError('Unknown policy: {}'.format(policy))
+        self.factory = consolidator
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.policy = policy
+        self.clock = clock
+        self.queues = dict()            # symbol -> TickQueue
+        self.consolidators = dict()     # symbol -> ArrayTickConsolidator
+        self.latency = Histogram()      # ns from the send time of a tick to the end of its batch
+        self.depth = Histogram()        # ticks queued for the symbol at each batch
+        self.batches = 0
+        self.elapsed = 0.0
+        self._pending = None
+        self._closed = False
+
+    def add_consolidator(self, symbol, consolidator):
+        self.consolidators[symbol] = consolidator
+
+    def queue(self, symbol):
+        queue = self.queues.get(symbol)
+        if queue is None:
+            queue = self.queues[symbol] = TickQueue(symbol, self.maxsize)
+            if symbol not in self.consolidators and self.factory is not None:
+                self.consolidators[symbol] = self.factory(symbol)
+        return queue
+
+    @property
+    def queued(self):
+        return sum(len(queue.ticks) for queue in self.queues.values())
+
+    async def put_many(self, symbol, ticks):
+        '''Queues ticks of a symbol, waiting for room while the queue is full under block.'''
+        queue = self.queue(symbol)
+        taken = queue.offer(ticks, self.policy)
+        while taken < len(ticks):
+            self._pending.set()
+            await queue.space.wait()
+            taken += queue.offer(ticks, self.policy, taken)
+        self._pending.set()
+
+    async def run(self, source):
+        '''Queues the (symbol, ticks) batches of an async source and consolidates them until it ends.'''
+        self._pending = asyncio.Event()
+        self._closed = False
+        started = timer.perf_counter()
+        consumer = asyncio.ensure_future(self._consume())
+        try:
+            async for symbol, ticks in source:
+                await self.put_many(symbol, ticks)
+                # a read of buffered socket data doesn't yield, so the consumer gets its turn here
+                await asyncio.sleep(0)
+        finally:
+            self._closed = True
+            self._pending.set()
+            await consumer
+            for consolidator in self.consolidators.values():
+                consolidator.Flush()
+            self.elapsed = timer.perf_counter() - started
+
+    async def _consume(self):
+        pending = self._pending
+        while True:
+            await pending.wait()
+            pending.clear()
+            # what is queued is consolidated a batch per symbol at a time, round robin, and the
+            # reader gets a turn after every round: if the handlers fall behind, the backlog
+            # builds up in the bounded queues, where the policy applies, rather than in the
+            # socket buffers
+            busy = True
+            while busy:
+                busy = False
+                for queue in list(self.queues.values()):
+                    if queue.ticks:
+                        self._process(queue)
+                        busy = True
+                await asyncio.sleep(0)
+            if self._closed and not self.queued:
+                return
+
+    def _process(self, queue):
+        ticks = queue.ticks
+        self.depth.add(len(ticks))
+        n = min(len(ticks), self.batch_size)
+        batch = [ticks.popleft() for _ in range(n)]
+        queue.space.set()
+        queue.processed += n
+        self.batches += 1
+
+        consolidator = self.consolidators.get(queue.symbol)
+        if consolidator is not None:
+            times, bid, ask, bid_size, ask_size, quantity, stamps = zip(*batch)
+            consolidator.update_many(np.array(times, np.int64).view('datetime64[ns]'), bid, ask,
+                                     bid_size, ask_size, quantity, queue.symbol)
+            consolidator.Flush()
+        else:
+            stamps = [tick[STAMP] for tick in batch]
+
+        # the ticks of a batch share a few send times, one per block the server wrote
+        now = self.clock()
+        for stamp, same in groupby(stamps):
+            self.latency.add_repeated(max(now - stamp, 0), sum(1 for _ in same))
+
+    def report(self):
+        received = sum(q.received for q in self.queues.values())
+        processed = sum(q.processed for q in self.queues.values())
+        dropped = sum(q.dropped for q in self.queues.values())
+        conflated = sum(q.conflated for q in self.queues.values())
+        rate = processed / self.elapsed if self.elapsed else 0.0
+        lines = [
+            'ticks: {} received  {} processed  {} dropped  {} conflated  ({:,.0f} ticks/sec)'.format(
+                received, processed, dropped, conflated, rate),
+            'batches: {}  mean size {:.1f}'.format(self.batches, processed / self.batches if self.batches else 0.0),
+            'queue depth: p50 {}  p99 {}  max {}  (limit {}, {} policy)'.format(
+                self.depth.percentile(50), self.depth.percentile(99), self.depth.max, self.maxsize, self.policy),
+            'latency: p50 {}  p99 {}  p99.9 {}  max {}'.format(
+                format_ns(self.latency.percentile(50)), format_ns(self.latency.percentile(99)),
+                format_ns(self.latency.percentile(99.9)), format_ns(self.latency.max)),
+        ]
+        return '\n'.join(lines)
+
+
+# Sources
+
+def _parse(text, stamp, batches):
+    '''
+    Parses complete wire lines into per-symbol tick lists, a column at a time. Returns the
+    last send time.
+    '''
+    for i, segment in enumerate(text.split('@')):
+        if i:
+            header, _, segment = segment.partition('\n')
+            stamp = int(header)
+        lines = segment.splitlines()
+        if not lines:
+            continue
+        fields = ','.join(lines).split(',')
+        ticks = list(zip(map(int, fields[1::7]), map(float, fields[2::7]), map(float, fields[3::7]),
+                         map(float, fields[4::7]), map(float, fields[5::7]), map(float, fields[6::7]),
+                         repeat(stamp)))
+        symbols = fields[0::7]
+        if symbols[0] == symbols[-1] and symbols.count(symbols[0]) == len(symbols):
+            batches.setdefault(symbols[0], []).extend(ticks)
+        else:
+            for symbol, tick in zip(symbols, ticks):
+                batches.setdefault(symbol, []).append(tick)
+    return stamp
+
+
+async def socket_source(host, port, read_size=1 << 20):
+    '''
+    Yields (symbol, ticks) batches of what a tick server sends, one read at a time. A read
+    takes everything received since the last one, up to read_size bytes, so a backlog is
+    queued (and shed by the policy) rather than left in the socket buffers.
+    '''
+    reader, writer = await asyncio.open_connection(host, port, limit=read_size)
+    stamp = 0
+    rest = b''
+    try:
+        while True:
+            data = await reader.read(read_size)
+            if not data:
+                break
+            data = rest + data
+            cut = data.rfind(b'\n') + 1
+            rest = data[cut:]
+            batches = dict()
+            stamp = _parse(data[:cut].decode(), stamp, batches)
+            for item in batches.items():
+                yield item
+    finally:
+        writer.close()
+
+
+def _tick_blocks(path, start=None, end=None, block=1000):
+    '''The ticks of a file as (count, wire lines) blocks.'''
+    symbol = os.path.splitext(os.path.basename(path))[0]
+    for chunk in read_chunks(path, TICK_COLUMNS, start=start, end=end, chunk_size=block * 20):
+        times, bid, ask, bid_size, ask_size, last, quantity = chunk
+        columns = [list(map(str, times.tolist()))]
+        columns += [list(map(repr, c.tolist())) for c in (bid, ask, bid_size, ask_size, quantity)]
+        for i in range(0, len(times), block):
+            lines = list(map(','.join, zip(repeat(symbol), *(c[i:i + block] for c in columns))))
+            yield len(lines), ('\n'.join(lines) + '\n').encode()
+
+
+class _Pacer:
+    '''Sleeps as needed to keep a count of items to a rate per second; no limit for rate 0.'''
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.sent = 0
+        self.started = timer.perf_counter()
+
+    async def wait(self, count):
+        self.sent += count
+        if self.rate:
+            delay = self.started + self.sent / self.rate - timer.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+
+async def file_source(path, rate=0, start=None, end=None, block=1000):
+    '''Yields (symbol, ticks) batches of a tick file, read at rate ticks/sec, stamped as read.'''
+    symbol = os.path.splitext(os.path.basename(path))[0]
+    pacer = _Pacer(rate)
+    for chunk in read_chunks(path, TICK_COLUMNS, start=start, end=end, chunk_size=block * 20):
+        times, bid, ask, bid_size, ask_size, last, quantity = chunk
+        ticks = list(zip(*[c.tolist() for c in (times, bid, ask, bid_size, ask_size, quantity)]))
+        for i in range(0, len(ticks), block):
+            stamp = timer.time_ns()
+            batch = [tick + (stamp,) for tick in ticks[i:i + block]]
+            yield symbol, batch
+            await pacer.wait(len(batch))
+
+
+# Replay server
+
+async def _stream(writer, path, rate, start, end):
+    pacer = _Pacer(rate)
+    for count, lines in _tick_blocks(path, start, end):
+        writer.write(b'@%d\n' % timer.time_ns() + lines)
+        # drain() waits while the client isn't reading, so a slow reader slows the replay
+        await writer.drain()
+        await pacer.wait(count)
+
+
+async def start_server(paths, host='127.0.0.1', port=7001, rate=0, start=None, end=None):
+    '''
+    Serves the tick files to every connection, each file at rate ticks/sec (0 for as fast as
+    the client reads), and closes the connection at the end of the files.
+    '''
+    async def on_connect(reader, writer):
+        try:
+            await asyncio.gather(*[_stream(writer, path, rate, start, end) for path in paths])
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(on_connect, host, port)
+
+
+# Command line
+
+class CrossoverSignals:
+    '''The moving average crossover of FuturesTickChartExample over the consolidated bars.'''
+
+    def __init__(self, fast_period=50, slow_period=100, tolerance=0.00015, cost=0.0):
+        self.fast_period = fast_period
+        self.slow_period = slow_period
+        self.tolerance = tolerance
+        self.cost = cost            # seconds of busy work per bar, to load test a slow handler
+        self.positions = dict()
+        self.indicators = dict()
+        self.signals = []
+        self.bars = 0
+
+    def consolidator(self, tick_length):
+        '''The consolidator factory of a TickPipeline.'''
+        def create(symbol):
+            consolidator = ArrayTickConsolidator(tick_length, batch_size=64)
+            consolidator.DataConsolidated += for_each_bar(self.on_bar)
+            return consolidator
+        return create
+
+    def on_bar(self, sender, bar):
+        self.bars += 1
+        if self.cost:
+            until = timer.perf_counter() + self.cost
+            while timer.perf_counter() < until:
+                pass
+        symbol = bar.Symbol
+        if symbol not in self.indicators:
+            self.indicators[symbol] = (SimpleMovingAverage(self.fast_period), SimpleMovingAverage(self.slow_period))
+            self.positions[symbol] = 0
+        fast, slow = self.indicators[symbol]
+        fast.Update(bar.EndTime, bar.Close)
+        slow.Update(bar.EndTime, bar.Close)
+        if not slow.IsReady:
+            return
+        position = self.positions[symbol]
+        if position <= 0 and fast.Current.Value > slow.Current.Value * (1 + self.tolerance):
+            self.signals.append((bar.EndTime, symbol, 'Buy', bar.Ask.Close))
+            self.positions[symbol] = 1
+        elif position > 0 and fast.Current.Value < slow.Current.Value:
+            self.signals.append((bar.EndTime, symbol, 'Sell', bar.Bid.Close))
+            self.positions[symbol] = 0
+
+
+def _pipeline(args):
+    parameters = dict(p.split('=', 1) for p in args.param)
+    signals = CrossoverSignals(int(parameters.get('fastPeriod') or 50), int(parameters.get('slowPeriod') or 100),
+                               float(parameters.get('tolerance') or 0.00015), args.handler_cost / 1e6)
+    pipeline = TickPipeline(signals.consolidator(int(parameters.get('tickLength') or 512)),
+                            args.queue, args.batch, args.policy)
+    return pipeline, signals
+
+
+def _print_results(pipeline, signals, verbose):
+    if verbose:
+        for signal in signals.signals:
+            print('{} {} {} >> {}'.format(*signal))
+    print('bars: {}  signals: {}'.format(signals.bars, len(signals.signals)))
+    print(pipeline.report())
+
+
+async def _ingest(args):
+    pipeline, signals = _pipeline(args)
+    await pipeline.run(socket_source(args.host, args.port))
+    _print_results(pipeline, signals, args.verbose)
+
+
+async def _load(args):
+    server = await start_server(args.files, args.host, 0, args.rate, args.start, args.end)
+    port = server.sockets[0].getsockname()[1]
+    pipeline, signals = _pipeline(args)
+    async with server:
+        await pipeline.run(socket_source(args.host, port))
+    _print_results(pipeline, signals, args.verbose)
+
+
+async def _serve(args):
+    server = await start_server(args.files, args.host, args.port, args.rate, args.start, args.end)
+    print('serving {} on {}:{}'.format(', '.join(args.files), args.host, args.port))
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Ingest ticks from a socket in micro-batches, or serve tick files.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve = commands.add_parser('serve', help='stream tick files to every connection')
+    load = commands.add_parser('load', help='serve tick files and ingest them in one process')
+    ingest = commands.add_parser('ingest', help='ingest the ticks of a server')
+    for command in (serve, load):
+        command.add_argument('files', nargs='+', help='tick files, named after their symbol')
+        command.add_argument('--rate', type=float, default=0, help='ticks/sec per file, 0 for no limit')
+        command.add_argument('--start', type=datetime.fromisoformat, help='first tick time')
+        command.add_argument('--end', type=datetime.fromisoformat, help='last tick time')
+    for command in (serve, ingest, load):
+        command.add_argument('--host', default='127.0.0.1')
+    for command in (serve, ingest):
+        command.add_argument('--port', type=int, default=7001)
+    for command in (ingest, load):
+        command.add_argument('--policy', choices=POLICIES, default=BLOCK, help='what to do with a tick '
+                                                                               'arriving at a full queue')
+        command.add_argument('--queue', type=int, default=8192, help='ticks queued per symbol at most')
+        command.add_argument('--batch', type=int, default=512, help='ticks consolidated per batch at most')
+        command.add_argument('--handler-cost', type=float, default=0, metavar='US',
+                             help='busy work per bar in microseconds, to load test a slow handler')
+        command.add_argument('--param', action='append', default=[], metavar='NAME=VALUE',
+                             help='fastPeriod, slowPeriod, tickLength or tolerance')
+        command.add_argument('--verbose', action='store_true', help='print every signal')
+    args = parser.parse_args(argv)
+
+    try:
+        asyncio.run({'serve': _serve, 'ingest': _ingest, 'load': _load}[args.command](args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,322 @@
+'''
+A structured journal of a run: order events, rolls, signals and indicator snapshots, in
+typed columns written a chunk at a time, so a sweep of thousands of runs can be analyzed
+without parsing their logs.
+
+    <journal>/<run>/run.json                 run id and parameters
+    <journal>/<run>/strings.txt              the run's dictionary of symbols and names, a line each
+    <journal>/<run>/<table>/index.csv        chunk,rows,first,last,symbols of each chunk
+    <journal>/<run>/<table>/<chunk>.npz      the columns of a chunk
+
+Events are buffered per table in columns and a chunk is written every chunk_size events and
+at close(). Times are int64 ns since the epoch, and symbols and names are int32 codes into
+the run's dictionary. The tables and their columns:
+
+    orders      time symbol order_id status quantity price fee     every order event
+    rolls       time symbol previous price previous_price          front contract changes
+    signals     time symbol name value                             what the logs say BUY >> ...
+    indicators  time symbol name value                             named indicator values
+
+A journal is attached to the algorithm before Initialize, which records its order events,
+and the algorithm records the rest through journal_for(self), which returns a journal that
+records nothing when none is attached (on the platform, or in a plain replay):
+
+    self.journal = journal_for(self)                        # in Initialize
+    self.journal.signal('BUY', symbol, price)
+    self.journal.snapshot(symbol, fast=self.fast_sma, slow=self.slow_sma)
+
+LocalReplay does the attaching with --journal, and ParameterSweep for every run. Reads
+filter by run, symbol and time range, skipping the chunks the index rules out, and searching
+the time column of the others:
+
+    reader = JournalReader('~/journal')
+    fills = reader.read('orders', symbols=['ESM19'], start=datetime(2019, 4, 1))
+    frame = reader.frame('signals', runs=reader.runs()[:100])
+'''
+
+import os
+from datetime import datetime, timedelta
+
+from AlgorithmBase import np, order_fee
+
+
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+STRING = 'str'
+
+TABLES = {
+    'orders': (('time', 'i8'), ('symbol', STRING), ('order_id', 'i8'), ('status', 'i1'), ('quantity', 'f8'),
+               ('price', 'f8'), ('fee', 'f8')),
+    'rolls': (('time', 'i8'), ('symbol', STRING), ('previous', STRING), ('price', 'f8'), ('previous_price', 'f8')),
+    'signals': (('time', 'i8'), ('symbol', STRING), ('name', STRING), ('value', 'f8')),
+    'indicators': (('time', 'i8'), ('symbol', STRING), ('name', STRING), ('value', 'f8')),
+}
+
+
+def to_ns(time):
+    return (time - EPOCH) // MICROSECOND * 1000
+
+
+def _key(symbol):
+    '''The journal name of a symbol: its value, or the string given.'''
+    if symbol is None:
+        return ''
+    return getattr(symbol, 'Value', symbol)
+
+
+def _value(x):
+    '''The current value of an indicator, or x itself.'''
+    current = getattr(x, 'Current', None)
+    return float(x if current is None else current.Value)
+
+
+class NullJournal:
+    '''The journal of an algorithm that has none attached: every record is ignored.'''
+
+    def order_event(self, order_event):
+        pass
+
+    def roll(self, symbol, previous=None, price=0.0, previous_price=0.0):
+        pass
+
+    def signal(self, name, symbol=None, value=0.0):
+        pass
+
+    def snapshot(self, symbol=None, **values):
+        pass
+
+
+NULL_JOURNAL = NullJournal()
+
+
+def journal_for(algorithm):
+    '''The journal attached to an algorithm, or one that records nothing.'''
+    return getattr(algorithm, '_journal', None) or NULL_JOURNAL
+
+
+class _Table:
+    '''The buffered columns of one table and the chunks written so far.'''
+    __slots__ = ('name', 'schema', 'folder', 'columns', 'chunks')
+
+    def __init__(self, name, folder):
+        self.name = name
+        self.schema = TABLES[name]
+        self.folder = folder
+        self.columns = [[] for _ in self.schema]
+        self.chunks = 0
+
+    def __len__(self):
+        return len(self.columns[0])
+
+
+class TradeJournal(NullJournal):
+    '''
+    Writes the journal of one run, with the times of the attached algorithm. The run folder
+    must not exist yet unless overwrite is set.
+    '''
+
+    def __init__(self, folder, run, parameters=None, chunk_size=65536, overwrite=False):
+        # json and shutil are only needed by a journal that is written, not by the algorithms
+        # importing journal_for()
+        import json
+        import shutil
+
+        self.folder = os.path.join(os.path.expanduser(folder), str(run))
+        self.run = str(run)
+        self.chunk_size = chunk_size
+        self.algorithm = None
+        self.events = 0
+        if os.path.exists(self.folder):
+            if not overwrite:
+                raise FileExistsError('Journal run {} already exists in {}'.format(run, folder))
+            shutil.rmtree(self.folder)
+        os.makedirs(self.folder)
+        with open(os.path.join(self.folder, 'run.json'), 'w') as f:
+            json.dump(dict(run=self.run, parameters=parameters or dict()), f, default=str)
+        self._strings = dict()      # string -> code
+        self._written = 0           # strings already in strings.txt
+        self._tables = {name: _Table(name, os.path.join(self.folder, name)) for name in TABLES}
+
+    def attach(self, algorithm):
+        '''Records the order events of an algorithm and makes the journal its journal_for(). Returns self.'''
+        self.algorithm = algorithm
+        algorithm._journal = self
+        on_order_event = algorithm.OnOrderEvent
+
+        def OnOrderEvent(order_event):
+            self.order_event(order_event)
+            return on_order_event(order_event)
+
+        algorithm.OnOrderEvent = OnOrderEvent
+        return self
+
+    # Records
+
+    def _code(self, text):
+        code = self._strings.get(text)
+        if code is None:
+            code = self._strings[text] = len(self._strings)
+        return code
+
+    def _append(self, name, *row):
+        table = self._tables[name]
+        for column, value in zip(table.columns, row):
+            column.append(value)
+        self.events += 1
+        if len(table) >= self.chunk_size:
+            self._write(table)
+
+    def order_event(self, order_event):
+        fee = order_fee(order_event)
+        self._append('orders', to_ns(self.algorithm.Time), self._code(_key(order_event.Symbol)),
+                     order_event.OrderId, int(order_event.Status), float(order_event.FillQuantity),
+                     float(order_event.FillPrice), float(fee))
+
+    def roll(self, symbol, previous=None, price=0.0, previous_price=0.0):
+        self._append('rolls', to_ns(self.algorithm.Time), self._code(_key(symbol)), self._code(_key(previous)),
+                     float(price), float(previous_price))
+
+    def signal(self, name, symbol=None, value=0.0):
+        self._append('signals', to_ns(self.algorithm.Time), self._code(_key(symbol)), self._code(name),
+                     float(value))
+
+    def snapshot(self, symbol=None, **values):
+        '''Records named values, indicators or numbers, at the current time.'''
+        time = to_ns(self.algorithm.Time)
+        symbol = self._code(_key(symbol))
+        for name, value in values.items():
+            self._append('indicators', time, symbol, self._code(name), _value(value))
+
+    # Writing
+
+    def _write(self, table):
+        if not len(table):
+            return
+        # the strings first, so a chunk never refers to a code that isn't stored
+        if self._written < len(self._strings):
+            strings = list(self._strings)[self._written:]
+            with open(os.path.join(self.folder, 'strings.txt'), 'a') as f:
+                f.write(''.join(s.replace('\n', ' ') + '\n' for s in strings))
+            self._written = len(self._strings)
+
+        columns = dict()
+        for (name, kind), values in zip(table.schema, table.columns):
+            columns[name] = np.array(values, dtype='i4' if kind == STRING else kind)
+        os.makedirs(table.folder, exist_ok=True)
+        path = os.path.join(table.folder, '{:06d}.npz'.format(table.chunks))
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(f, **columns)
+        os.replace(path + '.tmp', path)
+        # and the index last, so readers only see complete chunks
+        times = columns['time']
+        symbols = ' '.join(str(code) for code in np.unique(columns['symbol']).tolist())
+        with open(os.path.join(table.folder, 'index.csv'), 'a') as f:
+            f.write('{},{},{},{},{}\n'.format(table.chunks, len(times), times.min(), times.max(), symbols))
+        table.chunks += 1
+        table.columns = [[] for _ in table.schema]
+
+    def flush(self):
+        '''Writes what is buffered, a chunk per table.'''
+        for table in self._tables.values():
+            self._write(table)
+
+    close = flush
+
+
+class JournalReader:
+    '''Reads the journals of the runs in a folder.'''
+
+    def __init__(self, folder):
+        self.folder = os.path.expanduser(folder)
+
+    def runs(self):
+        return sorted(name for name in os.listdir(self.folder)
+                      if os.path.exists(os.path.join(self.folder, name, 'run.json')))
+
+    def parameters(self, run):
+        import json
+
+        with open(os.path.join(self.folder, run, 'run.json')) as f:
+            return json.load(f)['parameters']
+
+    def strings(self, run):
+        path = os.path.join(self.folder, run, 'strings.txt')
+        if not os.path.exists(path):
+            return []
+        with open(path) as f:
+            return f.read().splitlines()
+
+    def chunks(self, run, table):
+        '''(chunk, rows, first, last, symbol codes) of the chunks of a run's table.'''
+        path = os.path.join(self.folder, run, table, 'index.csv')
+        if not os.path.exists(path):
+            return []
+        chunks = []
+        with open(path) as f:
+            for line in f:
+                chunk, rows, first, last, symbols = line.rstrip('\n').split(',')
+                chunks.append((int(chunk), int(rows), int(first), int(last),
+                               set(int(s) for s in symbols.split())))
+        return chunks
+
+    def read(self, table, runs=None, symbols=None, start=None, end=None, columns=None):
+        '''
+        The rows of a table as a dict of column arrays, for the given runs (all by default),
+        symbols (names or Symbols) and times in [start, end], with a run column added. The
+        symbol and name columns are decoded to strings.
+        '''
+        schema = dict(TABLES[table])
+        names = list(columns or schema)
+        lo = None if start is None else to_ns(start)
+        hi = None if end is None else to_ns(end)
+        wanted = None if symbols is None else set(_key(s) for s in symbols)
+
+        parts = {name: [] for name in names}
+        run_ids = []
+        for run in (self.runs() if runs is None else runs):
+            strings = self.strings(run)
+            codes = None
+            if wanted is not None:
+                codes = set(code for code, s in enumerate(strings) if s in wanted)
+                if not codes:
+                    continue
+            lookup = np.array(strings, dtype=object)
+            for chunk, rows, first, last, chunk_symbols in self.chunks(run, table):
+                if (lo is not None and last < lo) or (hi is not None and first > hi):
+                    continue
+                if codes is not None and not codes & chunk_symbols:
+                    continue
+                with np.load(os.path.join(self.folder, run, table, '{:06d}.npz'.format(chunk))) as data:
+                    times = data['time']
+                    # a run's events are in time order
+                    a = 0 if lo is None else np.searchsorted(times, lo, 'left')
+                    b = len(times) if hi is None else np.searchsorted(times, hi, 'right')
+                    if a >= b:
+                        continue
+                    keep = slice(a, b)
+                    if codes is not None:
+                        keep = np.arange(a, b)[np.isin(data['symbol'][a:b], list(codes))]
+                        if not len(keep):
+                            continue
+                    for name in names:
+                        values = data[name][keep]
+                        parts[name].append(lookup[values] if schema[name] == STRING else values)
+                    run_ids.append(np.full(len(parts[names[0]][-1]), run, dtype=object))
+
+        result = dict()
+        for name in names:
+            if parts[name]:
+                result[name] = np.concatenate(parts[name])
+            else:
+                result[name] = np.empty(0, dtype=object if schema[name] == STRING else schema[name])
+        result['run'] = np.concatenate(run_ids) if run_ids else np.empty(0, dtype=object)
+        return result
+
+    def frame(self, table, runs=None, symbols=None, start=None, end=None, columns=None):
+        '''read() as a pandas DataFrame, with the times as datetimes.'''
+        import pandas as pd
+        frame = pd.DataFrame(self.read(table, runs, symbols, start, end, columns))
+        if 'time' in frame:
+            frame['time'] = frame['time'].values.view('datetime64[ns]')
+        return frame
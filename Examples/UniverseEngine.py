@@ -0,0 +1,297 @@
+'''
+Bars and Bollinger bands of many futures roots in NumPy columns, a slot per root.
+
+Instead of a consolidator and a BollingerBands object per contract, the state of every root
+is kept in arrays indexed by the root's slot: the last completed bar (time, open, high, low,
+close, volume), the middle band average, the ring of the last period closes and the bands.
+A root's slot stays the same across its rolls; track() points it at the contract whose bars
+feed it and adjust() back-adjusts its bands like ContinuousFuture does.
+
+A slice only appends the bars of the tracked contracts to the block of the current bar
+period. When the period ends their prices are read into arrays in one pass, reduced into
+the bar of every slot that had data, and the bands of all the slots are updated in one
+vectorized step, so the work per slice is a lookup per tracked contract and the NumPy work
+is per period and shared by all the roots. A columnar feed can skip the bar objects with
+update_arrays():
+
+    self.engine = UniverseEngine(TimeSpan.FromMinutes(60), 20, 2)
+    self.engine.DataConsolidated += self.OnHour     # handler(engine, slots) at each period end
+    slot = self.engine.add('ES')
+    self.engine.track(slot, contract.Symbol)        # at each roll
+    self.engine.load(slot, closes)                  # warm-up
+    self.engine.update_bars(slice.Bars)             # in OnData
+    ...
+    if self.engine.is_ready(slot):
+        upper = self.engine.upper[slot]
+
+Periods are aligned like a TradeBarConsolidator's, and the bars of a period are emitted by
+the first slice that reaches its end, for every slot at once, as if the consolidators were
+scanned: a root missing the last minute of an hour still gets its bar at the end of it. The
+middle band is an EMA (or an SMA) of the closes and the width k population standard
+deviations of the last period closes, as in FastIndicators.BollingerBands.
+
+The slots of removed roots are reused and the columns grow by doubling, so adding and
+removing roots doesn't reallocate per root.
+'''
+
+from datetime import datetime, timedelta
+from operator import attrgetter
+
+from AlgorithmBase import np
+from ArrayTickConsolidator import ConsolidatedEvent
+from ConsolidationTree import TreeBar
+
+
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+FLOAT_COLUMNS = ('open', 'high', 'low', 'close', 'volume', 'average', 'std', 'middle', 'upper', 'lower')
+INT_COLUMNS = ('time', 'samples', 'index')
+
+_SYMBOL = attrgetter('Symbol')
+_OHLCV = [attrgetter(name) for name in ('Open', 'High', 'Low', 'Close', 'Volume')]
+
+
+class UniverseEngine:
+    '''
+    The bar and band columns of the roots added. period is the bar period, which must divide
+    a day; bb_period, k and exponential are those of the bands.
+    '''
+
+    def __init__(self, period=timedelta(hours=1), bb_period=20, k=2.0, exponential=True, capacity=8):
+        if timedelta(days=1) % period:
+            raise ValueError('The period {} does not divide a day'.format(period))
+        self.period = period
+        self.bb_period = bb_period
+        self.k = k
+        self.exponential = exponential
+        self._alpha = 2.0 / (bb_period + 1)
+        self.DataConsolidated = ConsolidatedEvent()
+
+        self.capacity = 0
+        self.roots = []             # slot -> root, None for a free slot
+        self.symbols = []           # slot -> the contract feeding it
+        self._slots = dict()        # root -> slot
+        self._rows = dict()         # contract symbol -> slot
+        self._tracked = []          # the symbols of _rows, for the lookups of a slice
+        self._free = []
+        self._allocate(capacity)
+
+        self._end = None            # end of the open period
+        self._block = []            # the bars of the open period
+        self._arrays = []           # blocks given as arrays by update_arrays()
+
+    def _allocate(self, capacity):
+        '''Grows the columns to capacity slots, keeping their values.'''
+        for name in FLOAT_COLUMNS + INT_COLUMNS:
+            column = np.zeros(capacity, dtype=np.float64 if name in FLOAT_COLUMNS else np.int64)
+            if self.capacity:
+                column[:self.capacity] = getattr(self, name)
+            setattr(self, name, column)
+        window = np.zeros((capacity, self.bb_period))
+        if self.capacity:
+            window[:self.capacity] = self.window
+        self.window = window
+        self.roots.extend([None] * (capacity - self.capacity))
+        self.symbols.extend([None] * (capacity - self.capacity))
+        self.capacity = capacity
+
+    # Slots
+
+    def add(self, root):
+        '''The slot of a root, given one if it has none.'''
+        slot = self._slots.get(root)
+        if slot is not None:
+            return slot
+        if self._free:
+            slot = self._free.pop()
+        else:
+            slot = len(self._slots)
+            if slot == self.capacity:
+                self._allocate(2 * self.capacity)
+        self._reset(slot)
+        self.roots[slot] = root
+        self._slots[root] = slot
+        return slot
+
+    def remove(self, root):
+        '''Frees the slot of a root, dropping its state.'''
+        slot = self._slots.pop(root, None)
+        if slot is None:
+            return
+        self.track(slot, None)
+        self.roots[slot] = None
+        self._free.append(slot)
+
+    def slot(self, root):
+        return self._slots[root]
+
+    def track(self, slot, symbol):
+        '''
+        Feeds a slot with the bars of symbol from now on. The bars of the previous contract in
+        the open period are dropped, and the bands carry on (see adjust()).
+        '''
+        previous = self.symbols[slot]
+        if previous is not None:
+            del self._rows[previous]
+            self._block = [bar for bar in self._block if bar.Symbol != previous]
+            self._arrays = [block[block[:, 0] != slot] for block in self._arrays]
+        self.symbols[slot] = symbol
+        if symbol is not None:
+            self._rows[symbol] = slot
+        self._tracked = list(self._rows)
+
+    def _reset(self, slot):
+        for name in FLOAT_COLUMNS + INT_COLUMNS:
+            getattr(self, name)[slot] = 0
+        self.window[slot] = 0.0
+
+    def is_ready(self, slot):
+        return bool(self.samples[slot] >= self.bb_period)
+
+    @property
+    def ready(self):
+        '''Whether the bands of each slot are ready, as an array.'''
+        return self.samples >= self.bb_period
+
+    def bar(self, slot):
+        '''The last completed bar of a slot.'''
+        end = EPOCH + timedelta(microseconds=int(self.time[slot]) // 1000)
+        return TreeBar(self.symbols[slot], end - self.period, end, float(self.open[slot]), float(self.high[slot]),
+                       float(self.low[slot]), float(self.close[slot]), float(self.volume[slot]))
+
+    # Data
+
+    def update_bars(self, bars):
+        '''Adds the bars of a slice, a dictionary of bars by symbol like slice.Bars.'''
+        new = [bars[symbol] for symbol in self._tracked if symbol in bars]
+        if new:
+            bar = new[0]
+            self._add(bar.Time, bar.EndTime, self._block, new)
+
+    def update_arrays(self, slots, start, end, open, high, low, close, volume):
+        '''Adds a time step of bars given as arrays by slot, all starting at start and ending at end.'''
+        block = np.column_stack((np.asarray(slots, dtype=np.float64), open, high, low, close, volume))
+        if len(block):
+            self._add(start, end, self._arrays, [block])
+
+    def _add(self, start, end, buffer, rows):
+        # a step in a later period ends the open one first
+        if self._end is not None and start >= self._end:
+            self._flush()
+        if self._end is None:
+            bucket = start - (start - datetime.min) % self.period
+            self._end = bucket + self.period
+        buffer.extend(rows)
+        if end >= self._end:
+            self._flush()
+
+    def scan(self, time):
+        '''Emits the bars of the open period once time has reached its end.'''
+        if self._end is not None and time >= self._end:
+            self._flush()
+
+    def _flush(self):
+        end = self._end
+        self._end = None
+        blocks = self._arrays
+        bars = self._block
+        if bars:
+            # a column at a time, faster than an array of (open, ..., volume) tuples
+            n = len(bars)
+            slots = np.fromiter(map(self._rows.__getitem__, map(_SYMBOL, bars)), np.float64, n)
+            blocks.append(np.column_stack([slots] + [np.fromiter(map(get, bars), np.float64, n) for get in _OHLCV]))
+        self._block = []
+        self._arrays = []
+        if not blocks:
+            return
+        data = np.concatenate(blocks) if len(blocks) > 1 else blocks[0]
+
+        # the rows of each slot together, in the order they came
+        order = np.argsort(data[:, 0], kind='stable')
+        data = data[order]
+        rows = data[:, 0].astype(np.intp)
+        first = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+        last = np.r_[first[1:], len(rows)] - 1
+        slots = rows[first]
+
+        self.time[slots] = (end - EPOCH) // MICROSECOND * 1000
+        self.open[slots] = data[first, 1]
+        self.high[slots] = np.maximum.reduceat(data[:, 2], first)
+        self.low[slots] = np.minimum.reduceat(data[:, 3], first)
+        close = self.close[slots] = data[last, 4]
+        self.volume[slots] = np.add.reduceat(data[:, 5], first)
+        self._update_bands(slots, close)
+        self.DataConsolidated(self, slots)
+
+    # Bands
+
+    def _update_bands(self, slots, values):
+        samples = self.samples[slots]
+        if self.exponential:
+            alpha = self._alpha
+            # the first value of an EMA is the value itself
+            self.average[slots] = np.where(samples == 0, values, values * alpha + self.average[slots] * (1.0 - alpha))
+        index = self.index[slots]
+        self.window[slots, index] = values
+        self.index[slots] = (index + 1) % self.bb_period
+        self.samples[slots] = samples + 1
+        self._bands(slots)
+
+    def _bands(self, slots):
+        '''Computes the bands of slots from their windows and averages.'''
+        n = np.minimum(self.samples[slots], self.bb_period)
+        window = self.window[slots]
+        # a window that hasn't wrapped yet is filled from its start
+        filled = np.arange(self.bb_period) < n[:, None]
+        mean = np.where(filled, window, 0.0).sum(axis=1) / n
+        deviations = np.where(filled, window - mean[:, None], 0.0)
+        std = np.sqrt((deviations * deviations).sum(axis=1) / n)
+        middle = self.average[slots] if self.exponential else mean
+        if not self.exponential:
+            self.average[slots] = mean
+        width = self.k * std
+        self.std[slots] = std
+        self.middle[slots] = middle
+        self.upper[slots] = middle + width
+        self.lower[slots] = middle - width
+
+    def values(self, slot):
+        '''The window of a slot, oldest first.'''
+        n = min(int(self.samples[slot]), self.bb_period)
+        if n < self.bb_period:
+            return self.window[slot, :n].copy()
+        return np.roll(self.window[slot], -int(self.index[slot]))
+
+    def load(self, slot, values):
+        '''Updates the bands of a slot with a series of closes at once, for a warm-up.'''
+        values = np.asarray(values, dtype=np.float64)
+        n = len(values)
+        if n == 0:
+            return self.is_ready(slot)
+        if self.exponential:
+            k = self._alpha
+            if self.samples[slot] == 0:
+                seed, rest = values[0], values[1:]
+            else:
+                seed, rest = self.average[slot], values
+            # as ExponentialMovingAverage.update_many
+            decay = (1.0 - k) ** np.arange(len(rest), -1, -1, dtype=np.float64)
+            self.average[slot] = float(seed * decay[0] + k * (decay[1:] @ rest))
+        tail = np.concatenate((self.values(slot), values))[-self.bb_period:]
+        self.window[slot, :len(tail)] = tail
+        self.index[slot] = len(tail) % self.bb_period
+        self.samples[slot] += n
+        self._bands(np.array([slot]))
+        return self.is_ready(slot)
+
+    def adjust(self, slot, factor=1.0, offset=0.0):
+        '''Rewrites the state of a slot as if every past close x had been x * factor + offset.'''
+        n = min(int(self.samples[slot]), self.bb_period)
+        if n == 0:
+            return
+        self.window[slot, :n] = self.window[slot, :n] * factor + offset
+        self.average[slot] = self.average[slot] * factor + offset
+        for column in (self.open, self.high, self.low, self.close):
+            column[slot] = column[slot] * factor + offset
+        self._bands(np.array([slot]))
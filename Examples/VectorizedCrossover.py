@@ -0,0 +1,318 @@
+'''
+Vectorized moving average crossover backtests over whole arrays.
+
+The crossover examples (BasicTemplateFuturesAlgorithm, FuturesMovingAverageCrossOverExample2
+and FuturesTickChartExample) all run the same long only rule on each consolidated bar:
+
+    if holdings <= 0 and fast > slow * (1 + tolerance):    buy
+    if holdings > 0 and fast < slow:                       sell
+
+Since an entry and an exit can't both hold on a bar, the position after each bar is a latch
+set by the last entry signal and reset by the last exit signal, which is a running maximum
+of their bar indices. The indicators, the signals, the positions, the trades and the
+profit of a whole series then take a few NumPy passes instead of a Python call per bar:
+
+    result = backtest(closes, 18, 50, allowed=times >= start)
+    result.net_profit, result.trades
+
+The indicators follow FastIndicators: a simple average is the mean of the samples so far
+until it has period of them, and an exponential average starts at its first sample.
+screen() runs a grid of periods over the same series, reusing the averages.
+CrossoverParity checks the results against the event driven examples trade for trade.
+'''
+
+import math
+
+import numpy as np
+
+
+SMA = 'sma'
+EMA = 'ema'
+
+# the largest growth of a**-m within a block of the linear recurrence
+BLOCK_RANGE = 1e12
+
+
+def sma(values, period):
+    '''The simple moving average after each sample, over the samples so far until there are period.'''
+    values = np.asarray(values, dtype=np.float64)
+    n = len(values)
+    if n == 0:
+        return values.copy()
+    # running sums restart every period values, so a window sum only adds up to two blocks
+    # and its rounding error stays that of one window
+    blocks = -(-n // period)
+    padded = np.zeros(blocks * period)
+    padded[:n] = values
+    sums = np.cumsum(padded.reshape(blocks, period), axis=1)
+    totals = sums[:, -1]
+    sums = sums.reshape(-1)[:n]
+    averages = np.empty(n)
+    head = min(period, n)
+    averages[:head] = sums[:head] / np.arange(1, head + 1)
+    if n > period:
+        index = np.arange(period, n)
+        averages[period:] = (sums[period:] + (totals[index // period - 1] - sums[:n - period])) / period
+    return averages
+
+
+def linear_recurrence(b, a, y0=0.0):
+    '''
+    y[t] = a * y[t-1] + b[t] with y[-1] = y0, for 0 <= a < 1. The series is cut into blocks
+    short enough for a**-m to stay in range, each block is a cumulative sum, and the values
+    carried from block to block are the same recurrence over the block ends.
+    '''
+    b = np.asarray(b, dtype=np.float64)
+    n = len(b)
+    if n == 0:
+        return b.copy()
+    if a <= 0.0:
+        return b.copy()
+    size = n if a == 1.0 else max(2, min(n, int(math.log(BLOCK_RANGE) / -math.log(a))))
+    blocks = -(-n // size)
+    padded = np.zeros(blocks * size)
+    padded[:n] = b
+    padded = padded.reshape(blocks, size)
+
+    steps = np.arange(size, dtype=np.float64)
+    growth = a ** steps
+    local = np.cumsum(padded / growth, axis=1) * growth
+    # the value carried into each block: carry[j] = a**size * carry[j-1] + local[j-1, -1]
+    decay = a * growth[-1]
+    carry = np.empty(blocks)
+    carry[0] = y0
+    if blocks > 1:
+        carry[1:] = linear_recurrence(local[:-1, -1], decay, y0 * decay)
+    y = local + carry[:, None] * (a * growth)
+    return y.reshape(-1)[:n]
+
+
+def ema(values, period):
+    '''The exponential moving average after each sample, starting at the first sample.'''
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) == 0:
+        return values.copy()
+    k = 2.0 / (period + 1)
+    b = values * k
+    b[0] = values[0]
+    return linear_recurrence(b, 1.0 - k)
+
+
+def moving_average(values, period, kind=SMA):
+    if kind == SMA:
+        return sma(values, period)
+    if kind == EMA:
+        return ema(values, period)
+    raise ValueError('kind must be {} or {}'.format(SMA, EMA))
+
+
+def latch(enter, exit, flat_after=None):
+    '''
+    1 after the bars where the position is long, else 0. A position opens on an entry bar,
+    closes on an exit bar and is closed after the bars of flat_after (a boolean mask).
+    '''
+    n = len(enter)
+    index = np.arange(n)
+    reset = exit if flat_after is None else exit | flat_after
+    last_enter = np.maximum.accumulate(np.where(enter, index, -1))
+    last_reset = np.maximum.accumulate(np.where(reset, index, -1))
+    return (last_enter > last_reset).astype(np.int8)
+
+
+class CrossoverResult:
+    '''
+    The averages and the position at each evaluated bar, and the trades: arrays of the bar
+    index, signed quantity and price of every fill, entries and exits alternating.
+    '''
+
+    def __init__(self, fast, slow, position, trade_index, trade_quantity, trade_price, trade_flat, multiplier, fee):
+        self.fast = fast
+        self.slow = slow
+        self.position = position
+        self.trade_index = trade_index
+        self.trade_quantity = trade_quantity
+        self.trade_price = trade_price
+        self.trade_flat = trade_flat        # True for the exits of flat_after
+        self.multiplier = multiplier
+        self.fee = fee
+
+    @property
+    def trades(self):
+        '''(bar index, quantity, price) of every fill.'''
+        return list(zip(self.trade_index.tolist(), self.trade_quantity.tolist(), self.trade_price.tolist()))
+
+    @property
+    def round_trips(self):
+        return len(self.trade_index) // 2
+
+    @property
+    def fees(self):
+        return self.fee * float(np.abs(self.trade_quantity).sum())
+
+    @property
+    def profits(self):
+        '''The profit of each closed round trip, before fees.'''
+        closed = self.round_trips * 2
+        return (self.trade_price[1:closed:2] - self.trade_price[:closed:2]) * \
+            self.trade_quantity[:closed:2] * self.multiplier
+
+    @property
+    def net_profit(self):
+        '''The realized profit after the fees of every fill, like TotalNetProfit.'''
+        return float(self.profits.sum()) - self.fees
+
+    def equity(self, closes, cash=0.0):
+        '''cash plus the realized profit and the open profit at each evaluated bar's close.'''
+        closes = np.asarray(closes, dtype=np.float64)
+        n = len(closes)
+        flows = np.zeros(n)
+        np.add.at(flows, self.trade_index, -self.fee * np.abs(self.trade_quantity))
+        closed = self.round_trips * 2
+        np.add.at(flows, self.trade_index[1:closed:2], self.profits)
+
+        entries = self.trade_index[0::2]
+        exits = np.full(len(entries), n)
+        exits[:closed // 2] = self.trade_index[1:closed:2]
+        bars = np.arange(n)
+        trip = np.searchsorted(entries, bars, 'right') - 1
+        held = (trip >= 0) & (bars < exits[np.maximum(trip, 0)])
+        trip = trip[held]
+        open_profit = np.zeros(n)
+        open_profit[held] = (closes[held] - self.trade_price[0::2][trip]) * \
+            self.trade_quantity[0::2][trip] * self.multiplier
+        return cash + np.cumsum(flows) + open_profit
+
+
+def crossover(fast, slow, buy, sell, tolerance=0.0, allowed=None, ready=None, flat_after=None,
+              flat_price=None, quantity=1, fraction=None, cash=100000.0, multiplier=1.0, leverage=1.0, fee=0.0):
+    '''
+    Applies the crossover rule to the fast and slow averages at each evaluated bar.
+
+    buy and sell are the fill prices of each bar. Orders only fill where allowed (after the
+    warm-up period), and nothing is traded where ready is False. flat_after closes the
+    position after the given bars at flat_price, as a futures roll does. Each entry buys
+    quantity, or with fraction the whole number of units fraction of the equity buys, like
+    SetHoldings.
+    '''
+    n = len(fast)
+    enter = fast > slow * (1.0 + tolerance)
+    exit = fast < slow
+    for mask in (ready, allowed):
+        if mask is not None:
+            mask = np.asarray(mask, dtype=bool)
+            enter &= mask
+            exit &= mask
+    if flat_after is not None:
+        flat_after = np.asarray(flat_after, dtype=bool)
+    position = latch(enter, exit, flat_after)
+
+    before = np.r_[False, position[:-1].astype(bool)]
+    entries = enter & ~before
+    exits = exit & before
+    exit_index = np.flatnonzero(exits)
+    exit_price = np.asarray(sell, dtype=np.float64)[exit_index]
+    exit_flat = np.zeros(len(exit_index), dtype=bool)
+    if flat_after is not None:
+        # a roll closes what the bar's handler left open, an entry on the same bar included
+        flats = flat_after & (entries | (before & ~exits))
+        exit_index = np.flatnonzero(exits | flats)
+        exit_flat = flats[exit_index]
+        if flat_price is None:
+            flat_price = sell
+        flat_price = np.broadcast_to(np.asarray(flat_price, dtype=np.float64), (n,))
+        exit_price = np.where(exit_flat, flat_price[exit_index], np.asarray(sell, dtype=np.float64)[exit_index])
+    entry_index = np.flatnonzero(entries)
+
+    index = np.empty(len(entry_index) + len(exit_index), dtype=np.int64)
+    index[0::2] = entry_index
+    index[1::2] = exit_index
+    price = np.empty(len(index))
+    price[0::2] = np.asarray(buy, dtype=np.float64)[entry_index]
+    price[1::2] = exit_price
+    flat = np.zeros(len(index), dtype=bool)
+    flat[1::2] = exit_flat
+
+    if fraction is None:
+        sizes = np.full(len(entry_index), int(quantity), dtype=np.int64)
+    else:
+        sizes = _sizes(price, fraction, cash, multiplier, leverage, fee)
+    signed = np.empty(len(index), dtype=np.int64)
+    signed[0::2] = sizes
+    signed[1::2] = -sizes[:len(exit_index)]
+    # an entry too small to buy a unit doesn't trade
+    keep = np.repeat(sizes != 0, 2)[:len(index)]
+    return CrossoverResult(fast, slow, position, index[keep], signed[keep], price[keep], flat[keep], multiplier, fee)
+
+
+def _sizes(price, fraction, cash, multiplier, leverage, fee):
+    '''The quantity of each entry, from the cash left by the round trips before it.'''
+    entries = price[0::2].tolist()
+    exits = price[1::2].tolist()
+    sizes = []
+    for i, entry in enumerate(entries):
+        unit = entry * multiplier / leverage
+        size = int(cash * fraction / unit) if unit else 0
+        sizes.append(size)
+        if i < len(exits):
+            cash += (exits[i] - entry) * size * multiplier - 2 * fee * size
+    return np.array(sizes, dtype=np.int64)
+
+
+def backtest(values, fast_period, slow_period, fast_kind=SMA, slow_kind=SMA, at=None, buy=None, sell=None,
+             require_ready=False, samples=0, **kwargs):
+    '''
+    Backtests the crossover rule over values, the series the averages are updated with.
+
+    at are the indices of the values after which the rule is evaluated (every value by
+    default), and buy and sell the fill prices there (the values by default).
+    require_ready skips the bars where an average has fewer than its period of samples,
+    counting samples taken before the series. The other arguments are crossover()'s.
+    '''
+    values = np.asarray(values, dtype=np.float64)
+    fast = moving_average(values, fast_period, fast_kind)
+    slow = moving_average(values, slow_period, slow_kind)
+    counts = np.arange(1, len(values) + 1) + samples
+    if at is not None:
+        at = np.asarray(at, dtype=np.int64)
+        fast, slow, values, counts = fast[at], slow[at], values[at], counts[at]
+    ready = counts >= max(fast_period, slow_period) if require_ready else None
+    return crossover(fast, slow, buy=values if buy is None else buy, sell=values if sell is None else sell,
+                     ready=ready, **kwargs)
+
+
+def screen(values, fast_periods, slow_periods, fast_kind=SMA, slow_kind=SMA, **kwargs):
+    '''
+    Backtests every pair of a fast and a slower period over the same series, computing each
+    average once. Takes backtest()'s arguments and returns (fast, slow, net profit, round
+    trips) rows, the most profitable first.
+    '''
+    values = np.asarray(values, dtype=np.float64)
+    at = kwargs.pop('at', None)
+    require_ready = kwargs.pop('require_ready', False)
+    samples = kwargs.pop('samples', 0)
+    counts = np.arange(1, len(values) + 1) + samples
+    closes = values
+    if at is not None:
+        at = np.asarray(at, dtype=np.int64)
+        counts, closes = counts[at], values[at]
+    kwargs.setdefault('buy', closes)
+    kwargs.setdefault('sell', closes)
+
+    averages = dict()
+
+    def average(period, kind):
+        if (period, kind) not in averages:
+            series = moving_average(values, period, kind)
+            averages[(period, kind)] = series if at is None else series[at]
+        return averages[(period, kind)]
+
+    rows = []
+    for slow in slow_periods:
+        for fast in fast_periods:
+            if fast >= slow:
+                continue
+            ready = counts >= slow if require_ready else None
+            result = crossover(average(fast, fast_kind), average(slow, slow_kind), ready=ready, **kwargs)
+            rows.append((fast, slow, result.net_profit, result.round_trips))
+    rows.sort(key=lambda row: -row[2])
+    return rows